@@ -80,5 +80,6 @@ setup(
         "dev": ["nose", "flake8"],
         "test": ["nose", "flake8"],
         "gdal": ["GDAL", "Shapely>=1.5.13"],
+        "columnar": ["numpy>=1.13"],
     },
 )
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Dataset, Release, SimpleTable, FieldTable, DBTable, FieldTableRelease, SimpleTableRelease
+from .models import (
+    Dataset, Release, SimpleTable, FieldTable, DBTable, FieldTableRelease, SimpleTableRelease, DerivedIndicator)
 
 
 admin.site.register(DBTable)
@@ -28,7 +29,7 @@ class FieldTableAdmin(admin.ModelAdmin):
             'fields': ('dataset', 'universe', 'fields', 'description')
         }),
         ('Advanced', {
-            'fields': ('name', 'stat_type', 'value_type', 'denominator_key', 'has_total'),
+            'fields': ('name', 'stat_type', 'value_type', 'denominator_key', 'has_total', 'engine'),
             'classes': ('collapse', ),
         })
     )
@@ -40,11 +41,17 @@ class SimpleTableReleaseInline(admin.StackedInline):
     extra = 0
 
 
+class DerivedIndicatorInline(admin.StackedInline):
+    model = DerivedIndicator
+    fields = ('name', 'expression', 'description')
+    extra = 0
+
+
 @admin.register(SimpleTable)
 class SimpleTableAdmin(admin.ModelAdmin):
     list_display = ('name', 'dataset', 'universe')
     list_filter = ('dataset', 'universe')
-    inlines = (SimpleTableReleaseInline, )
+    inlines = (SimpleTableReleaseInline, DerivedIndicatorInline)
     fieldsets = (
         (None, {
             'fields': ('name', 'dataset', 'universe', 'description'),
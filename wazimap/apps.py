@@ -1,6 +1,7 @@
 from importlib import import_module
 import logging
 import os.path
+import time
 
 from django.apps import AppConfig, apps as django_apps
 
@@ -11,16 +12,24 @@ class WazimapConfig(AppConfig):
     log = logging.getLogger(__name__)
 
     def ready(self):
-        self.check_gdal()
-        self.load_tables()
+        # log how long each step takes, to keep startup fast
+        timings = []
+        for name, step in [('gdal', self.check_gdal), ('tables', self.load_tables)]:
+            start = time.time()
+            step()
+            timings.append((name, time.time() - start))
+
+        self.log.info("Wazimap started in %.3fs (%s)" % (
+            sum(t for _, t in timings), ', '.join('%s %.3fs' % t for t in timings)))
 
     def check_gdal(self):
         # GDAL is difficult to install, so we make it an optional dependency.
-        # Here, we check if it's installed and warn if it isn't.
+        # Here, we check if it's installed and warn if it isn't. It's slow to
+        # import, so it's only imported when it's used.
         from wazimap.geo import HAS_GDAL, gdal_missing
         if HAS_GDAL:
-            import osgeo.gdal
-            self.log.info("Wazimap found GDAL version %s" % (osgeo.gdal.VersionInfo("RELEASE_NAME")))
+            # the version is logged when GDAL is first imported, by downloads
+            self.log.info("Wazimap found GDAL")
         else:
             gdal_missing()
 
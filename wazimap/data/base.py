@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import threading
+
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from wazimap.data.utils import _metadata
 
@@ -9,8 +12,117 @@ class Base(object):
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
-                           ', '.join(['%s="%s"' % (c.name, getattr(self, c.name))
-                                      for c in self.__table__.columns]))
+                           ', '.join(['%s="%s"' % (p.key, getattr(self, p.key))
+                                      for p in self.__mapper__.column_attrs]))
+
+
+Base = declarative_base(cls=Base, metadata=_metadata)
+
+
+class ModelRegistry(object):
+    """ A thread-safe cache of SQLAlchemy models for database tables, keyed by table name.
+
+    If +max_size+ is set, the least recently used models are evicted when there are more
+    than +max_size+ models. Evicting a model also removes its table from +metadata+,
+    so that it can be garbage collected once it's no longer in use.
+    """
+    def __init__(self, metadata, max_size=None):
+        self.metadata = metadata
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        # per-table locks, held while a model is being created
+        self._creating = {}
+
+    def get(self, name):
+        """ The model for table +name+, or None.
+        """
+        with self._lock:
+            model = self.models.get(name)
+            if model is not None:
+                self.models.move_to_end(name)
+            return model
+
+    def get_or_create(self, name, factory):
+        """ The model for table +name+, calling +factory+ to create it if necessary.
+
+        If two threads ask for the same missing model at the same time, only one of
+        them calls +factory+.
+        """
+        with self._lock:
+            model = self.models.get(name)
+            if model is not None:
+                self.hits += 1
+                self.models.move_to_end(name)
+                return model
+
+            self.misses += 1
+            lock = self._creating.setdefault(name, threading.Lock())
+
+        try:
+            with lock:
+                # another thread may have created it while we waited
+                model = self.get(name)
+                if model is None:
+                    model = factory()
+                    self[name] = model
+        finally:
+            with self._lock:
+                self._creating.pop(name, None)
+
+        return model
+
+    def __setitem__(self, name, model):
+        with self._lock:
+            old = self.models.get(name)
+            if old is not None and old is not model:
+                self._remove_table(old)
+
+            self.models[name] = model
+            self.models.move_to_end(name)
+
+            while self.max_size is not None and len(self.models) > self.max_size:
+                evicted, evicted_model = self.models.popitem(last=False)
+                self._remove_table(evicted_model)
+                self.evictions += 1
+
+    def __contains__(self, name):
+        return name in self.models
+
+    def __len__(self):
+        return len(self.models)
+
+    def evict(self, name):
+        """ Remove the model for table +name+, if there is one. Returns the model.
+        """
+        with self._lock:
+            model = self.models.pop(name, None)
+            if model is not None:
+                self._remove_table(model)
+                self.evictions += 1
+            return model
+
+    def clear(self):
+        with self._lock:
+            for name in list(self.models.keys()):
+                self.evict(name)
 
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self.models),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
 
-Base = declarative_base(cls=Base, metadata=_metadata)
\ No newline at end of file
+    def _remove_table(self, model):
+        table = getattr(model, '__table__', None)
+        # models for tables keyed by geo_id are mapped to a join, see `wazimap.data.geokeys`
+        table = getattr(table, 'left', table)
+        if table is not None and self.metadata.tables.get(table.key) is table:
+            self.metadata.remove(table)
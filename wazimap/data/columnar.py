@@ -0,0 +1,242 @@
+"""
+Columnar in-memory engine for FieldTable data.
+
+FieldTables with ``engine`` set to ``columnar`` are loaded into NumPy arrays
+the first time they're used, and stats are then calculated in memory rather
+than by the database. This suits read-mostly releases that are used heavily.
+
+Each field column is dictionary-encoded: its distinct values are ordered as the
+database orders them, and each row stores the index of its value. Rows are
+sorted by geography, with an index of the offsets of each geography's rows.
+
+Loaded tables are kept for ``WAZIMAP['columnar_table_ttl']`` seconds, so other
+processes pick up reloaded data within that time.
+
+NumPy is required, install it with ``pip install wazimap[columnar]``.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+from sqlalchemy import func
+
+from wazimap.data.deferred import StatRow
+from wazimap.data.utils import get_session, STREAM_BATCH_SIZE
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+class ColumnarTable(object):
+    """ The data of a FieldTable release, held in NumPy arrays.
+    """
+
+    def __init__(self, table, db_table):
+        if not HAS_NUMPY:
+            raise ImportError("The columnar engine needs NumPy. Install it with: pip install wazimap[columnar]")
+
+        self.table = table
+        self.db_table = db_table
+        self.integer = table.value_type == table.INTEGER
+        self.load()
+        self.loaded_at = time.time()
+
+    def load(self):
+        model = self.db_table.model
+        fields = self.table.fields
+
+        session = get_session()
+        try:
+            # the distinct values of each field, in database order
+            self.values = {}
+            self.codes_for = {}
+            for f in fields:
+                col = getattr(model, f)
+                values = [r[0] for r in session.query(col).distinct().order_by(col)]
+                self.values[f] = values
+                self.codes_for[f] = dict((v, i) for i, v in enumerate(values))
+
+            count = session.query(func.count()).select_from(model).scalar()
+            self.codes = dict((f, np.zeros(count, dtype=np.int32)) for f in fields)
+            self.total = np.zeros(count, dtype=np.int64 if self.integer else np.float64)
+            self.null = np.zeros(count, dtype=bool)
+            # (geo_level, geo_code, geo_version) -> (start, end)
+            self.index = {}
+
+            rows = (
+                session.query(model.geo_level, model.geo_code, model.geo_version, model.total,
+                              *[getattr(model, f) for f in fields])
+                .select_from(model)
+                .order_by(model.geo_level, model.geo_code, model.geo_version)
+                .yield_per(STREAM_BATCH_SIZE)
+            )
+
+            key = None
+            start = 0
+            for i, row in enumerate(rows):
+                row_key = (row[0], row[1], row[2])
+                if row_key != key:
+                    if key is not None:
+                        self.index[key] = (start, i)
+                    key = row_key
+                    start = i
+
+                if row[3] is None:
+                    self.null[i] = True
+                else:
+                    self.total[i] = row[3]
+
+                for j, f in enumerate(fields):
+                    self.codes[f][i] = self.codes_for[f][row[4 + j]]
+
+            if key is not None:
+                self.index[key] = (start, count)
+        finally:
+            session.close()
+
+    def encode(self, field, values):
+        """ Codes for +values+ of +field+, ignoring unknown values.
+        """
+        codes = self.codes_for[field]
+        return [codes[v] for v in values if v in codes]
+
+    def rows_for_geo(self, geo, fields=None, order_by=None, only=None, exclude=None):
+        """ Rows for +geo+, like those returned by `FieldTable.get_rows_for_geo`.
+
+        Rows are summed over the total column and grouped by +fields+, after filtering by +only+ and
+        +exclude+. They are ordered by +order_by+, or by the field values if it is None.
+        """
+        fields = fields or self.table.fields
+        start, end = self.index.get((geo.geo_level, geo.geo_code, geo.version), (0, 0))
+        if start == end:
+            return []
+
+        mask = np.ones(end - start, dtype=bool)
+        for k, v in (only or {}).items():
+            mask &= np.isin(self.codes[k][start:end], self.encode(k, v))
+        for k, v in (exclude or {}).items():
+            mask &= ~np.isin(self.codes[k][start:end], self.encode(k, v))
+
+        if not mask.any():
+            return []
+
+        codes = np.stack([self.codes[f][start:end][mask] for f in fields], axis=1)
+        total = self.total[start:end][mask]
+        valid = ~self.null[start:end][mask]
+
+        # group by the field codes, which sorts the groups by field values
+        groups, inverse = np.unique(codes, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        sums = np.zeros(len(groups), dtype=total.dtype)
+        np.add.at(sums, inverse[valid], total[valid])
+        # SUM is null if all values are null
+        counts = np.bincount(inverse[valid], minlength=len(groups))
+
+        order = np.arange(len(groups))
+        if order_by:
+            is_desc = order_by[0] == '-'
+            attr = order_by.lstrip('-')
+
+            if attr == 'total':
+                # nulls sort last, or first when descending
+                nulls = counts == 0
+                if is_desc:
+                    order = np.lexsort((-sums, ~nulls))
+                else:
+                    order = np.lexsort((sums, nulls))
+            else:
+                col = groups[:, fields.index(attr)]
+                order = np.argsort(-col if is_desc else col, kind='stable')
+
+        convert = int if self.integer else float
+        rows = []
+        for i in order:
+            total = convert(sums[i]) if counts[i] else None
+            values = dict((f, self.values[f][groups[i][j]]) for j, f in enumerate(fields))
+            rows.append(StatRow(total, **values))
+
+        return rows
+
+
+class ColumnarCache(object):
+    """ Loaded columnar tables, by database table name.
+
+    Tables are reloaded once they're older than ``WAZIMAP['columnar_table_ttl']``
+    seconds, so that processes pick up data loaded by other processes, such as
+    management commands. `evict` only affects the current process.
+
+    Only one thread loads each table. While an expired table is reloaded, other
+    threads keep using it rather than waiting.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self._lock = threading.Lock()
+        # per-table locks, held while a table is being loaded
+        self._loading = {}
+        # incremented when a table is evicted, so that loads started before then aren't kept
+        self._generations = {}
+
+    def expired(self, columnar):
+        ttl = settings.WAZIMAP.get('columnar_table_ttl')
+        return ttl is not None and time.time() - columnar.loaded_at >= ttl
+
+    def get(self, table, db_table):
+        name = db_table.name
+
+        columnar = self.tables.get(name)
+        if columnar is not None and not self.expired(columnar):
+            return columnar
+
+        with self._lock:
+            lock = self._loading.setdefault(name, threading.Lock())
+            generation = self._generations.get(name, 0)
+
+        # serve the expired table if another thread is already reloading it
+        if not lock.acquire(blocking=columnar is None):
+            return columnar
+
+        try:
+            loaded = self.tables.get(name)
+            if loaded is not None and not self.expired(loaded):
+                # another thread loaded it while we waited
+                return loaded
+
+            loaded = ColumnarTable(table, db_table)
+            with self._lock:
+                if self._generations.get(name, 0) == generation:
+                    self.tables[name] = loaded
+            return loaded
+        finally:
+            lock.release()
+
+    def evict(self, name):
+        with self._lock:
+            self.tables.pop(name, None)
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+
+columnar_tables = ColumnarCache()
+
+
+def get_columnar_table(table, db_table):
+    """ The columnar table for +db_table+, a release of the FieldTable +table+, loaded if necessary.
+    """
+    return columnar_tables.get(table, db_table)
+
+
+def rows_for_geos(columnar, geos, **kwargs):
+    """ Rows for each of +geos+ that has data, like those returned by `FieldTable.get_rows_for_geos`.
+    """
+    objects = OrderedDict()
+    for geo in geos:
+        rows = columnar.rows_for_geo(geo, **kwargs)
+        if rows:
+            objects[(geo.geo_level, geo.geo_code, geo.version)] = rows
+    return objects
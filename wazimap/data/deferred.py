@@ -0,0 +1,246 @@
+"""
+Deferred stat lookups.
+
+Profile builders call `get_stat_data` many times for the same geography, and
+often against the same underlying database table. Inside a deferred dataset
+context, such as::
+
+    with dataset_context(year='2011', deferred=True):
+        gender = get_stat_data('gender', geo, session)
+        age = get_stat_data(['gender', 'age group'], geo, session)
+
+    gender_data, total_pop = gender
+
+`FieldTable.get_stat_data` returns a `DeferredStatData` rather than doing the
+query immediately. All outstanding lookups are done when the context exits or
+when any deferred result is first read, with one grouped query per database table.
+"""
+
+from sqlalchemy import func
+
+from wazimap.data.utils import add_metadata, geo_keys, geo_chunks
+
+
+class StatRow(object):
+    """ A row of summed statistics, like those returned by `FieldTable.get_rows_for_geo`.
+    """
+
+    def __init__(self, total, **fields):
+        self.total = total
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return "StatRow(%s)" % ", ".join(
+            "%s=%r" % (k, v) for k, v in sorted(self.__dict__.items())
+        )
+
+
+class DeferredStatData(object):
+    """ The result of a deferred call to `get_stat_data`. It can be unpacked
+    or indexed like the usual ``(data, total)`` tuple, which resolves all
+    outstanding lookups.
+    """
+
+    def __init__(self, planner):
+        self._planner = planner
+        self._result = None
+        self._error = None
+
+    @property
+    def resolved(self):
+        return self._result is not None or self._error is not None
+
+    def resolve(self):
+        if not self.resolved:
+            self._planner.resolve()
+
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    @property
+    def data(self):
+        return self.resolve()[0]
+
+    @property
+    def total(self):
+        return self.resolve()[1]
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __getitem__(self, i):
+        return self.resolve()[i]
+
+    def __len__(self):
+        return 2
+
+
+class StatRequest(object):
+    """ An outstanding call to `get_stat_data`, with normalised arguments.
+    """
+
+    def __init__(self, table, db_table, geo, session, fields, options):
+        self.table = table
+        self.db_table = db_table
+        self.geo = geo
+        self.session = session
+        self.fields = fields
+        self.options = options
+        self.result = None
+
+
+class DeferredStatPlanner(object):
+    """ Collects calls to `get_stat_data` and resolves them in as few queries as possible.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def defer(self, table, db_table, geo, session, fields, **options):
+        request = StatRequest(table, db_table, geo, session, fields, options)
+        request.result = DeferredStatData(self)
+        self.pending.append(request)
+        return request.result
+
+    def resolve(self):
+        """ Resolve all outstanding requests, grouped by database table.
+        """
+        pending, self.pending = self.pending, []
+
+        groups = {}
+        for request in pending:
+            groups.setdefault(request.db_table.name, []).append(request)
+
+        for requests in groups.values():
+            try:
+                self.resolve_group(requests)
+            except Exception as e:
+                for request in requests:
+                    if not request.result.resolved:
+                        request.result._error = e
+
+    def resolve_group(self, requests):
+        """ Do one query for all +requests+, which share a database table,
+        and fan the rows out to each request.
+        """
+        from wazimap.models.data import join_geo_keys
+
+        table = requests[0].table
+        db_model = requests[0].db_table.model
+        session = requests[0].session
+
+        # all the fields needed by any request, in table order
+        needed = set()
+        for r in requests:
+            needed.update(r.fields)
+            needed.update(r.options["only"] or {})
+            needed.update(r.options["exclude"] or {})
+        fields = [f for f in table.fields if f in needed]
+
+        geo_columns = [db_model.geo_level, db_model.geo_code, db_model.geo_version]
+        # rank field values in database order, so that ordering matches the
+        # ORDER BY done by get_rows_for_geo
+        rank_attrs = dict((f, "_rank_%d" % i) for i, f in enumerate(fields))
+        ranks = [
+            func.dense_rank().over(order_by=getattr(db_model, f)).label(rank_attrs[f])
+            for f in fields
+        ]
+
+        rows = {}
+        for chunk in geo_chunks(r.geo for r in requests):
+            keys = geo_keys(chunk)
+            query = (
+                table._rows_query(session, db_model, fields, None, None, None)
+                .add_columns(*(geo_columns + ranks))
+                .group_by(*geo_columns)
+                .join(keys, join_geo_keys(db_model, keys))
+            )
+
+            for row in query:
+                key = (row.geo_level, row.geo_code, row.geo_version)
+                rows.setdefault(key, []).append(row)
+
+        for request in requests:
+            geo = request.geo
+            try:
+                request.result._result = self.build_result(
+                    request, rows.get((geo.geo_level, geo.geo_code, geo.version), []), rank_attrs
+                )
+            except Exception as e:
+                request.result._error = e
+
+    def build_result(self, request, rows, rank_attrs):
+        """ Aggregate the grouped +rows+ for a request's geography down to the
+        fields it asked for, and build its data dictionary.
+        """
+        from wazimap.models.data import DataNotFound
+
+        opts = request.options
+        only = opts["only"] or {}
+        exclude = opts["exclude"] or {}
+
+        # sum over the request's fields, honouring only and exclude
+        totals = {}
+        ranks = {}
+        for row in rows:
+            if any(getattr(row, k) not in v for k, v in only.items()):
+                continue
+            if any(getattr(row, k) in v for k, v in exclude.items()):
+                continue
+
+            key = tuple(getattr(row, f) for f in request.fields)
+            if key not in totals:
+                totals[key] = None
+                ranks[key] = tuple(
+                    getattr(row, rank_attrs[f]) for f in request.fields
+                )
+
+            # SUM ignores nulls, and is null only if all values are null
+            if row.total is not None:
+                totals[key] = (totals[key] or 0) + row.total
+
+        if not totals:
+            raise DataNotFound(
+                "Entry in %s for geography %s version '%s' not found"
+                % (request.db_table.name, request.geo.geoid, request.geo.version)
+            )
+
+        objects = [
+            StatRow(total, **dict(zip(request.fields, key)))
+            for key, total in totals.items()
+        ]
+
+        # order as get_rows_for_geo would
+        order_by = opts["order_by"]
+        is_desc = order_by.startswith("-")
+        attr = order_by.lstrip("-")
+        if attr == "total":
+            # postgres sorts nulls last, or first when descending
+            objects.sort(key=lambda o: (o.total is None, o.total or 0), reverse=is_desc)
+        elif attr in request.fields:
+            i = request.fields.index(attr)
+            objects.sort(
+                key=lambda o: ranks[tuple(getattr(o, f) for f in request.fields)][i],
+                reverse=is_desc,
+            )
+
+        table = request.table
+        data, total = table._build_stat_data(
+            objects,
+            request.fields,
+            percent=opts["percent"],
+            total=opts["total"],
+            exclude_zero=opts["exclude_zero"],
+            recode=opts["recode"],
+            key_order=opts["key_order"],
+            percent_grouping=opts["percent_grouping"],
+        )
+
+        if opts["slices"]:
+            for v in opts["slices"]:
+                data = data[v]
+
+        add_metadata(data, table, request.db_table.active_release)
+        return data, total
+
@@ -10,6 +10,17 @@ from wazimap.geo import geo_data, HAS_GDAL, gdal_missing
 
 log = logging.getLogger(__name__)
 
+# GDAL's version is logged when it's first imported, rather than at startup
+_gdal_version_logged = False
+
+
+def log_gdal_version(gdal):
+    global _gdal_version_logged
+
+    if not _gdal_version_logged:
+        _gdal_version_logged = True
+        log.info("Wazimap found GDAL version %s" % gdal.VersionInfo("RELEASE_NAME"))
+
 
 class DownloadManager(object):
     BAD_LAYER_CHARS = re.compile('[ /#-]')
@@ -23,10 +34,17 @@ class DownloadManager(object):
     }
 
     def generate_download_bundle(self, tables, geos, geo_ids, release, columns, data, fmt):
+        """ Generate a zipped download of +data+ for +geos+.
+
+        +data+ is either a dict from geo ids to table data, or an iterable of
+        (geo, table data) tuples, such as that returned by `DataAPIView.stream_data`,
+        which is consumed as the file is written.
+        """
         if not HAS_GDAL:
             gdal_missing(critical=True)
 
-        from osgeo import ogr, osr
+        from osgeo import gdal, ogr, osr
+        log_gdal_version(gdal)
         self.ogr = ogr
         self.osr = osr
         ogr.UseExceptions()
@@ -66,7 +84,12 @@ class DownloadManager(object):
                 for column_id, column_info in columns[table.name].items():
                     out_layer.CreateField(ogr.FieldDefn(str(column_id), ogr.OFTReal))
 
-            for geo in geos:
+            if isinstance(data, dict):
+                records = ((geo, data[geo.geoid]) for geo in geos)
+            else:
+                records = data
+
+            for geo, geo_tables in records:
                 geoid = geo.geoid
 
                 out_feat = ogr.Feature(out_layer.GetLayerDefn())
@@ -82,7 +105,7 @@ class DownloadManager(object):
                 out_feat.SetField2('name', geo.name.encode('utf-8'))
 
                 for table in tables:
-                    table_estimates = data[geoid][table.name.upper()]['estimate']
+                    table_estimates = geo_tables[table.name.upper()]['estimate']
 
                     for column_id, column_info in columns[table.name].items():
                         if column_id in table_estimates:
@@ -0,0 +1,151 @@
+"""
+Integer geography keys for data tables.
+
+By default, every row of a data table is keyed by its geography's ``geo_level``,
+``geo_code`` and ``geo_version`` strings. A database table with a ``geo_key`` of
+``geo_id`` stores the integer id of the geography instead, in a ``geo_id`` column.
+Its rows and indexes are much smaller.
+
+There is no foreign key constraint on ``geo_id``, so that geographies can be
+reloaded, but their ids must then stay the same.
+
+The model for such a table is mapped to a join of the table with the
+geography table, so rows still have ``geo_level``, ``geo_code`` and
+``geo_version`` attributes and are queried like those of any other data table.
+
+Use ``python manage.py convertgeokeys`` to convert existing tables.
+"""
+
+from sqlalchemy import Column, Integer, String, Table, join
+from sqlalchemy.orm import column_property
+
+from wazimap.data.base import Base
+from wazimap.data.columnar import columnar_tables
+from wazimap.data.utils import _engine
+
+
+# the columns of a data table that identify its geography
+GEO_COLUMNS = ['geo_level', 'geo_code', 'geo_version', 'geo_id']
+
+
+def geo_code_columns(primary_key=False):
+    """ New geo_level, geo_code and geo_version columns, which key data tables by default.
+    """
+    return [
+        Column('geo_level', String(15), nullable=False, primary_key=primary_key),
+        Column('geo_code', String(10), nullable=False, primary_key=primary_key),
+        Column('geo_version', String(100), nullable=False, primary_key=primary_key, server_default=''),
+    ]
+
+
+def geo_id_column():
+    """ A new geo_id column, for data tables keyed by geography id.
+    """
+    return Column('geo_id', Integer, nullable=False, primary_key=True)
+
+
+def geography_table():
+    """ The table of the geography model, which geo_id columns refer to.
+    """
+    from wazimap.geo import geo_data
+
+    return Table(
+        geo_data.geo_model._meta.db_table, Base.metadata,
+        Column('id', Integer, primary_key=True),
+        Column('geo_level', String(25), nullable=False),
+        Column('geo_code', String(10), nullable=False),
+        Column('version', String(100), nullable=False),
+        keep_existing=True)
+
+
+def geo_id_model(table):
+    """ A model for +table+, which is keyed by geo_id, mapped to a join with the geography table.
+    """
+    geos = geography_table()
+
+    class Model(Base):
+        __table__ = join(table, geos, table.c.geo_id == geos.c.id)
+        __mapper_args__ = {
+            'include_properties': list(table.columns) + [geos.c.geo_level, geos.c.geo_code],
+            'primary_key': list(table.primary_key.columns),
+        }
+
+        geo_id = column_property(table.c.geo_id, geos.c.id)
+        geo_version = column_property(geos.c.version)
+
+    return Model
+
+
+def convert_to_geo_ids(db_table):
+    """ Convert the database table behind +db_table+ from geo_level, geo_code and
+    geo_version columns to a geo_id column. +db_table+ must have a model.
+
+    The rows are copied into a new table, which then replaces the existing table.
+    Indexes other than the primary key are not kept.
+
+    :return: the number of rows converted
+    """
+    from wazimap.data.loader import quote, shadow_name
+    from wazimap.data.registry import invalidate_registry
+    from wazimap.models import DBTable
+
+    if db_table.geo_key == DBTable.GEO_ID:
+        raise ValueError("%s already uses geo_id keys" % db_table.name)
+
+    name = db_table.name
+    new = shadow_name(name)
+    pk_name = 'pk_%s' % name
+    geos = geography_table()
+    columns = [quote(c.name) for c in db_table.table.columns if c.name not in GEO_COLUMNS]
+    primary_key = [quote(c.name) for c in db_table.table.primary_key.columns if c.name not in GEO_COLUMNS]
+
+    conn = _engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+
+        cursor.execute('DROP TABLE IF EXISTS %s' % quote(new))
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (quote(new), quote(name)))
+        cursor.execute('ALTER TABLE %s DROP COLUMN geo_level, DROP COLUMN geo_code, DROP COLUMN geo_version, '
+                       'ADD COLUMN geo_id INTEGER NOT NULL' % quote(new))
+
+        cursor.execute("""
+            INSERT INTO {new} (geo_id, {columns})
+            SELECT g.id, {t_columns}
+            FROM {name} t
+            INNER JOIN {geos} g
+              ON g.geo_level = t.geo_level AND g.geo_code = t.geo_code AND g.version = t.geo_version
+        """.format(
+            new=quote(new), name=quote(name), geos=quote(geos.name),
+            columns=', '.join(columns), t_columns=', '.join('t.' + c for c in columns)))
+        rows = cursor.rowcount
+
+        cursor.execute('SELECT COUNT(*) FROM %s' % quote(name))
+        missing = cursor.fetchone()[0] - rows
+        if missing:
+            raise ValueError("%d rows of %s are for geographies that don't exist" % (missing, name))
+
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (%s)' % (
+            quote(new), quote(shadow_name(pk_name)), ', '.join(['geo_id'] + primary_key)))
+
+        cursor.execute('DROP TABLE %s' % quote(name))
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (quote(new), quote(name)))
+        cursor.execute('ALTER TABLE %s RENAME CONSTRAINT %s TO %s' % (
+            quote(name), quote(shadow_name(pk_name)), quote(pk_name)))
+        cursor.execute('UPDATE %s SET geo_key = %%s WHERE id = %%s' % quote(DBTable._meta.db_table),
+                       [DBTable.GEO_ID, db_table.id])
+        conn.commit()
+
+        cursor.execute('ANALYZE %s' % quote(name))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    # the table's model and metadata have changed
+    DBTable.MODELS.evict(name)
+    columnar_tables.evict(name)
+    invalidate_registry()
+
+    return rows
@@ -0,0 +1,175 @@
+"""
+Binary geometry caches.
+
+Parsing large GeoJSON files into Shapely shapes is slow, and happens in every
+Wazimap process when it starts. A geometry cache holds the same features in a
+compact binary file: the shapes as WKB, and their properties and bounding boxes
+in an index. `GeoData` memory-maps the cache and only deserializes a shape when
+it is first used.
+
+The file is laid out as:
+
+* the `MAGIC` bytes,
+* the length of the index, as an unsigned 64-bit little-endian integer,
+* the index, as UTF-8 JSON,
+* the WKB of each shape, at offsets given in the index.
+
+The index records the ``geometry_data`` setting and the size and modification
+time of each GeoJSON file the cache was built from, so that a stale cache is
+ignored.
+
+Use ``python manage.py buildgeometrycache`` to build a cache.
+"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'WAZIMAPGEO1\n'
+LENGTH = struct.Struct('<Q')
+
+
+class CachedFeature(dict):
+    """ A feature from a geometry cache, with 'properties' and 'bbox' keys. Its
+    'shape' is deserialized from WKB when it's first used, and kept if +keep+ is
+    True. Otherwise it's deserialized each time it's used.
+    """
+    def __init__(self, properties, bbox, wkb, keep=True):
+        super(CachedFeature, self).__init__(properties=properties, bbox=bbox)
+        self.wkb = wkb
+        self.keep = keep
+
+    def __missing__(self, key):
+        if key != 'shape':
+            raise KeyError(key)
+
+        shape = None
+        if self.wkb is not None:
+            from shapely import wkb
+            shape = wkb.loads(bytes(self.wkb))
+
+        if self.keep:
+            self['shape'] = shape
+            self.wkb = None
+        return shape
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def file_signature(fname):
+    stat = os.stat(fname)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def write_geometry_cache(path, geometry_data, features):
+    """ Write a geometry cache to +path+, replacing it once it's complete.
+
+    :param dict geometry_data: the ``geometry_data`` setting the cache is built from
+    :param features: an iterator of (version, level, source file name, GeoJSON feature) tuples
+    :return: the number of features written
+    """
+    from shapely.geometry import shape as make_shape
+
+    index = {'geometry_data': geometry_data, 'sources': {}, 'features': {}}
+    count = 0
+    offset = 0
+    # a file used for several levels is written once, as (bbox, offset, length) by (file name, code)
+    written = {}
+
+    with tempfile.TemporaryFile() as shapes:
+        for version, level, fname, feature in features:
+            if fname not in index['sources']:
+                index['sources'][fname] = file_signature(fname)
+
+            props = feature['properties']
+            key = (fname, props['code'])
+
+            if key not in written:
+                bbox = None
+                length = 0
+
+                if feature['geometry']:
+                    shape = make_shape(feature['geometry'])
+                    if not shape.is_empty:
+                        data = shape.wkb
+                        shapes.write(data)
+                        bbox = list(shape.bounds)
+                        length = len(data)
+
+                written[key] = (bbox, offset, length)
+                offset += length
+
+            index['features'].setdefault(version, {}).setdefault(level, []).append(
+                [props['code'], props] + list(written[key]))
+            count += 1
+
+        tmp_path = path + '.tmp'
+        data = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(LENGTH.pack(len(data)))
+            f.write(data)
+            shapes.seek(0)
+            shutil.copyfileobj(shapes, f)
+
+    os.replace(tmp_path, path)
+
+    return count
+
+
+def read_geometry_cache(path, geometry_data, with_shapes=True, keep_shapes=True):
+    """ Read the geometry cache at +path+, if it was built from +geometry_data+ and its
+    source files haven't changed.
+
+    :param bool with_shapes: load shapes lazily from the cache, otherwise features don't have shapes
+    :param bool keep_shapes: keep shapes once they're loaded, otherwise they're loaded each time they're used
+    :return: a dict from version to a dict from level to a dict from geo code to a `CachedFeature`,
+             or None if the cache can't be used
+    """
+    if not os.path.exists(path):
+        log.warning("The geometry cache %s doesn't exist, loading geometry from GeoJSON" % path)
+        return None
+
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s isn't a geometry cache" % path)
+
+    start = len(MAGIC) + LENGTH.size
+    length, = LENGTH.unpack(data[len(MAGIC):start])
+    index = json.loads(data[start:start + length].decode('utf-8'))
+
+    if index['geometry_data'] != geometry_data:
+        log.warning("The geometry cache %s was built with a different geometry_data setting, "
+                    "loading geometry from GeoJSON" % path)
+        return None
+
+    for fname, signature in index['sources'].items():
+        if not os.path.exists(fname) or file_signature(fname) != signature:
+            log.warning("The geometry cache %s is out of date, because %s has changed. "
+                        "Loading geometry from GeoJSON" % (path, fname))
+            return None
+
+    # the shapes are read straight from the file, when they're used
+    shapes = memoryview(data)[start + length:]
+
+    geometry = {}
+    for version, levels in index['features'].items():
+        for level, features in levels.items():
+            level_detail = geometry.setdefault(version, {}).setdefault(level, {})
+            for code, props, bbox, offset, wkb_length in features:
+                wkb = shapes[offset:offset + wkb_length] if with_shapes and wkb_length else None
+                level_detail[code] = CachedFeature(props, bbox if wkb is not None else None, wkb, keep=keep_shapes)
+
+    return geometry
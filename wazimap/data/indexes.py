@@ -0,0 +1,288 @@
+"""
+Index advice for the database tables behind data tables.
+
+The primary key of a data table starts with ``geo_level`` and ``geo_code``, which
+suits fetching the data for a geography. Maps and rankings instead read one
+column for every geography at a level, which Postgres can only answer by
+scanning most of a large table.
+
+`advise` runs a representative set of the queries Wazimap issues against a
+table through ``EXPLAIN``, builds candidate covering indexes inside a
+transaction, explains the queries again, and then rolls the transaction back.
+Candidates that make the queries cheaper are recommended, either for the whole
+table or, when only some geo levels benefit, as partial indexes for those levels.
+
+Use ``python manage.py adviseindexes`` to see and create recommended indexes.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+
+from sqlalchemy import String
+
+from wazimap.data.geokeys import GEO_COLUMNS
+from wazimap.data.loader import MAX_NAME_LENGTH, quote
+from wazimap.data.utils import _engine
+from wazimap.geo import geo_data
+
+
+# tables with fewer rows than this are small enough to scan
+MIN_ROWS = 10000
+
+# the fraction by which an index must reduce the cost of a query to be recommended
+MIN_IMPROVEMENT = 0.2
+
+Index = namedtuple('Index', ['name', 'columns', 'include', 'level'])
+# +kind+ is 'geography' for the data of one geography, or 'map' for one column of every geography at a level
+Query = namedtuple('Query', ['level', 'kind', 'sql'])
+
+
+class IndexAdvice(object):
+    """ The recommended indexes for a database table, and the estimated costs of
+    its queries before and after they're created.
+    """
+    def __init__(self, name, rows, size, partitioned=False):
+        self.name = name
+        self.rows = rows
+        self.size = size
+        self.partitioned = partitioned
+        # (query, cost before, cost after) tuples
+        self.costs = []
+        self.indexes = []
+        self.skipped = None
+
+
+def index_name(table_name, *parts):
+    """ A name for an index on +table_name+, within Postgres' limit on name lengths.
+    """
+    name = '_'.join(('ix', table_name) + parts).lower().replace(' ', '_')
+    if len(name) > MAX_NAME_LENGTH:
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        name = name[:MAX_NAME_LENGTH - len(digest) - 1] + '_' + digest
+    return name
+
+
+def literal(value):
+    return String().literal_processor(_engine.dialect)(value)
+
+
+def index_sql(table_name, index, concurrently=False):
+    """ The SQL to create +index+ on +table_name+.
+    """
+    sql = 'CREATE INDEX %s%s ON %s (%s)' % (
+        'CONCURRENTLY ' if concurrently else '', quote(index.name), quote(table_name),
+        ', '.join(quote(c) for c in index.columns))
+    if index.include:
+        sql += ' INCLUDE (%s)' % ', '.join(quote(c) for c in index.include)
+    if index.level:
+        sql += ' WHERE geo_level = %s' % literal(index.level)
+    return sql
+
+
+def value_columns(db_table):
+    return [c.name for c in db_table.table.columns if c.name not in GEO_COLUMNS]
+
+
+def is_field_table(data_table):
+    from wazimap.models import FieldTable
+
+    return isinstance(data_table, FieldTable)
+
+
+def map_columns(data_table, db_table, columns=None):
+    """ The value columns that map queries read: the total of a FieldTable, or +columns+
+    of a SimpleTable, by default all of them.
+    """
+    if is_field_table(data_table):
+        return ['total']
+
+    available = value_columns(db_table)
+    if columns is None:
+        return available
+    for column in columns:
+        if column not in available:
+            raise ValueError("%s doesn't have a column named '%s'" % (db_table.name, column))
+    return list(columns)
+
+
+def candidate_index(data_table, db_table, level=None, columns=None):
+    """ The covering index for queries that read a column for every geography at a level,
+    only for +level+ if it's given.
+
+    For FieldTables, the index is on the field columns, so that the rows for one
+    combination of field values can be found. For SimpleTables, it's on the geo version
+    and includes +columns+, so that the table itself isn't read.
+    """
+    name = db_table.name
+    include = ['geo_code'] + map_columns(data_table, db_table, columns)
+    columns = ['geo_version']
+
+    if is_field_table(data_table):
+        columns += [c for c in value_columns(db_table) if c != 'total']
+
+    if level:
+        return Index(index_name(name, level, 'level'), columns, include, level)
+    return Index(index_name(name, 'level'), ['geo_level'] + columns, include, None)
+
+
+def sample_queries(cursor, data_table, db_table, columns=None):
+    """ Representative queries for the table, using values of a sample row for each geo level:
+    the data for one geography, and the +columns+ that maps read for every geography at a level.
+    """
+    name = quote(db_table.name)
+    fields = [c for c in value_columns(db_table) if c != 'total'] if is_field_table(data_table) else []
+    selected = ', '.join(quote(c) for c in map_columns(data_table, db_table, columns))
+
+    queries = []
+    for level in geo_data.geo_levels:
+        cursor.execute('SELECT geo_code, geo_version%s FROM %s WHERE geo_level = %%s LIMIT 1' % (
+            ''.join(', ' + quote(f) for f in fields), name), [level])
+        row = cursor.fetchone()
+        if not row:
+            continue
+        values = dict(zip(['geo_code', 'geo_version'] + fields, row))
+
+        where = 'geo_level = %s AND geo_version = %s' % (literal(level), literal(values['geo_version']))
+        queries.append(Query(level, 'geography', 'SELECT * FROM %s WHERE %s AND geo_code = %s' % (
+            name, where, literal(values['geo_code']))))
+
+        # for FieldTables, the rows for one combination of field values
+        sql = 'SELECT geo_code, %s FROM %s WHERE %s' % (selected, name, where)
+        sql += ''.join(' AND %s = %s' % (quote(f), literal(values[f])) for f in fields)
+        queries.append(Query(level, 'map', sql))
+
+    return queries
+
+
+def explain_cost(cursor, sql):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Total Cost']
+
+
+def table_stats(cursor, table_name):
+    """ The estimated number of rows of +table_name+, its size in bytes including its
+    indexes, and whether it's partitioned.
+    """
+    cursor.execute("""
+        SELECT c.reltuples, pg_total_relation_size(c.oid), c.relkind
+        FROM pg_class c
+        WHERE c.oid = %s::regclass
+    """, [quote(table_name)])
+    rows, size, kind = cursor.fetchone()
+    return max(int(rows), 0), size, kind == 'p'
+
+
+def existing_indexes(cursor, table_name):
+    cursor.execute('SELECT c.relname FROM pg_index i INNER JOIN pg_class c ON c.oid = i.indexrelid '
+                   'WHERE i.indrelid = %s::regclass', [quote(table_name)])
+    return set(r[0] for r in cursor.fetchall())
+
+
+def trial_costs(cursor, db_table, queries, indexes):
+    """ The costs of +queries+ with +indexes+ created. The indexes are built in
+    the current transaction, which the caller must roll back.
+    """
+    for index in indexes:
+        cursor.execute(index_sql(db_table.name, index))
+    return [explain_cost(cursor, q.sql) for q in queries]
+
+
+def advise(data_table, db_table, columns=None, min_rows=MIN_ROWS, min_improvement=MIN_IMPROVEMENT):
+    """ Recommend indexes for the database table behind +db_table+, a release of +data_table+.
+
+    Candidate indexes are built in a transaction that is rolled back, which blocks
+    writes to the table while they're built.
+
+    :param list columns: for SimpleTables, the columns that maps and rankings read. Default: all of them.
+    :param int min_rows: don't recommend indexes for tables with fewer rows than this
+    :param float min_improvement: the fraction by which an index must reduce the cost of a query
+    :return: an `IndexAdvice`
+    """
+    conn = _engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        advice = IndexAdvice(db_table.name, *table_stats(cursor, db_table.name))
+
+        if db_table.geo_key == db_table.GEO_ID:
+            advice.skipped = "keyed by geo_id"
+            return advice
+
+        if advice.rows < min_rows:
+            advice.skipped = "fewer than %d rows" % min_rows
+            return advice
+
+        queries = sample_queries(cursor, data_table, db_table, columns)
+        if not queries:
+            advice.skipped = "no data for any geo level"
+            return advice
+
+        existing = existing_indexes(cursor, db_table.name)
+        before = [explain_cost(cursor, q.sql) for q in queries]
+
+        index = candidate_index(data_table, db_table, columns=columns)
+        if index.name in existing:
+            advice.skipped = "already indexed"
+            advice.costs = [(q, cost, cost) for q, cost in zip(queries, before)]
+            return advice
+
+        try:
+            after = trial_costs(cursor, db_table, queries, [index])
+        finally:
+            conn.rollback()
+
+        # the levels whose maps are cheaper with the index
+        maps = [(q, b, a) for q, b, a in zip(queries, before, after) if q.kind == 'map']
+        improved = [q.level for q, b, a in maps if a <= b * (1 - min_improvement)]
+
+        if improved and len(improved) == len(maps):
+            advice.indexes = [index]
+        elif improved:
+            # only some levels benefit, so index just their rows
+            advice.indexes = [candidate_index(data_table, db_table, level, columns) for level in improved]
+            advice.indexes = [i for i in advice.indexes if i.name not in existing]
+            try:
+                after = trial_costs(cursor, db_table, queries, advice.indexes)
+            finally:
+                conn.rollback()
+
+        if not advice.indexes:
+            after = before
+        advice.costs = list(zip(queries, before, after))
+
+        return advice
+    finally:
+        conn.close()
+
+
+def create_indexes(advice, concurrently=False):
+    """ Create the indexes recommended by +advice+.
+
+    :param bool concurrently: build them without blocking writes to the table, which takes longer.
+                              Not supported for partitioned tables.
+    :return: the names of the indexes created
+    """
+    if concurrently and advice.partitioned:
+        raise ValueError("Indexes can't be created concurrently on %s, because it's partitioned" % advice.name)
+
+    conn = _engine.raw_connection()
+    try:
+        # CREATE INDEX CONCURRENTLY can't run in a transaction
+        conn.connection.autocommit = concurrently
+        cursor = conn.cursor()
+        for index in advice.indexes:
+            cursor.execute(index_sql(advice.name, index, concurrently=concurrently))
+        if not concurrently:
+            conn.commit()
+    except Exception:
+        if not concurrently:
+            conn.rollback()
+        raise
+    finally:
+        conn.connection.autocommit = False
+        conn.close()
+
+    return [i.name for i in advice.indexes]
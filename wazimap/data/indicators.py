@@ -0,0 +1,298 @@
+"""
+Derived indicators.
+
+A derived indicator, such as persons per household, is an arithmetic expression
+over the data of other tables. Its values are computed for every geography at
+once with a single SQL query, and stored as a column of a SimpleTable, so
+profiles and the data API read them like any other data.
+
+Expressions refer to data with references in braces:
+
+* ``{TABLE.column}`` is a column of a SimpleTable.
+* ``{TABLE}`` is the sum of the totals of a FieldTable, or of its denominator
+  rows if it has a ``denominator_key``.
+* ``{TABLE:field=value,field=value}`` is the sum of the totals of a FieldTable's
+  rows with those field values.
+
+References can be combined with numbers, ``+``, ``-``, ``*``, ``/`` and parentheses,
+such as ``{POPULATION.total} / {HOUSEHOLDS.total}`` or
+``100 * {WATERSOURCE:water source=Piped} / {WATERSOURCE}``. Division by zero gives null.
+
+Use ``python manage.py computeindicators`` to compute the indicators of a table.
+"""
+
+from collections import namedtuple
+import ast
+import re
+
+from sqlalchemy import Float, and_, cast, func, literal, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from wazimap.data.columnar import columnar_tables
+from wazimap.data.geokeys import GEO_COLUMNS, geography_table
+from wazimap.data.loader import quote
+from wazimap.data.utils import _engine, get_datatable
+
+
+REFERENCE_RE = re.compile(r'\{([^{}]+)\}')
+NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+
+# table.column, or table:field=value,field=value
+Reference = namedtuple('Reference', ['table', 'column', 'filters'])
+
+OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / func.nullif(b, 0),
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: lambda a: a,
+    ast.USub: lambda a: -a,
+}
+
+# numbers are ast.Num before Python 3.8
+NUMBER_NODES = tuple(getattr(ast, n) for n in ('Constant', 'Num') if hasattr(ast, n))
+
+
+def parse_reference(ref):
+    """ Parse the text of a reference, without its braces, into a `Reference`.
+    """
+    if ':' in ref:
+        table, filters = ref.split(':', 1)
+        pairs = [f.split('=', 1) for f in filters.split(',')]
+        if any(len(p) != 2 for p in pairs):
+            raise ValueError("Invalid field filters in {%s}, use {TABLE:field=value,field=value}" % ref)
+        return Reference(table.strip(), None, tuple((f.strip(), v.strip()) for f, v in pairs))
+
+    if '.' in ref:
+        table, column = ref.split('.', 1)
+        return Reference(table.strip(), column.strip(), ())
+
+    return Reference(ref.strip(), None, ())
+
+
+def parse_expression(expression):
+    """ Parse +expression+ into an expression AST, in which references are replaced
+    with names, and a dict from those names to `Reference` tuples.
+
+    Raises a ValueError if the expression is invalid.
+    """
+    refs = {}
+    names = {}
+
+    def replace(match):
+        ref = match.group(1).strip()
+        if ref not in names:
+            names[ref] = '_ref%d' % len(names)
+            refs[names[ref]] = parse_reference(ref)
+        return names[ref]
+
+    source = REFERENCE_RE.sub(replace, expression)
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError("Invalid expression: %s" % expression)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id not in refs:
+                raise ValueError("Unknown name '%s' in %s. Refer to data in braces, like {TABLE.column}" % (
+                    node.id, expression))
+        elif isinstance(node, NUMBER_NODES):
+            if not isinstance(number(node), (int, float)) or isinstance(number(node), bool):
+                raise ValueError("Only numbers are allowed in %s" % expression)
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load) + tuple(OPERATORS) +
+                            tuple(UNARY_OPERATORS)):
+            raise ValueError("Only +, -, *, / and parentheses are allowed in %s" % expression)
+
+    if not refs:
+        raise ValueError("%s doesn't refer to any data" % expression)
+
+    return tree, refs
+
+
+def compile_expression(node, values):
+    """ Compile the AST +node+ into a SQLAlchemy expression, with names replaced by +values+.
+    """
+    if isinstance(node, ast.Expression):
+        return compile_expression(node.body, values)
+    if isinstance(node, ast.BinOp):
+        return OPERATORS[type(node.op)](compile_expression(node.left, values), compile_expression(node.right, values))
+    if isinstance(node, ast.UnaryOp):
+        return UNARY_OPERATORS[type(node.op)](compile_expression(node.operand, values))
+    if isinstance(node, ast.Name):
+        return values[node.id]
+    return literal(number(node), Float)
+
+
+def number(node):
+    return getattr(node, 'value', getattr(node, 'n', None))
+
+
+def reference_query(ref, year):
+    """ A query for the value of +ref+ for each geography, for the release for +year+
+    of the table it refers to.
+    """
+    from wazimap.models import FieldTable
+
+    table = get_datatable(ref.table)
+    if not table:
+        raise ValueError("No data table named '%s'" % ref.table)
+
+    release = table.get_release(year)
+    if not release:
+        raise ValueError("%s doesn't have a release for %s" % (table.name, year))
+
+    db_table = table.get_db_table(release=release)
+    model = db_table.model
+    columns = db_table.table.columns
+    geo_columns = [model.geo_level.label('geo_level'), model.geo_code.label('geo_code'),
+                   model.geo_version.label('geo_version')]
+
+    if isinstance(table, FieldTable):
+        if ref.column:
+            raise ValueError("%s is a FieldTable, refer to it with {%s:field=value}" % (table.name, ref.table))
+        for field, value in ref.filters:
+            if field not in table.fields:
+                raise ValueError("%s doesn't have a field named '%s'" % (table.name, field))
+
+        filters = [columns[f] == v for f, v in ref.filters]
+        last = table.fields[-1]
+        if table.denominator_key and last not in dict(ref.filters):
+            # the denominator row is the total of the other rows, so use it rather than adding to them
+            filters.append(columns[last] == table.denominator_key)
+
+        return select([*geo_columns, func.sum(columns.total).label('value')]) \
+            .select_from(model.__table__) \
+            .where(and_(*filters)) \
+            .group_by(model.geo_level, model.geo_code, model.geo_version)
+
+    if not ref.column or ref.filters:
+        raise ValueError("%s is a SimpleTable, refer to it with {%s.column}" % (table.name, ref.table))
+    if ref.column not in columns or ref.column in GEO_COLUMNS:
+        raise ValueError("%s doesn't have a column named '%s'" % (table.name, ref.column))
+
+    return select([*geo_columns, columns[ref.column].label('value')]).select_from(model.__table__)
+
+
+def indicators_query(indicators, year, geo_id=False):
+    """ A query for the values of +indicators+ for every geography with data for any
+    of their references, using the release of each referenced table for +year+.
+
+    The query has geo_level, geo_code and geo_version columns, or a geo_id column if
+    +geo_id+ is True, and a column for each indicator.
+    """
+    geos = geography_table()
+    source = geos
+    values = {}
+    subqueries = {}
+
+    expressions = []
+    for indicator in indicators:
+        tree, refs = parse_expression(indicator.expression)
+
+        names = {}
+        for name, ref in refs.items():
+            if ref not in subqueries:
+                sub = reference_query(ref, year).alias('ref%d' % len(subqueries))
+                subqueries[ref] = sub
+                source = source.outerjoin(sub, and_(
+                    sub.c.geo_level == geos.c.geo_level,
+                    sub.c.geo_code == geos.c.geo_code,
+                    sub.c.geo_version == geos.c.version))
+                values[ref] = cast(sub.c.value, Float)
+            names[name] = values[ref]
+
+        expressions.append(compile_expression(tree, names).label(indicator.name))
+
+    if geo_id:
+        geo_columns = [geos.c.id.label('geo_id')]
+    else:
+        geo_columns = [geos.c.geo_level, geos.c.geo_code, geos.c.version.label('geo_version')]
+
+    return select(geo_columns + expressions) \
+        .select_from(source) \
+        .where(or_(*[sub.c.value.isnot(None) for sub in subqueries.values()]))
+
+
+def compute_indicators(table, year):
+    """ Compute the derived indicators of the SimpleTable +table+ and store them in
+    its release for +year+. Columns are added to the database table for new indicators.
+
+    Every referenced table uses the release for the same year as +table+, even if
+    +year+ is 'latest'. Only the indicator columns are replaced, the table's other
+    columns are left alone.
+
+    :return: the number of rows stored
+    """
+    from wazimap.models import DBTable
+
+    indicators = list(table.indicators.all())
+    if not indicators:
+        raise ValueError("%s doesn't have any derived indicators" % table.name)
+
+    release = table.get_release(year)
+    if not release:
+        raise ValueError("%s doesn't have a release for %s" % (table.name, year))
+    # don't let each referenced table pick its own latest release
+    year = release.year
+
+    db_table = table.get_db_table(release=release)
+    existing = set(c.name for c in db_table.table.columns)
+    missing = [i.name for i in indicators if i.name not in existing]
+
+    if missing:
+        with _engine.begin() as conn:
+            conn.execute(text('ALTER TABLE %s %s' % (quote(db_table.name), ', '.join(
+                'ADD COLUMN %s DOUBLE PRECISION' % quote(name) for name in missing))))
+
+        # rebuild the model with the new columns
+        DBTable.MODELS.evict(db_table.name)
+        db_table = table.get_db_table(release=release)
+        if any(name not in db_table.table.columns for name in missing):
+            raise ValueError("The schema snapshot doesn't have the new columns of %s. Update it with "
+                             "'python manage.py snapshotschema' and try again" % db_table.name)
+
+    geo_id = db_table.geo_key == DBTable.GEO_ID
+    query = indicators_query(indicators, year, geo_id=geo_id)
+    keys = ['geo_id'] if geo_id else ['geo_level', 'geo_code', 'geo_version']
+    values = [i.name for i in indicators]
+    target = db_table.table
+    others = [c.name for c in target.columns if c.name not in GEO_COLUMNS and c.name not in values]
+
+    with _engine.begin() as conn:
+        if others:
+            # keep the table's other data, and only replace its indicators
+            conn.execute(target.update().values(dict((name, None) for name in values)))
+            insert = pg_insert(target).from_select([target.c[n] for n in keys + values], query)
+            insert = insert.on_conflict_do_update(
+                index_elements=[target.c[n] for n in keys],
+                set_=dict((name, insert.excluded[name]) for name in values))
+        else:
+            conn.execute(target.delete())
+            insert = target.insert().from_select([target.c[n] for n in keys + values], query)
+
+        rows = conn.execute(insert).rowcount
+
+    columnar_tables.evict(db_table.name)
+
+    return rows
+
+
+def indicator_tables(table):
+    """ The SimpleTables with derived indicators that refer to the data table +table+.
+    """
+    from wazimap.models import DerivedIndicator, SimpleTable
+
+    names = set()
+    for indicator in DerivedIndicator.objects.select_related('table'):
+        try:
+            _, refs = parse_expression(indicator.expression)
+        except ValueError:
+            continue
+        if any(ref.table.upper() == table.name.upper() for ref in refs.values()):
+            names.add(indicator.table.id)
+
+    return list(SimpleTable.objects.filter(id__in=names).order_by('name'))
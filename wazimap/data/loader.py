@@ -0,0 +1,315 @@
+"""
+Bulk loading of data into the database tables behind data table releases.
+
+Rows are streamed into Postgres with ``COPY FROM STDIN`` in chunks, so that
+large files are loaded quickly without being read into memory.
+Use ``python manage.py loaddatatable`` to load a CSV file.
+
+To replace a table's data without readers seeing partial data, `DataTableLoader.swap`
+loads into a shadow table, indexes and analyzes it, and then swaps it for the
+live table with a rename.
+"""
+
+import csv
+import gzip
+import io
+import logging
+import re
+import time
+
+from sqlalchemy import String
+
+from wazimap.data.columnar import columnar_tables
+from wazimap.data.geokeys import geo_code_columns, geography_table
+from wazimap.data.utils import _engine
+
+
+log = logging.getLogger(__name__)
+
+# Postgres' limit on the length of names
+MAX_NAME_LENGTH = 63
+
+INDEX_DEF_RE = re.compile(r'^CREATE (UNIQUE )?INDEX (\S+) ON (\S+) ')
+
+# SQLSTATE for lock_not_available, raised when lock_timeout is exceeded
+LOCK_NOT_AVAILABLE = '55P03'
+
+# temporary table that rows for tables keyed by geo_id are loaded into first
+STAGING_TABLE = 'wazimap_staging'
+
+
+def open_csv(path):
+    """ Open a CSV file for reading, which may be gzipped.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+
+class DataTableLoader(object):
+    """ Loads CSV data into the database table behind +db_table+, a release of +table+.
+
+    The CSV file's header row must name the columns of the database table. The geo
+    columns and field columns are required, except for ``geo_version``, which defaults
+    to an empty string. Empty values are loaded as empty strings for text columns and
+    as nulls for numeric columns.
+
+    Tables keyed by geo_id are loaded from the same geo columns, which are replaced
+    with the ids of the geographies.
+    """
+    CHUNK_SIZE = 10000
+
+    def __init__(self, table, db_table, chunk_size=None):
+        self.table = table
+        self.db_table = db_table
+        self.geo_id = db_table.geo_key == db_table.GEO_ID
+        self.columns = list(db_table.table.columns)
+        if self.geo_id:
+            self.columns = geo_code_columns() + [c for c in self.columns if c.name != 'geo_id']
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+
+    def check_headers(self, headers):
+        """ Raise a ValueError if +headers+ don't describe the columns of the database table.
+        """
+        known = [c.name for c in self.columns]
+
+        unknown = [h for h in headers if h not in known]
+        if unknown:
+            raise ValueError("Unknown columns for %s: %s. Expected some of: %s" % (
+                self.db_table.name, ', '.join(unknown), ', '.join(known)))
+
+        duplicates = set(h for h in headers if headers.count(h) > 1)
+        if duplicates:
+            raise ValueError("Duplicate columns: %s" % ', '.join(sorted(duplicates)))
+
+        missing = [
+            c.name for c in self.columns
+            if not c.nullable and c.server_default is None and c.name not in headers]
+        if missing:
+            raise ValueError("Missing required columns for %s: %s" % (self.db_table.name, ', '.join(missing)))
+
+    def copy_sql(self, headers, table_name):
+        types = dict((c.name, c.type) for c in self.columns)
+        text_columns = [h for h in headers if isinstance(types[h], String)]
+
+        sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv' % (
+            quote(table_name), ', '.join(quote(h) for h in headers))
+        if text_columns:
+            sql += ', FORCE_NOT_NULL (%s)' % ', '.join(quote(h) for h in text_columns)
+        return sql + ')'
+
+    def chunks(self, reader):
+        """ Re-encode the rows from +reader+ as CSV, in buffers of at most `chunk_size` rows.
+
+        Yields (buffer, number of rows) tuples.
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        rows = 0
+
+        for row in reader:
+            writer.writerow(row)
+            rows += 1
+
+            if rows == self.chunk_size:
+                buf.seek(0)
+                yield buf, rows
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                rows = 0
+
+        if rows:
+            buf.seek(0)
+            yield buf, rows
+
+    def load(self, f, truncate=False, progress=None):
+        """ Load CSV data from the file object +f+ in a single transaction.
+
+        :param bool truncate: remove existing data from the table first
+        :param function progress: called with the number of rows loaded so far, after each chunk
+
+        :return: the number of rows loaded
+        """
+        conn = _engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if truncate:
+                cursor.execute('TRUNCATE %s' % quote(self.db_table.name))
+
+            loaded = self.copy(cursor, f, self.db_table.name, progress)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        columnar_tables.evict(self.db_table.name)
+
+        return loaded
+
+    def copy(self, cursor, f, table_name, progress=None):
+        """ Copy CSV data from the file object +f+ into +table_name+.
+        """
+        reader = csv.reader(f)
+        try:
+            headers = [h.strip() for h in next(reader)]
+        except StopIteration:
+            raise ValueError("The file is empty")
+        self.check_headers(headers)
+
+        target = table_name
+        if self.geo_id:
+            table_name = STAGING_TABLE
+            cursor.execute('DROP TABLE IF EXISTS %s' % quote(table_name))
+            cursor.execute(
+                "CREATE TEMPORARY TABLE %s (geo_level TEXT NOT NULL, geo_code TEXT NOT NULL, "
+                "geo_version TEXT NOT NULL DEFAULT '', LIKE %s INCLUDING DEFAULTS) ON COMMIT DROP" % (
+                    quote(table_name), quote(target)))
+            cursor.execute('ALTER TABLE %s DROP COLUMN geo_id' % quote(table_name))
+
+        sql = self.copy_sql(headers, table_name)
+        loaded = 0
+
+        for buf, rows in self.chunks(reader):
+            cursor.copy_expert(sql, buf)
+            loaded += rows
+            if progress:
+                progress(loaded)
+
+        if self.geo_id:
+            self.insert_geo_ids(cursor, headers, table_name, target, loaded)
+
+        return loaded
+
+    def insert_geo_ids(self, cursor, headers, staging, table_name, loaded):
+        """ Insert the +loaded+ rows in +staging+ into +table_name+, with the ids of their geographies.
+        """
+        columns = [quote(h) for h in headers if h not in ('geo_level', 'geo_code', 'geo_version')]
+
+        cursor.execute("""
+            INSERT INTO {table} (geo_id, {columns})
+            SELECT g.id, {s_columns}
+            FROM {staging} s
+            INNER JOIN {geos} g
+              ON g.geo_level = s.geo_level AND g.geo_code = s.geo_code AND g.version = s.geo_version
+        """.format(
+            table=quote(table_name), staging=quote(staging), geos=quote(geography_table().name),
+            columns=', '.join(columns), s_columns=', '.join('s.' + c for c in columns)))
+
+        missing = loaded - cursor.rowcount
+        if missing:
+            raise ValueError("%d rows are for geographies that don't exist" % missing)
+
+    def swap(self, f, progress=None, lock_timeout=5, retries=5):
+        """ Replace the table's data with the CSV data from the file object +f+, without
+        readers ever seeing partial data.
+
+        The data is loaded into a shadow table, which is given the same primary key
+        and indexes as the live table and analyzed. The shadow table then replaces the
+        live table in a short transaction, waiting at most +lock_timeout+ seconds
+        for queries on the live table to finish, and trying again up to +retries+ times.
+
+        Partitioned tables can't be swapped, because the shadow table wouldn't be partitioned.
+
+        :return: the number of rows loaded
+        """
+        name = self.db_table.name
+        shadow = shadow_name(name)
+
+        conn = _engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+
+            cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass', [quote(name)])
+            if cursor.fetchone()[0] == 'p':
+                raise ValueError("%s is partitioned and can't be swapped, load it with truncate instead" % name)
+
+            # build and fill the shadow table
+            try:
+                cursor.execute('DROP TABLE IF EXISTS %s' % quote(shadow))
+                cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)' % (quote(shadow), quote(name)))
+                loaded = self.copy(cursor, f, shadow, progress)
+
+                log.info("Indexing %s" % shadow)
+                index_renames = self.copy_indexes(cursor, name, shadow)
+                cursor.execute('ANALYZE %s' % quote(shadow))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            # swap it in
+            for attempt in range(retries + 1):
+                try:
+                    cursor.execute("SET LOCAL lock_timeout = '%ds'" % lock_timeout)
+                    cursor.execute('DROP TABLE %s' % quote(name))
+                    cursor.execute('ALTER TABLE %s RENAME TO %s' % (quote(shadow), quote(name)))
+                    for index_name, shadow_index in index_renames:
+                        cursor.execute('ALTER INDEX %s RENAME TO %s' % (quote(shadow_index), quote(index_name)))
+                    conn.commit()
+                    break
+                except Exception as e:
+                    conn.rollback()
+                    if getattr(e, 'pgcode', None) != LOCK_NOT_AVAILABLE or attempt == retries:
+                        raise
+                    log.warning("Timed out waiting to swap in %s, trying again" % shadow)
+                    time.sleep(lock_timeout)
+        finally:
+            conn.close()
+
+        # the model's table is no longer the same database table
+        from wazimap.models import DBTable
+        DBTable.MODELS.evict(name)
+        columnar_tables.evict(name)
+
+        return loaded
+
+    def copy_indexes(self, cursor, table_name, shadow):
+        """ Create the primary key and indexes of +table_name+ on +shadow+, with temporary names.
+
+        Returns a list of (index name, temporary index name) tuples.
+        """
+        renames = []
+
+        cursor.execute("""
+            SELECT con.conname, pg_get_constraintdef(con.oid), con.conindid
+            FROM pg_constraint con
+            WHERE con.conrelid = %s::regclass AND con.contype = 'p'
+        """, [quote(table_name)])
+        primary_key = cursor.fetchone()
+        if primary_key:
+            pk_name, pk_def, pk_index = primary_key
+            pk_shadow = shadow_name(pk_name)
+            cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (quote(shadow), quote(pk_shadow), pk_def))
+            renames.append((pk_name, pk_shadow))
+        else:
+            pk_index = None
+
+        cursor.execute("""
+            SELECT c.relname, pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            INNER JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = %s::regclass AND i.indexrelid IS DISTINCT FROM %s
+        """, [quote(table_name), pk_index])
+
+        for index_name, index_def in cursor.fetchall():
+            index_shadow = shadow_name(index_name)
+            sql = INDEX_DEF_RE.sub(
+                lambda m: 'CREATE %sINDEX %s ON %s ' % (m.group(1) or '', quote(index_shadow), quote(shadow)),
+                index_def)
+            cursor.execute(sql)
+            renames.append((index_name, index_shadow))
+
+        return renames
+
+
+def quote(name):
+    return _engine.dialect.identifier_preparer.quote(name)
+
+
+def shadow_name(name):
+    """ The name of the shadow for table or index +name+, within Postgres' limit on name lengths.
+    """
+    suffix = '_shadow'
+    return name[:MAX_NAME_LENGTH - len(suffix)] + suffix
@@ -0,0 +1,183 @@
+"""
+Partitioned data tables.
+
+If ``WAZIMAP['partition_data_tables']`` is set, new database tables for data
+tables are partitioned by list on ``geo_level``, and each level's partition is
+partitioned by list on ``geo_version``. Queries for a geography only read the
+partition for its level and version, and an old version is retired by
+detaching its partitions rather than by deleting its rows.
+
+Tables have a partition for each geo level and version that exists when they
+are created, and default partitions for rows of other levels and versions.
+Use ``python manage.py provisiontables`` to add partitions for new levels and
+versions, and ``python manage.py detachgeoversion`` to retire a version.
+
+Partitioning needs PostgreSQL 11 or later. Tables keyed by geo_id are not
+partitioned.
+"""
+
+import hashlib
+import logging
+import re
+
+from django.conf import settings
+from sqlalchemy import String, bindparam, event, text
+
+from wazimap.data.loader import MAX_NAME_LENGTH
+
+log = logging.getLogger(__name__)
+
+# the partitions of a table, and their parents and bounds
+PARTITIONS_SQL = """
+    WITH RECURSIVE partitions (oid, parent) AS (
+        SELECT inhrelid, inhparent FROM pg_inherits WHERE inhparent = CAST(:name AS regclass)
+      UNION ALL
+        SELECT i.inhrelid, i.inhparent FROM pg_inherits i INNER JOIN partitions p ON i.inhparent = p.oid
+    )
+    SELECT c.relname, parent.relname, pg_get_expr(c.relpartbound, c.oid)
+    FROM partitions p
+    INNER JOIN pg_class c ON c.oid = p.oid
+    INNER JOIN pg_class parent ON parent.oid = p.parent
+"""
+
+
+def is_partitioned(db_table):
+    """ Should the database table behind +db_table+ be partitioned when it's created?
+    """
+    return bool(settings.WAZIMAP.get('partition_data_tables')) and db_table.geo_key == db_table.GEO_CODES
+
+
+def table_kwargs(db_table):
+    """ Keyword arguments for the SQLAlchemy table for +db_table+.
+    """
+    if is_partitioned(db_table):
+        return {'postgresql_partition_by': 'LIST (geo_level)'}
+    return {}
+
+
+def partition_on_create(table):
+    """ Create the partitions of the partitioned +table+ when it is created.
+    """
+    if not event.contains(table, 'after_create', after_create):
+        event.listen(table, 'after_create', after_create)
+
+
+def after_create(table, connection, **kwargs):
+    create_partitions(connection, table.name)
+
+
+def partition_name(*parts):
+    """ A name for a partition, within Postgres' limit on name lengths.
+    """
+    name = re.sub(r'[^a-z0-9_]+', '_', '_'.join(parts).lower())
+    if len(name) > MAX_NAME_LENGTH:
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        name = name[:MAX_NAME_LENGTH - len(digest) - 1] + '_' + digest
+    return name
+
+
+def get_partitions(connection, name):
+    """ The partitions of the table +name+, as a dict from partition name to a (parent name, bound) tuple.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    rows = connection.execute(text(PARTITIONS_SQL), {'name': quote(name)})
+    return dict((r[0], (r[1], r[2])) for r in rows)
+
+
+def partitioned_tables(connection, names):
+    """ The tables in +names+ that are partitioned.
+    """
+    if not names:
+        return []
+    sql = text("SELECT relname FROM pg_class WHERE relkind = 'p' AND relname IN :names ORDER BY relname")
+    sql = sql.bindparams(bindparam('names', expanding=True))
+    return [r[0] for r in connection.execute(sql, {'names': list(names)})]
+
+
+def values_bound(connection, value):
+    literal = String().literal_processor(connection.dialect)
+    return 'FOR VALUES IN (%s)' % literal(value)
+
+
+def create_partitions(connection, name, levels=None, versions=None):
+    """ Create the partitions of the partitioned table +name+ for +levels+ and +versions+
+    that don't exist yet, and its default partitions.
+
+    A partition isn't created if the default partition it would take rows from
+    already has rows for it.
+
+    :param list levels: geo levels, default: all levels
+    :param list versions: geo versions, default: the versions of all geographies
+    :return: the names of the partitions created
+    """
+    from wazimap.geo import geo_data
+
+    if levels is None:
+        levels = list(geo_data.geo_levels.keys())
+    if versions is None:
+        versions = list(geo_data.geo_model.objects.values_list('version', flat=True).distinct())
+
+    quote = connection.dialect.identifier_preparer.quote
+    existing = get_partitions(connection, name)
+    created = []
+
+    def create(partition, parent, bound, default, column, value, partition_by=None):
+        if partition in existing:
+            return
+
+        if default in existing:
+            # rows in the default partition must be moved before the new partition can be created
+            has_rows = connection.execute(text('SELECT 1 FROM %s WHERE %s = :value LIMIT 1' % (
+                quote(default), column)), {'value': value}).first()
+            if has_rows:
+                log.warning("Not creating partition %s, because %s has rows for it" % (partition, default))
+                return
+
+        sql = 'CREATE TABLE %s PARTITION OF %s %s' % (quote(partition), quote(parent), bound)
+        if partition_by:
+            sql += ' PARTITION BY %s' % partition_by
+        connection.execute(text(sql))
+        existing[partition] = (parent, bound)
+        created.append(partition)
+
+    default = partition_name(name, 'default')
+    for level in levels:
+        level_partition = partition_name(name, level)
+        create(level_partition, name, values_bound(connection, level), default, 'geo_level', level,
+               partition_by='LIST (geo_version)')
+        if level_partition not in existing:
+            continue
+
+        level_default = partition_name(level_partition, 'default')
+        for version in versions:
+            create(partition_name(level_partition, 'v' + version), level_partition, values_bound(connection, version),
+                   level_default, 'geo_version', version)
+        create(level_default, level_partition, 'DEFAULT', None, None, None)
+
+    create(default, name, 'DEFAULT', None, None, None)
+
+    return created
+
+
+def detach_version(connection, name, version, drop=False):
+    """ Detach the partitions of the partitioned table +name+ for the geo version +version+.
+    Rows for the version in default partitions are left alone.
+
+    :param bool drop: drop the detached partitions
+    :return: the names of the detached partitions
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    bound = values_bound(connection, version)
+
+    detached = []
+    for partition, (parent, partition_bound) in sorted(get_partitions(connection, name).items()):
+        # version partitions are the partitions of the level partitions
+        if parent == name or partition_bound != bound:
+            continue
+
+        connection.execute(text('ALTER TABLE %s DETACH PARTITION %s' % (quote(parent), quote(partition))))
+        if drop:
+            connection.execute(text('DROP TABLE %s' % quote(partition)))
+        detached.append(partition)
+
+    return detached
@@ -0,0 +1,261 @@
+"""
+In-memory registry of data table metadata.
+
+Datasets, releases, data tables and DB tables change rarely, but are looked up
+for nearly every stat. The registry loads them all in one go and builds indexes
+for the common lookups, so that resolving a table and its release doesn't touch
+the database in the steady state.
+
+The registry is rebuilt lazily after it is invalidated, which happens when any
+of these models are saved or deleted. Other processes only see changes once
+their registry expires, which is controlled by
+``WAZIMAP['metadata_registry_ttl']``.
+"""
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+
+class MetadataRegistry(object):
+    """ An immutable snapshot of data table metadata, with indexes.
+
+    Tables are identified by their class and primary key, so lookups work for any
+    instance of a table, not only the instances held by the registry.
+
+    The columns of FieldTables are kept in `field_table_columns` as they're used,
+    so that they're discarded along with the registry.
+    """
+
+    def __init__(self, datasets, releases, tables, table_releases):
+        """
+        :param list datasets: all `Dataset` instances
+        :param list releases: all `Release` instances
+        :param list tables: all `SimpleTable` and `FieldTable` instances, ordered by name
+        :param list table_releases: all `SimpleTableRelease` and `FieldTableRelease`
+                                    instances, with their db tables and releases
+        """
+        self.built_at = time.time()
+
+        # (field table id, release id) -> columns, filled in by FieldTable.columns
+        self.field_table_columns = {}
+
+        self.tables = tuple(tables)
+
+        # table class -> lowercase name -> tables
+        by_name = {}
+        # field -> field tables with that field
+        by_field = {}
+        for table in self.tables:
+            by_name.setdefault(type(table), {}).setdefault(table.name.lower(), []).append(table)
+            for field in getattr(table, "fields", None) or []:
+                by_field.setdefault(field, []).append(table)
+
+        self.tables_by_name = MappingProxyType(
+            {
+                cls: MappingProxyType({k: tuple(v) for k, v in names.items()})
+                for cls, names in by_name.items()
+            }
+        )
+        self.field_tables_by_field = MappingProxyType(
+            {k: tuple(v) for k, v in by_field.items()}
+        )
+
+        # (table class, table id) -> [(release, db_table)] with the latest first
+        by_table = {}
+        for table_release in sorted(
+            table_releases, key=lambda r: r.release.year, reverse=True
+        ):
+            table_class = table_release._meta.get_field("data_table").related_model
+            key = (table_class, table_release.data_table_id)
+            by_table.setdefault(key, []).append(
+                (table_release.release, table_release.db_table)
+            )
+        self.table_releases = MappingProxyType({k: tuple(v) for k, v in by_table.items()})
+
+        # dataset name -> releases, with the latest first
+        by_dataset = OrderedDict((d.name, []) for d in datasets)
+        for release in sorted(releases, key=lambda r: r.year, reverse=True):
+            by_dataset.setdefault(release.dataset.name, []).append(release)
+        self.dataset_releases = MappingProxyType(
+            {k: tuple(v) for k, v in by_dataset.items()}
+        )
+
+    @classmethod
+    def build(cls):
+        """ Load all metadata from the database and build a registry.
+        """
+        from wazimap.models import (
+            Dataset,
+            Release,
+            SimpleTable,
+            FieldTable,
+            SimpleTableRelease,
+            FieldTableRelease,
+        )
+
+        tables = list(SimpleTable.objects.select_related("dataset").all())
+        tables.extend(FieldTable.objects.select_related("dataset").all())
+        tables.sort(key=lambda t: t.name)
+
+        table_releases = []
+        for release_class in [SimpleTableRelease, FieldTableRelease]:
+            table_releases.extend(
+                release_class.objects.select_related("db_table", "release").all()
+            )
+
+        return cls(
+            list(Dataset.objects.all()),
+            list(Release.objects.select_related("dataset").all()),
+            tables,
+            table_releases,
+        )
+
+    def expired(self):
+        ttl = settings.WAZIMAP.get("metadata_registry_ttl")
+        return ttl is not None and time.time() - self.built_at > ttl
+
+    def find(self, cls, name, universe=None, dataset=None):
+        """ The table of class +cls+ with +name+, like `DataTable.find`.
+        """
+        for table in self.tables_by_name.get(cls, {}).get(name.lower(), ()):
+            if universe and table.universe.lower() != universe.lower():
+                continue
+            if dataset and table.dataset.name.lower() != dataset.lower():
+                continue
+            return table
+
+    def for_fields(self, fields, universe=None, dataset=None, name=None):
+        """ Field tables that cover all of +fields+, in name order.
+        """
+        field_set = set(fields)
+
+        candidates = set(t for t in self.tables if hasattr(t, "fields"))
+        for field in field_set:
+            candidates &= set(self.field_tables_by_field.get(field, ()))
+
+        for table in self.tables:
+            if table not in candidates:
+                continue
+            if name and table.name.lower() != name.lower():
+                continue
+            if universe and table.universe != universe:
+                continue
+            if dataset and table.dataset.name != dataset:
+                continue
+            yield table
+
+    def releases_for(self, table):
+        """ (release, db_table) tuples for +table+, with the latest release first.
+        """
+        return self.table_releases.get((type(table), table.pk), ())
+
+    def get_release(self, table, year):
+        """ The release of +table+ for +year+, which may be 'latest'.
+        """
+        for release, db_table in self.releases_for(table):
+            if year == "latest" or release.year == str(year):
+                return release
+
+    def get_db_table(self, table, release):
+        """ A copy of the DBTable for +table+ in +release+, which the caller may change.
+        """
+        for table_release, db_table in self.releases_for(table):
+            if table_release.pk == release.pk:
+                return copy.copy(db_table)
+
+    def get_dataset_releases(self, name):
+        """ Releases for the dataset called +name+, with the latest first.
+        """
+        from wazimap.models import Dataset
+
+        try:
+            return self.dataset_releases[name]
+        except KeyError:
+            raise Dataset.DoesNotExist("Dataset %s does not exist" % name)
+
+
+_registry = None
+# bumped on each invalidation, so that a registry built from stale data isn't kept
+_generation = 0
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_registry():
+    """ The current metadata registry, built if necessary.
+    """
+    global _registry
+
+    registry = _registry
+    if registry is None or registry.expired():
+        generation = _generation
+        registry = MetadataRegistry.build()
+
+        # Requests run in atomic blocks, so the registry is kept unless this
+        # transaction has changed metadata, which may still be rolled back.
+        # Changes made elsewhere while it was built bump the generation.
+        if not has_uncommitted_changes():
+            with _lock:
+                if generation == _generation:
+                    _registry = registry
+
+    return registry
+
+
+def has_uncommitted_changes():
+    """ Has the current transaction changed metadata that isn't committed yet?
+    """
+    if not connection.in_atomic_block:
+        # any transaction that made changes is over, whether it was committed or rolled back
+        _pending_changes().discard(connection.alias)
+        return False
+    return connection.alias in _pending_changes()
+
+
+def _pending_changes():
+    """ The aliases of database connections in this thread with uncommitted metadata changes.
+    """
+    if not hasattr(_local, "pending"):
+        _local.pending = set()
+    return _local.pending
+
+
+def metadata_changed():
+    """ Discard the registry after metadata is changed, and again once the change is committed,
+    in case another thread rebuilt the registry before then. Until then, registries built in this
+    transaction aren't kept.
+    """
+    invalidate_registry()
+
+    if connection.in_atomic_block:
+        _pending_changes().add(connection.alias)
+    transaction.on_commit(_committed)
+
+
+def _committed():
+    _pending_changes().discard(connection.alias)
+    invalidate_registry()
+
+
+@receiver(request_started)
+def _forget_pending_changes(sender, **kwargs):
+    # the transactions of earlier requests are over, even if they were rolled back
+    _pending_changes().clear()
+
+
+def invalidate_registry():
+    """ Discard the current registry, so that it's rebuilt when next used.
+    """
+    global _registry, _generation
+
+    with _lock:
+        _registry = None
+        _generation += 1
@@ -0,0 +1,156 @@
+"""
+Hierarchical rollups of FieldTable data.
+
+Many datasets are only published for the lowest geography level. `rollup`
+sums the rows for geographies at that level into rows for each of their
+ancestors, which are stored in the same database table. The ancestors are found
+by following the ``parent_level`` and ``parent_code`` links of the geographies,
+so stats for parent geographies don't have to be summed when they're viewed.
+
+Use ``python manage.py rollupdata`` to roll up a table.
+"""
+
+from sqlalchemy import text
+
+from wazimap.data.columnar import columnar_tables
+from wazimap.data.utils import get_session, _engine
+from wazimap.geo import geo_data
+
+
+def ancestor_levels(level):
+    """ The ancestors of +level+, deepest first.
+    """
+    ancestors = geo_data.geo_levels[level].get('ancestors', [])
+    return sorted(ancestors, key=lambda a: len(geo_data.geo_levels[a].get('ancestors', [])), reverse=True)
+
+
+def rollup(table, db_table, source_level, levels=None, geo_codes=None):
+    """ Replace the rows for ancestors of +source_level+ geographies in the database table
+    behind +db_table+, a release of the FieldTable +table+, with the sums of the rows for
+    their descendants at +source_level+.
+
+    :param str source_level: the geo level with the data to roll up
+    :param list levels: the ancestor levels to roll up to, default: all ancestors of `source_level`
+    :param list geo_codes: codes of the `source_level` geographies that have changed. If given, only
+                           their ancestors are recalculated.
+
+    :return: the number of rows inserted
+    """
+    if source_level not in geo_data.geo_levels:
+        raise ValueError("Unknown geo level: %s" % source_level)
+
+    all_levels = ancestor_levels(source_level)
+    levels = levels or all_levels
+    for level in levels:
+        if level not in all_levels:
+            raise ValueError("%s is not an ancestor of %s" % (level, source_level))
+
+    quote = _engine.dialect.identifier_preparer.quote
+    name = quote(db_table.name)
+    fields = [quote(f) for f in table.fields]
+    geographies = quote(geo_data.geo_model._meta.db_table)
+
+    params = {
+        'source_level': source_level,
+        'levels': list(levels),
+    }
+
+    # each source geography and its ancestors
+    ancestors_sql = """
+        WITH RECURSIVE ancestors (geo_code, geo_version, ancestor_level, ancestor_code) AS (
+            SELECT geo_code, version, parent_level, parent_code
+            FROM {geographies}
+            WHERE geo_level = :source_level AND parent_level IS NOT NULL
+          UNION ALL
+            SELECT a.geo_code, a.geo_version, p.parent_level, p.parent_code
+            FROM ancestors a
+            INNER JOIN {geographies} p
+              ON p.geo_level = a.ancestor_level AND p.geo_code = a.ancestor_code AND p.version = a.geo_version
+            WHERE p.parent_level IS NOT NULL
+        ),
+        targets AS (
+            SELECT DISTINCT ancestor_level, ancestor_code, geo_version
+            FROM ancestors
+            WHERE ancestor_level = ANY(:levels) {changed}
+        )
+    """
+    if geo_codes:
+        changed = "AND geo_code = ANY(:geo_codes)"
+        params['geo_codes'] = list(geo_codes)
+    else:
+        changed = ""
+    ancestors_sql = ancestors_sql.format(geographies=geographies, changed=changed)
+
+    if db_table.geo_key == db_table.GEO_ID:
+        # the rows of tables keyed by geo_id, with their geo columns
+        source = """(
+            SELECT g.geo_level, g.geo_code, g.version AS geo_version, d.*
+            FROM {name} d
+            INNER JOIN {geographies} g ON g.id = d.geo_id
+        )""".format(name=name, geographies=geographies)
+
+        delete_sql = ancestors_sql + """
+            DELETE FROM {name} t
+            USING targets, {geographies} g
+            WHERE t.geo_id = g.id
+              AND g.geo_level = targets.ancestor_level
+              AND g.geo_code = targets.ancestor_code
+              AND g.version = targets.geo_version
+        """.format(name=name, geographies=geographies)
+
+        insert_columns = 'geo_id'
+        target_columns = 'ag.id'
+        target_join = """
+            INNER JOIN {geographies} ag
+              ON ag.geo_level = a.ancestor_level AND ag.geo_code = a.ancestor_code AND ag.version = t.geo_version
+        """.format(geographies=geographies)
+    else:
+        source = name
+
+        delete_sql = ancestors_sql + """
+            DELETE FROM {name} t
+            USING targets
+            WHERE t.geo_level = targets.ancestor_level
+              AND t.geo_code = targets.ancestor_code
+              AND t.geo_version = targets.geo_version
+        """.format(name=name)
+
+        insert_columns = 'geo_level, geo_code, geo_version'
+        target_columns = 'a.ancestor_level, a.ancestor_code, t.geo_version'
+        target_join = ''
+
+    insert_sql = ancestors_sql + """
+        INSERT INTO {name} ({insert_columns}, {fields}, total)
+        SELECT {target_columns}, {t_fields}, SUM(t.total)
+        FROM {source} t
+        INNER JOIN ancestors a
+          ON t.geo_level = :source_level AND t.geo_code = a.geo_code AND t.geo_version = a.geo_version
+        INNER JOIN targets
+          ON targets.ancestor_level = a.ancestor_level
+          AND targets.ancestor_code = a.ancestor_code
+          AND targets.geo_version = a.geo_version
+        {target_join}
+        GROUP BY {target_columns}, {t_fields}
+    """.format(
+        name=name,
+        source=source,
+        insert_columns=insert_columns,
+        target_columns=target_columns,
+        target_join=target_join,
+        fields=', '.join(fields),
+        t_fields=', '.join('t.' + f for f in fields))
+
+    session = get_session()
+    try:
+        session.execute(text(delete_sql), params)
+        rows = session.execute(text(insert_sql), params).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    columnar_tables.evict(db_table.name)
+
+    return rows
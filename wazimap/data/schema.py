@@ -0,0 +1,132 @@
+"""
+Snapshots of the schema of data tables.
+
+SimpleTables describe tables whose columns are only known to the database, so
+building their models would otherwise require reflecting each table from the
+database. Instead, ``python manage.py snapshotschema`` stores the columns and
+types of all data tables in a JSON file, named by ``WAZIMAP['schema_snapshot']``,
+which is read once per process. Tables missing from the snapshot are reflected
+from the database as before, as are tables whose snapshot is missing a column
+that is asked for.
+"""
+
+import json
+import logging
+import os.path
+import threading
+
+from django.conf import settings
+from sqlalchemy import Column, inspect, text
+import sqlalchemy.types
+from sqlalchemy.dialects import postgresql
+
+
+log = logging.getLogger(__name__)
+
+# type attributes that are stored in the snapshot
+TYPE_ARGS = ('length', 'precision', 'scale', 'timezone')
+
+
+def dump_type(type_):
+    """ Describe a SQLAlchemy type as a dict.
+    """
+    info = {'type': type(type_).__name__}
+    for arg in TYPE_ARGS:
+        value = getattr(type_, arg, None)
+        if value is not None:
+            info[arg] = value
+    return info
+
+
+def load_type(info):
+    """ Build a SQLAlchemy type from a dict created by `dump_type`.
+    """
+    info = dict(info)
+    name = info.pop('type')
+    cls = getattr(postgresql, name, None) or getattr(sqlalchemy.types, name, sqlalchemy.types.NullType)
+    try:
+        return cls(**info)
+    except TypeError:
+        return cls()
+
+
+def dump_schema(bind, table_names):
+    """ Describe the columns of each table in +table_names+ that exists in the database.
+    """
+    inspector = inspect(bind)
+    existing = set(inspector.get_table_names())
+
+    tables = {}
+    for name in sorted(set(table_names) & existing):
+        primary_key = set(inspector.get_pk_constraint(name)['constrained_columns'])
+        tables[name] = {
+            'columns': [{
+                'name': col['name'],
+                'type': dump_type(col['type']),
+                'nullable': col['nullable'],
+                'primary_key': col['name'] in primary_key,
+                'default': col.get('default'),
+            } for col in inspector.get_columns(name)],
+        }
+
+    return {'version': 1, 'tables': tables}
+
+
+class SchemaSnapshot(object):
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f)['tables'])
+
+    def __contains__(self, table_name):
+        return table_name in self.tables
+
+    def discard(self, table_name):
+        """ Forget +table_name+, so that it is reflected from the database instead.
+        """
+        self.tables.pop(table_name, None)
+
+    def columns(self, table_name):
+        """ SQLAlchemy columns for +table_name+, or None if it isn't in the snapshot.
+        """
+        table = self.tables.get(table_name)
+        if table is None:
+            return None
+
+        return [
+            Column(
+                col['name'],
+                load_type(col['type']),
+                nullable=col['nullable'],
+                primary_key=col['primary_key'],
+                server_default=text(col['default']) if col.get('default') else None,
+            )
+            for col in table['columns']
+        ]
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_schema_snapshot():
+    """ The schema snapshot for this process, which is empty if there is no snapshot file.
+    """
+    global _snapshot
+
+    if _snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                path = settings.WAZIMAP.get('schema_snapshot')
+                if path and os.path.exists(path):
+                    _snapshot = SchemaSnapshot.load(path)
+                    log.info("Loaded schema snapshot for %d tables from %s" % (len(_snapshot.tables), path))
+                else:
+                    if path:
+                        log.warning("Schema snapshot %s doesn't exist, run `python manage.py snapshotschema`" % path)
+                    _snapshot = SchemaSnapshot()
+
+    return _snapshot
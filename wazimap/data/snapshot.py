@@ -0,0 +1,218 @@
+"""
+Read-only SQLite snapshots of a Wazimap database.
+
+`export_snapshot` writes Wazimap's metadata tables, the geographies and the
+database tables of every data table release into a single SQLite file. A site
+can then be served from the file, without Postgres, by setting the
+``SNAPSHOT_DATABASE`` environment variable to its path. This suits static
+mirrors and small deployments whose data doesn't change often.
+
+Postgres arrays, such as the fields of a FieldTable, are stored as JSON text.
+
+Use ``python manage.py exportsnapshot`` to write a snapshot.
+"""
+
+from itertools import islice
+import json
+import os
+
+from django.contrib.postgres.fields import ArrayField
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+    Text,
+    create_engine,
+    event,
+    text,
+)
+
+from wazimap.data.utils import _engine, STREAM_BATCH_SIZE
+from wazimap.models.geo import GeographyBase
+
+
+# SQLite column types for Django fields, by internal type. Other fields are stored as text.
+DJANGO_TYPES = {
+    'AutoField': Integer,
+    'BigAutoField': Integer,
+    'BigIntegerField': Integer,
+    'BooleanField': Boolean,
+    'DateField': Date,
+    'DateTimeField': DateTime,
+    'DecimalField': Numeric,
+    'FloatField': Float,
+    'ForeignKey': Integer,
+    'IntegerField': Integer,
+    'NullBooleanField': Boolean,
+    'OneToOneField': Integer,
+    'PositiveIntegerField': Integer,
+    'PositiveSmallIntegerField': Integer,
+    'SmallIntegerField': Integer,
+}
+
+
+def column_type(type_):
+    """ The generic type to use in SQLite for a column of the SQLAlchemy +type_+.
+    """
+    if isinstance(type_, Boolean):
+        return Boolean(create_constraint=False)
+    for generic in (Integer, Float, Numeric, DateTime, Date, String):
+        if isinstance(type_, generic):
+            return generic()
+    return Text()
+
+
+def metadata_models():
+    """ The Django models to include in a snapshot.
+    """
+    from wazimap.geo import geo_data
+    from wazimap.models import (
+        Dataset, Release, DBTable, SimpleTable, FieldTable, SimpleTableRelease,
+        FieldTableRelease, FieldTableColumn, DerivedIndicator)
+
+    return [
+        Dataset, Release, DBTable, SimpleTable, FieldTable, SimpleTableRelease,
+        FieldTableRelease, FieldTableColumn, DerivedIndicator, geo_data.geo_model]
+
+
+def release_db_tables():
+    """ The database tables, with their models, of every data table release.
+    """
+    from wazimap.models import SimpleTableRelease, FieldTableRelease
+
+    db_tables = {}
+    for release_class in (SimpleTableRelease, FieldTableRelease):
+        for table_release in release_class.objects.select_related('data_table', 'release').order_by('id'):
+            db_table = table_release.data_table.get_db_table(release=table_release.release)
+            db_tables.setdefault(db_table.name, db_table)
+
+    return list(db_tables.values())
+
+
+def model_table(model, metadata):
+    """ A SQLite table for the Django +model+, with indexes like those Django would create.
+    """
+    fields = model._meta.concrete_fields
+    name = model._meta.db_table
+
+    columns = []
+    for field in fields:
+        type_ = DJANGO_TYPES.get(field.get_internal_type(), Text)
+        type_ = Boolean(create_constraint=False) if type_ is Boolean else type_()
+        columns.append(Column(field.column, type_, primary_key=field.primary_key, nullable=field.null))
+    table = Table(name, metadata, *columns)
+
+    for field in fields:
+        if not field.primary_key and (field.db_index or field.unique or field.is_relation):
+            Index('ix_%s_%s' % (name, field.column), table.c[field.column], unique=field.unique)
+
+    for i, together in enumerate(model._meta.unique_together):
+        Index('uq_%s_%d' % (name, i), *[table.c[model._meta.get_field(f).column] for f in together], unique=True)
+
+    if issubclass(model, GeographyBase):
+        # children are found by their parent
+        Index('ix_%s_parent' % name, table.c.parent_level, table.c.parent_code, table.c.version)
+
+    return table
+
+
+def insert_rows(conn, table, keys, rows):
+    """ Insert +rows+, an iterator of tuples of values for the +keys+ columns, in batches.
+
+    :return: the number of rows inserted
+    """
+    count = 0
+    while True:
+        batch = [dict(zip(keys, row)) for row in islice(rows, STREAM_BATCH_SIZE)]
+        if not batch:
+            return count
+        conn.execute(table.insert(), batch)
+        count += len(batch)
+
+
+def export_model(conn, metadata, model):
+    table = model_table(model, metadata)
+    table.create(conn)
+
+    fields = model._meta.concrete_fields
+    arrays = [isinstance(f, ArrayField) for f in fields]
+
+    def values(row):
+        return [json.dumps(v) if is_array and v is not None else v for v, is_array in zip(row, arrays)]
+
+    rows = model.objects.order_by('pk').values_list(*[f.attname for f in fields]).iterator()
+    return insert_rows(conn, table, [f.column for f in fields], (values(r) for r in rows))
+
+
+def export_db_table(conn, metadata, db_table):
+    source = db_table.table
+    table = Table(
+        source.name, metadata,
+        *[Column(c.name, column_type(c.type), primary_key=c.primary_key, nullable=c.nullable)
+          for c in source.columns])
+    table.create(conn)
+
+    source_conn = _engine.connect().execution_options(stream_results=True)
+    try:
+        result = source_conn.execute(source.select().order_by(*source.primary_key.columns))
+        return insert_rows(conn, table, list(result.keys()), iter(result))
+    finally:
+        source_conn.close()
+
+
+def export_snapshot(path, progress=None):
+    """ Write a snapshot of the database to the SQLite file at +path+. The snapshot
+    is written to a temporary file which replaces +path+ once it is complete.
+
+    :param function progress: called with the name of each table and the number of rows
+                              in it, after the table has been exported
+    :return: the number of tables exported
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    engine = create_engine('sqlite:///%s' % tmp_path)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # the file is only used once it is complete
+        dbapi_connection.execute('PRAGMA journal_mode = OFF')
+        dbapi_connection.execute('PRAGMA synchronous = OFF')
+
+    metadata = MetaData()
+    tables = 0
+
+    try:
+        with engine.begin() as conn:
+            for model in metadata_models():
+                rows = export_model(conn, metadata, model)
+                tables += 1
+                if progress:
+                    progress(model._meta.db_table, rows)
+
+            for db_table in release_db_tables():
+                rows = export_db_table(conn, metadata, db_table)
+                tables += 1
+                if progress:
+                    progress(db_table.name, rows)
+
+            # statistics for the query planner
+            conn.execute(text('ANALYZE'))
+    except Exception:
+        engine.dispose()
+        os.remove(tmp_path)
+        raise
+
+    engine.dispose()
+    os.replace(tmp_path, path)
+
+    return tables
@@ -1,9 +1,17 @@
 from __future__ import division
 from collections import OrderedDict
+import json
+import os
+import sqlite3
 import threading
+from urllib.parse import quote
 
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData, String, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.elements import ColumnElement, TextClause
 
 from django.conf import settings
 from django.db.backends.base.creation import TEST_DATABASE_PREFIX
@@ -18,6 +26,29 @@ naming_convention = {
     "pk": "pk_%(table_name)s",
 }
 
+# bytes of a SQLite snapshot to memory-map
+SNAPSHOT_MMAP_SIZE = 1024 * 1024 * 1024
+
+
+def snapshot_engine(path):
+    """ A read-only engine for the SQLite snapshot at +path+, written by
+    ``python manage.py exportsnapshot``. The file is opened as immutable,
+    so SQLite doesn't lock it or check it for changes, and it is memory-mapped.
+    """
+    uri = "file:%s?mode=ro&immutable=1" % quote(os.path.abspath(path))
+
+    def connect():
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    engine = create_engine("sqlite://", creator=connect, poolclass=QueuePool)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA mmap_size = %d" % SNAPSHOT_MMAP_SIZE)
+
+    return engine
+
+
 if settings.TESTING:
     # Hack to ensure the sqlalchemy database name matches the Django one
     # during testing
@@ -33,11 +64,14 @@ if settings.TESTING:
     url = "/".join(parts)
     _engine = create_engine(url)
     _metadata = MetaData(bind=_engine, naming_convention=naming_convention)
+elif settings.WAZIMAP.get("snapshot_database"):
+    _engine = snapshot_engine(settings.WAZIMAP["snapshot_database"])
+    _metadata = MetaData(bind=_engine, naming_convention=naming_convention)
 else:
     _engine = create_engine(settings.DATABASE_URL)
-    _metadata = MetaData(
-        bind=_engine, naming_convention=naming_convention, reflect=True
-    )
+    # Tables are not reflected here, models for data tables are built as they're
+    # needed, see `wazimap.data.schema`.
+    _metadata = MetaData(bind=_engine, naming_convention=naming_convention)
 
 
 _Session = sessionmaker(bind=_engine)
@@ -46,11 +80,131 @@ _Session = sessionmaker(bind=_engine)
 # dictionaries that merge_dicts will merge
 MERGE_KEYS = set(["values", "numerators", "error"])
 
+# maximum number of geographies to send to the database in one query
+GEO_CHUNK_SIZE = 5000
+
+# number of rows to fetch at a time when streaming rows from a server-side cursor
+STREAM_BATCH_SIZE = 1000
+
 
 def get_session():
     return _Session()
 
 
+class GeoKeysClause(TextClause):
+    """ The SELECT behind `geo_keys`, which is compiled differently for Postgres and
+    for SQLite snapshots.
+    """
+
+    __visit_name__ = "geo_keys"
+    # the keys are bound when the clause is compiled, so it can't be cached
+    inherit_cache = False
+
+    def __init__(self, geos):
+        super(GeoKeysClause, self).__init__("")
+        self.geos = geos
+
+
+@compiles(GeoKeysClause)
+def compile_geo_keys(element, compiler, **kw):
+    # the keys are sent as three arrays
+    clause = TextClause(
+        "SELECT * FROM unnest(:geo_levels, :geo_codes, :geo_versions) "
+        "AS geo_keys(geo_level, geo_code, geo_version)"
+    ).bindparams(
+        bindparam("geo_levels", [g.geo_level for g in element.geos], type_=ARRAY(String)),
+        bindparam("geo_codes", [g.geo_code for g in element.geos], type_=ARRAY(String)),
+        bindparam("geo_versions", [g.version for g in element.geos], type_=ARRAY(String)),
+    )
+    return compiler.process(clause, **kw)
+
+
+@compiles(GeoKeysClause, "sqlite")
+def compile_geo_keys_sqlite(element, compiler, **kw):
+    # SQLite doesn't have arrays, so the keys are sent as a JSON list of lists
+    clause = TextClause(
+        "SELECT json_extract(value, '$[0]') AS geo_level, "
+        "json_extract(value, '$[1]') AS geo_code, "
+        "json_extract(value, '$[2]') AS geo_version "
+        "FROM json_each(:geo_keys)"
+    ).bindparams(
+        bindparam(
+            "geo_keys",
+            json.dumps([[g.geo_level, g.geo_code, g.version] for g in element.geos]),
+            type_=String,
+        )
+    )
+    return compiler.process(clause, **kw)
+
+
+def geo_keys(geos):
+    """ Build a relation of the (geo_level, geo_code, geo_version) keys of +geos+,
+    suitable for joining against a data table. The keys are sent as three arrays,
+    rather than as one clause per geography, so the query stays the same size
+    no matter how many geographies are asked for.
+    """
+    return (
+        GeoKeysClause(geos)
+        .columns(geo_level=String, geo_code=String, geo_version=String)
+        .alias("geo_keys")
+    )
+
+
+class byte_order(ColumnElement):
+    """ Order by +column+ using the byte values of its text, rather than the database's
+    collation. This is the "C" collation in Postgres and SQLite's default.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, column):
+        if hasattr(column, "__clause_element__"):
+            column = column.__clause_element__()
+        self.column = column
+        self.type = column.type
+
+    @property
+    def _from_objects(self):
+        return self.column._from_objects
+
+
+@compiles(byte_order)
+def compile_byte_order(element, compiler, **kw):
+    return '%s COLLATE "C"' % compiler.process(element.column, **kw)
+
+
+@compiles(byte_order, "sqlite")
+def compile_byte_order_sqlite(element, compiler, **kw):
+    return "%s COLLATE BINARY" % compiler.process(element.column, **kw)
+
+
+def geo_chunks(geos, size=GEO_CHUNK_SIZE):
+    """ Split +geos+ into lists of at most +size+ unique geographies.
+    """
+    seen = set()
+    chunk = []
+    for geo in geos:
+        key = (geo.geo_level, geo.geo_code, geo.version)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        chunk.append(geo)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def geo_sort_key(geo):
+    """ Sort key for geographies that matches rows ordered by geo level and code
+    using `byte_order`, which is how streamed data is ordered.
+    """
+    return (geo.geo_level, geo.geo_code)
+
+
 def capitalize(s):
     """
     Capitalize the first char of a string, without
@@ -287,6 +441,44 @@ def get_stat_data(
     return data_table.get_stat_data(fields, geo, session, **kwargs)
 
 
+def get_stat_data_for_geos(
+    fields,
+    geos,
+    session,
+    table_dataset=None,
+    table_universe=None,
+    table_fields=None,
+    table_name=None,
+    **kwargs
+):
+    """
+    Like `get_stat_data`, but builds the stats for a geography and its comparative
+    geographies in a single query. The values for the comparative geographies are
+    merged into the result, keyed by their geo level, as `merge_dicts` does::
+
+        geos = [geo] + geo_data.get_comparative_geos(geo)
+        data, total = get_stat_data_for_geos('gender', geos, session)
+
+    See `wazimap.models.data.FieldTable.get_stat_data_for_geos` for a full description
+    of all parameters.
+
+    :param list geos: the primary geography, followed by its comparative geographies
+
+    :return: (data-dictionary, total) for the primary geography
+    """
+    from wazimap.models import FieldTable
+
+    if not isinstance(fields, list):
+        fields = [fields]
+
+    table_fields = table_fields or fields
+
+    data_table = FieldTable.for_fields(
+        table_fields, universe=table_universe, dataset=table_dataset, name=table_name
+    )
+    return data_table.get_stat_data_for_geos(fields, geos, session, **kwargs)
+
+
 def get_table_for_fields(fields, universe=None, dataset=None):
     from wazimap.models import FieldTable
 
@@ -328,6 +520,11 @@ class DatasetContext(object):
 
     def __init__(self, **kwargs):
         self.year = kwargs.pop("year", None)
+        self.planner = None
+        if kwargs.pop("deferred", False):
+            from wazimap.data.deferred import DeferredStatPlanner
+
+            self.planner = DeferredStatPlanner()
 
     def get(self, name):
         val = getattr(self, name, None)
@@ -345,7 +542,11 @@ class DatasetContext(object):
         DatasetContext._threadlocal.dataset_context = self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        DatasetContext._threadlocal.dataset_context = self._prev_context
+        try:
+            if self.planner and exc_type is None:
+                self.planner.resolve()
+        finally:
+            DatasetContext._threadlocal.dataset_context = self._prev_context
 
     @classmethod
     def ensure_context(cls):
@@ -355,16 +556,21 @@ class DatasetContext(object):
         return ctx
 
 
-def dataset_context(year=None):
+def dataset_context(year=None, deferred=False):
     """ Sets the dataset context. Mostly used when setting the best release year to use when building
     a profile::
 
         with dataset_context(year='2011'):
             get_stat_data(...)
 
+    In deferred mode, `get_stat_data` returns a lazy result and the lookups are done
+    together, with one query per database table, when the context exits or when
+    a result is first used. See `wazimap.data.deferred`.
+
     :param str year: release year to use. Use 'latest' for the latest year.
+    :param bool deferred: defer and batch calls to `get_stat_data`.
     """
-    return DatasetContext(year=year)
+    return DatasetContext(year=year, deferred=deferred)
 
 
 def current_context():
@@ -376,21 +582,22 @@ def get_page_releases(dataset_name, geo, year, filter_releases=True):
     Return the active release being viewed and a list of related releases
     for a geo and dataset
     """
-    from wazimap.models import Dataset
+    from wazimap.data.registry import get_registry
 
     releases = {}
     releases.setdefault("other", [])
 
-    query = Dataset.objects.get(name=dataset_name).releases.order_by("-year")
+    query = get_registry().get_dataset_releases(dataset_name)
 
     # Some releases don't have data for all geo_levels
     available_years = settings.WAZIMAP["available_release_years"].get(
         geo.geo_level, None
     )
     if filter_releases and available_years:
-        query = query.filter(year__in=available_years)
+        available_years = [str(y) for y in available_years]
+        query = [r for r in query if r.year in available_years]
 
-    dataset_releases = [r.as_dict() for r in query.all()]
+    dataset_releases = [r.as_dict() for r in query]
 
     if year == "latest":
         releases["active"] = dataset_releases[0]
@@ -1,13 +1,25 @@
+import gc
+import importlib.util
 import os.path
 import json
 import logging
+import numbers
+import operator
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import reduce
 from itertools import chain
 
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from django.utils.module_loading import import_string
+from django.db import connection
 from django.db.models import Q
 from django.contrib.staticfiles.storage import staticfiles_storage
 
+from wazimap.data.geometry import read_geometry_cache, write_geometry_cache
 from wazimap.models import Geography
 
 log = logging.getLogger(__name__)
@@ -15,17 +27,94 @@ log = logging.getLogger(__name__)
 
 # GDAL is difficult to install, so we make it an optional dependency.
 # Here, we check if it's installed and warn if it isn't.
-try:
-    import osgeo.gdal  # noqa
-    HAS_GDAL = True
-except ImportError:
-    HAS_GDAL = False
+# GDAL is slow to import, so only check that it's installed
+HAS_GDAL = importlib.util.find_spec('osgeo') is not None
 
 
 class LocationNotFound(Exception):
     pass
 
 
+class ShapeIndex(object):
+    """ A spatial index of the shapes of geographies at one level, for finding the
+    geographies that contain a point without testing every shape.
+
+    Candidate shapes are found with an STRtree of their bounding boxes, and then
+    tested exactly with prepared geometries. Shapes are only prepared, and loaded
+    from a geometry cache, when they're first tested. When geometry is shared
+    between processes, only the most recently tested shapes are kept prepared.
+    """
+    def __init__(self, features, max_prepared=None):
+        """ :param list features: (geo_code, feature, bounding box) tuples
+            :param int max_prepared: keep prepared geometries for at most this many of the most
+                                     recently tested shapes, or for all of them if None
+        """
+        from shapely.geometry import box
+        from shapely.strtree import STRtree
+
+        self.codes = [code for code, feature, bbox in features]
+        self.features = [feature for code, feature, bbox in features]
+        self.boxes = [box(*bbox) for code, feature, bbox in features]
+        self.max_prepared = max_prepared
+        # position -> prepared geometry, least recently used first
+        self.prepared = OrderedDict()
+        self._lock = threading.Lock()
+        self.tree = STRtree(self.boxes)
+        # Shapely 1 returns the boxes themselves from queries, rather than their indexes
+        self.positions = dict((id(b), i) for i, b in enumerate(self.boxes))
+
+    def contains(self, i, point):
+        return self.prepared_shape(i).contains(point)
+
+    def prepared_shape(self, i):
+        with self._lock:
+            prepared = self.prepared.get(i)
+            if prepared is not None:
+                self.prepared.move_to_end(i)
+                return prepared
+
+        from shapely.prepared import prep
+        prepared = prep(self.features[i]['shape'])
+
+        with self._lock:
+            self.prepared[i] = prepared
+            if self.max_prepared is not None and len(self.prepared) > self.max_prepared:
+                self.prepared.popitem(last=False)
+
+        return prepared
+
+    def candidates(self, point):
+        for candidate in self.tree.query(point):
+            if isinstance(candidate, numbers.Integral):
+                yield int(candidate)
+            else:
+                yield self.positions[id(candidate)]
+
+    def codes_containing_points(self, coords):
+        """ The codes of the geographies containing each of the (x, y) +coords+, as a list of lists.
+
+        With Shapely 2, the bounding boxes of all the points are queried at once.
+        """
+        import shapely
+        from shapely.geometry import Point
+
+        if not hasattr(shapely, 'points'):
+            return [self.codes_containing(Point(x, y)) for x, y in coords]
+
+        results = [[] for c in coords]
+        if coords:
+            points = shapely.points(coords)
+            for i, j in zip(*self.tree.query(points)):
+                if self.contains(j, points[i]):
+                    results[i].append(self.codes[j])
+        return results
+
+    def codes_containing(self, point):
+        """ The codes of the geographies whose shapes contain +point+.
+        """
+        return [self.codes[i] for i in self.candidates(point) if self.contains(i, point)]
+
+
 class GeoData(object):
     """ General Wazimap geography helper object.
 
@@ -39,6 +128,12 @@ class GeoData(object):
     it available as `wazimap.geo.geo_data`.
     """
     _versions = None
+    spatial_index = None
+    _geometry_loaded = None
+    # set by preload, when shapes are shared with forked processes rather than kept
+    _shared = False
+    # how many prepared shapes each spatial index keeps when shapes are shared
+    shared_prepared_shapes = 200
 
     def __init__(self):
         self.geo_model = Geography
@@ -107,7 +202,10 @@ class GeoData(object):
         self.root_level = roots[0]
 
     def setup_geometry(self):
-        """ Load boundaries from geojson shape files.
+        """ Prepare to load boundaries from geojson shape files, or from a geometry cache.
+
+        The files are only checked here. The boundaries for a level and version are
+        loaded by `geometry_for_level` the first time they're used.
         """
         # map from levels to a dict of geoid-keyed feature
         # objects, including their geometry as shapely shapes
@@ -125,7 +223,18 @@ class GeoData(object):
         #
         self.geometry = {}
         self.geometry_files = settings.WAZIMAP.get('geometry_data', {})
+        # map from (version, level) tuples to ShapeIndex objects
+        self.spatial_index = {}
+        # the (version, level) tuples that have been loaded
+        self._geometry_loaded = set()
+        self._geometry_lock = threading.Lock()
+        self._geometry_cache = settings.WAZIMAP.get('geometry_cache')
+
+        self.check_geometry_files()
 
+    def check_geometry_files(self):
+        """ Check that the `WAZIMAP['geometry_data']` setting has a file name for each level and version.
+        """
         for level in self.geo_levels.keys():
             # sanity check for geo version
             if level in self.geometry_files or self.geometry_files.keys() == [''] and isinstance(self.geometry_files[''], basestring):
@@ -156,36 +265,155 @@ class GeoData(object):
                                  "change WAZIMAP['geometry_data'] to be: %s" % suggestion)
 
             for version in self.geometry_files.keys():
-                fname, js = self.load_geojson_for_level(level, version)
-                if not js:
-                    continue
+                self.geometry_file(level, version)
+
+    def geometry_for_level(self, version, level):
+        """ The features of geographies at +level+ and +version+, as a dict from geo code
+        to feature. They're loaded, and their spatial index built, on first use.
+        """
+        key = (version, level)
+        # subclasses may load all their geometry in setup_geometry
+        if self._geometry_loaded is not None and key not in self._geometry_loaded and version in self.geometry_files:
+            with self._geometry_lock:
+                if key not in self._geometry_loaded:
+                    start = time.time()
+                    self.load_geometry(version, level)
+                    log.info("Loaded geometry for level %s and version '%s' in %.3fs" % (level, version, time.time() - start))
+
+        return self.geometry.get(version, {}).get(level, {})
+
+    def load_geometry(self, version, level):
+        """ Load the features for +level+ and +version+ into `self.geometry` and index them.
+        A geometry cache is read in full, the first time any level is loaded.
+        """
+        if self._geometry_cache:
+            cache, self._geometry_cache = self._geometry_cache, None
+            geometry = read_geometry_cache(cache, self.geometry_files, with_shapes=HAS_GDAL,
+                                           keep_shapes=not self._shared)
+            if geometry is not None:
+                self.geometry.update(geometry)
+                self._geometry_loaded.update(
+                    (v, l) for v in self.geometry_files.keys() for l in self.geo_levels.keys())
+                self.setup_spatial_index()
+                return
+
+        level_detail = self.geometry.setdefault(version, {}).setdefault(level, {})
+        for fname, feature in self._geojson_features(level, version):
+            props = feature['properties']
+            shape = None
+
+            if HAS_GDAL and feature['geometry']:
+                from shapely.geometry import shape as make_shape
+                try:
+                    shape = make_shape(feature['geometry'])
+                except ValueError as e:
+                    log.error("Error parsing geometry for %s-%s from %s: %s. Feature: %s"
+                              % (level, props['code'], fname, e.message, feature), exc_info=e)
+                    raise e
+
+            level_detail[props['code']] = {
+                'properties': props,
+                'shape': shape
+            }
+
+        self._geometry_loaded.add((version, level))
+        self.index_level(version, level)
+
+    def preload(self):
+        """ Load the geometry for every level and version now, in a layout that
+        processes forked afterwards share, such as before gunicorn forks its workers.
+
+        Shapes are read from a memory-mapped geometry cache, which is built in a
+        temporary file if the `WAZIMAP['geometry_cache']` setting isn't set. Rather
+        than keeping every shape it uses, each worker's spatial indexes only keep
+        the `shared_prepared_shapes` most recently used, so that workers don't each
+        build up their own copies. Other shapes are deserialized each time they're used.
+        """
+        if self._geometry_loaded is None:
+            # subclasses may load all their geometry in setup_geometry
+            return
+
+        start = time.time()
+        self._shared = True
+        tmp_path = None
 
-                if js['type'] != 'FeatureCollection':
-                    raise ValueError("GeoJSON files must contain a FeatureCollection. The file %s has type %s" % (fname, js['type']))
+        if HAS_GDAL and not self._geometry_cache and not self._geometry_loaded:
+            fd, tmp_path = tempfile.mkstemp(suffix='.geometry')
+            os.close(fd)
+            write_geometry_cache(tmp_path, self.geometry_files, self.iter_geojson_features())
+            self._geometry_cache = tmp_path
+
+        try:
+            for version in self.geometry_files.keys():
+                for level in self.geo_levels.keys():
+                    self.geometry_for_level(version, level)
+        finally:
+            if tmp_path:
+                # the cache stays mapped once it's deleted
+                os.unlink(tmp_path)
+
+        if hasattr(gc, 'freeze'):
+            # keep the garbage collector from writing to, and so copying, the shared objects
+            gc.collect()
+            gc.freeze()
+
+        log.info("Preloaded geometry in %.3fs" % (time.time() - start))
+
+    def iter_geojson_features(self):
+        """ Load the GeoJSON files of the `WAZIMAP['geometry_data']` setting, and yield a
+        (version, level, file name, feature) tuple for each of their features.
+        """
+        for level in self.geo_levels.keys():
+            for version in self.geometry_files.keys():
+                for fname, feature in self._geojson_features(level, version):
+                    yield version, level, fname, feature
 
-                level_detail = self.geometry.setdefault(version, {}).setdefault(level, {})
+    def _geojson_features(self, level, version):
+        fname, js = self.load_geojson_for_level(level, version)
+        if not js:
+            return
 
-                for feature in js['features']:
-                    props = feature['properties']
-                    shape = None
+        if js['type'] != 'FeatureCollection':
+            raise ValueError("GeoJSON files must contain a FeatureCollection. The file %s has type %s" % (fname, js['type']))
 
-                    if HAS_GDAL and feature['geometry']:
-                        from shapely.geometry import asShape
-                        try:
-                            shape = asShape(feature['geometry'])
-                        except ValueError as e:
-                            log.error("Error parsing geometry for %s-%s from %s: %s. Feature: %s"
-                                      % (level, props['code'], fname, e.message, feature), exc_info=e)
-                            raise e
+        for feature in js['features']:
+            yield fname, feature
 
-                    level_detail[props['code']] = {
-                        'properties': props,
-                        'shape': shape
-                    }
+    def setup_spatial_index(self):
+        """ Build a `ShapeIndex` of the shapes for each loaded geometry version and level.
+        """
+        self.spatial_index = {}
+        for version, levels in self.geometry.items():
+            for level in levels.keys():
+                self.index_level(version, level)
 
-    def load_geojson_for_level(self, level, version):
+    def index_level(self, version, level):
+        """ Build a `ShapeIndex` of the shapes for +version+ and +level+.
+        """
+        if not HAS_GDAL:
+            return
+
+        indexed = []
+        for code, feature in self.geometry.get(version, {}).get(level, {}).items():
+            # features from a geometry cache know their bounding box without loading their shape
+            bbox = feature['bbox'] if 'bbox' in feature else (
+                feature['shape'].bounds if feature['shape'] is not None and not feature['shape'].is_empty
+                else None)
+            if bbox:
+                indexed.append((code, feature, bbox))
+
+        if indexed:
+            self.spatial_index[(version, level)] = ShapeIndex(
+                indexed, max_prepared=self.shared_prepared_shapes if self._shared else None)
+
+    def geometry_file(self, level, version):
+        """ The name of the geometry file for +level+ and +version+, relative to the static files, or None.
+        """
         files = self.geometry_files[version]
-        fname = files.get(level, files.get(''))
+        return files.get(level, files.get(''))
+
+    def load_geojson_for_level(self, level, version):
+        fname = self.geometry_file(level, version)
         if not fname:
             return None, None
 
@@ -240,7 +468,7 @@ class GeoData(object):
         with two keys, 'properties' which is a dict of properties,
         and 'shape' which is a shapely shape (may be None).
         """
-        return self.geometry.get(geo.version, {}).get(geo.geo_level, {}).get(geo.geo_code)
+        return self.geometry_for_level(geo.version, geo.geo_level).get(geo.geo_code)
 
     def get_locations(self, search_term, levels=None, version=None):
         """
@@ -253,7 +481,10 @@ class GeoData(object):
 
         query = self.geo_model.objects.filter(
             Q(name__icontains=search_term) | Q(geo_code=search_term.upper())
-        ).distinct("name")
+        )
+        if connection.features.can_distinct_on_fields:
+            # not supported by SQLite snapshots
+            query = query.distinct("name")
 
         if version is None:
             version = self.default_version
@@ -278,21 +509,88 @@ class GeoData(object):
         p = Point(float(longitude), float(latitude))
         geos = []
 
+        version = self._coords_version(version)
+        keys = set()
+        for level, index in self._spatial_indexes(levels, version):
+            keys.update((level, code) for code in index.codes_containing(p))
+
+        if not keys:
+            return geos
+
+        # fetch all the matching geographies at once
+        query = self.geo_model.objects.filter(
+            reduce(operator.or_, [Q(geo_level=level, geo_code=code) for level, code in keys]),
+            version=version)
+        geos = sorted(query, key=lambda g: self._level_sort_key(g.geo_level, g.geo_code))
+
+        return geos
+
+    def get_geoids_from_coords(self, coords, levels=None, version=None):
+        """
+        Find the geographies containing each of many points, querying the
+        spatial index of each level once for all the points.
+
+        :param list coords: (longitude, latitude) tuples
+        :return: a list with the geo ids of the geographies containing each point,
+                 from the root level down
+        """
+        if not HAS_GDAL:
+            gdal_missing(critical=True)
+
+        coords = [(float(lon), float(lat)) for lon, lat in coords]
+        version = self._coords_version(version)
+
+        matches = [[] for c in coords]
+        found = {}
+        for level, index in self._spatial_indexes(levels, version):
+            for i, codes in enumerate(index.codes_containing_points(coords)):
+                matches[i].extend((level, code) for code in codes)
+                found.setdefault(level, set()).update(codes)
+
+        if not found:
+            return [[] for c in coords]
+
+        # only geographies that exist, in a single query
+        query = self.geo_model.objects.filter(
+            reduce(operator.or_, [Q(geo_level=level, geo_code__in=codes) for level, codes in found.items()]),
+            version=version)
+        existing = set(query.values_list('geo_level', 'geo_code'))
+
+        return [
+            ['%s-%s' % key for key in sorted(keys, key=lambda k: self._level_sort_key(*k)) if key in existing]
+            for keys in matches]
+
+    def _coords_version(self, version):
         if version is None:
             version = self.default_version
         if version is None:
             version = self.global_latest_version
+        return version
 
-        for features in self.geometry.values():
-            for feature in features.values():
-                feature_key = list(feature.keys())[0]
-                if feature[feature_key]['shape'] and feature[feature_key]['shape'].contains(p):
-                    geo = self.get_geography(feature[feature_key]['properties']['code'],
-                                             feature[feature_key]['properties']['level'],
-                                             version)
-                    if not levels or geo.geo_level in levels:
-                        geos.append(geo)
-        return geos
+    def _spatial_indexes(self, levels, version):
+        """ The (level, `ShapeIndex`) tuples to search for geographies of +levels+ and +version+.
+        """
+        if self._geometry_loaded is None:
+            if self.spatial_index is None:
+                # subclasses may load geometry without building the index
+                self.setup_spatial_index()
+            available = self.geometry
+        else:
+            available = self.geometry_files
+
+        # use the shapes for this version, if there are any
+        versions = [version] if version in available else list(available.keys())
+        for geometry_version in versions:
+            for level in (levels or self.geo_levels.keys()):
+                self.geometry_for_level(geometry_version, level)
+
+        return [
+            (level, index) for (geometry_version, level), index in self.spatial_index.items()
+            if geometry_version in versions and (not levels or level in levels)]
+
+    def _level_sort_key(self, geo_level, geo_code):
+        # root level first
+        return len(self.geo_levels.get(geo_level, {}).get('ancestors', [])), geo_level, geo_code
 
     def get_summary_geo_info(self, geo):
         """ Get a list of (level, code) tuples of geographies that
@@ -322,7 +620,23 @@ class GeoData(object):
         return settings.WAZIMAP['primary_release_year'].get(geo.geo_level, 'latest')
 
 
-geo_data = import_string(settings.WAZIMAP['geodata'])()
+def load_geo_data():
+    start = time.time()
+    data = import_string(settings.WAZIMAP['geodata'])()
+    log.info("Set up %s in %.3fs" % (settings.WAZIMAP['geodata'], time.time() - start))
+    return data
+
+
+# created when it's first used, so that importing this module is cheap
+geo_data = SimpleLazyObject(load_geo_data)
+
+
+def preload_geometry():
+    """ Preload geometry if the `WAZIMAP['preload_geometry']` setting is set. Call this
+    before a server forks its worker processes, so that they share the geometry.
+    """
+    if settings.WAZIMAP.get('preload_geometry'):
+        geo_data.preload()
 
 
 def gdal_missing(critical=False):
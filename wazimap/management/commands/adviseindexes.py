@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from wazimap.data.indexes import MIN_IMPROVEMENT, MIN_ROWS, advise, create_indexes, index_sql
+from wazimap.data.utils import get_datatable
+from wazimap.models import SimpleTableRelease, FieldTableRelease
+
+
+class Command(BaseCommand):
+    help = "Recommends indexes for the database tables of data tables, by comparing the EXPLAIN costs of the " + \
+           "queries Wazimap issues with and without them. Candidate indexes are built in a transaction that " + \
+           "is rolled back, which blocks writes to each table while they're built."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*', help="Names of the data tables to check. Default: all tables.")
+        parser.add_argument('--create', action='store_true', default=False,
+                            help="Create the recommended indexes")
+        parser.add_argument('--concurrently', action='store_true', default=False,
+                            help="With --create, build the indexes without blocking writes, which takes longer")
+        parser.add_argument('--columns',
+                            help="Comma-separated columns of SimpleTables that maps and rankings read, "
+                                 "to include in their indexes. Default: all columns")
+        parser.add_argument('--min-rows', type=int, default=MIN_ROWS,
+                            help="Skip tables with fewer rows than this. Default: %d" % MIN_ROWS)
+        parser.add_argument('--min-improvement', type=float, default=MIN_IMPROVEMENT,
+                            help="The fraction by which an index must reduce the cost of a query to be "
+                                 "recommended. Default: %s" % MIN_IMPROVEMENT)
+
+    def handle(self, *args, **options):
+        if options['concurrently'] and not options['create']:
+            raise CommandError("--concurrently can only be used with --create")
+
+        releases = [
+            release_class.objects.select_related('data_table', 'db_table', 'release').order_by('id')
+            for release_class in [SimpleTableRelease, FieldTableRelease]]
+
+        if options['table']:
+            tables = []
+            for name in options['table']:
+                table = get_datatable(name)
+                if not table:
+                    raise CommandError("No data table named '%s'" % name)
+                tables.append(table)
+
+            releases = [
+                r.filter(data_table__in=[t for t in tables if t.release_class == r.model])
+                for r in releases]
+
+        columns = options['columns'].split(',') if options['columns'] else None
+
+        checked = set()
+        recommended = created = 0
+        for release_class in releases:
+            for table_release in release_class:
+                if table_release.db_table.name in checked:
+                    continue
+                checked.add(table_release.db_table.name)
+
+                data_table = table_release.data_table
+                db_table = data_table.get_db_table(release=table_release.release)
+                try:
+                    advice = advise(data_table, db_table, columns=columns, min_rows=options['min_rows'],
+                                    min_improvement=options['min_improvement'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+
+                self.stdout.write("%s: %d rows, %s" % (advice.name, advice.rows, filesizeformat(advice.size)))
+                if advice.skipped:
+                    self.stdout.write("  Skipped: %s" % advice.skipped)
+                    continue
+
+                for query, before, after in advice.costs:
+                    self.stdout.write("  %s %s: cost %.1f -> %.1f" % (query.level, query.kind, before, after))
+
+                if not advice.indexes:
+                    self.stdout.write("  No indexes recommended")
+                    continue
+
+                for index in advice.indexes:
+                    self.stdout.write("  Recommended: %s" % index_sql(advice.name, index))
+                recommended += len(advice.indexes)
+
+                if options['create']:
+                    try:
+                        names = create_indexes(advice, concurrently=options['concurrently'])
+                    except ValueError as e:
+                        raise CommandError(str(e))
+                    for name in names:
+                        self.stdout.write("  Created %s" % name)
+                    created += len(names)
+
+        self.stdout.write(self.style.SUCCESS("Recommended %d indexes for %d tables, created %d" % (
+            recommended, len(checked), created)))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.geometry import write_geometry_cache
+from wazimap.geo import geo_data
+
+
+class Command(BaseCommand):
+    help = "Builds a binary cache of the shapes in the GeoJSON files of WAZIMAP['geometry_data'], " + \
+           "which is read at startup rather than parsing the GeoJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            help="Where to write the cache. Default: WAZIMAP['geometry_cache'].")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.WAZIMAP.get('geometry_cache')
+        if not path:
+            raise CommandError("Give the path to write the cache to, or set WAZIMAP['geometry_cache']")
+
+        try:
+            count = write_geometry_cache(path, geo_data.geometry_files, geo_data.iter_geojson_features())
+        except ImportError:
+            raise CommandError("Shapely must be installed to build a geometry cache")
+
+        self.stdout.write(self.style.SUCCESS("Wrote %d features to %s" % (count, path)))
+        if path != settings.WAZIMAP.get('geometry_cache'):
+            self.stdout.write("Set WAZIMAP['geometry_cache'] to '%s' to use it" % path)
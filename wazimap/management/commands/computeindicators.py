@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.indicators import compute_indicators
+from wazimap.models import SimpleTable
+
+
+class Command(BaseCommand):
+    help = "Computes the derived indicators of SimpleTables for every geography, and stores them in the " + \
+           "tables' releases. Existing values of the indicators are replaced."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*',
+                            help="Names of the SimpleTables to compute. Default: all tables with derived indicators.")
+        parser.add_argument('--year', default='latest', help="Release year to compute. Default: latest")
+        parser.add_argument('--clear-cache', action='store_true', default=False,
+                            help="Clear the page cache afterwards, so that pages show the new data")
+
+    def handle(self, *args, **options):
+        if options['table']:
+            tables = []
+            for name in options['table']:
+                table = SimpleTable.find(name)
+                if not table:
+                    raise CommandError("No SimpleTable named '%s'" % name)
+                tables.append(table)
+        else:
+            tables = SimpleTable.objects.filter(indicators__isnull=False).distinct().order_by('name')
+
+        for table in tables:
+            if not table.get_release(options['year']):
+                raise CommandError("%s doesn't have a release for %s" % (table.name, options['year']))
+
+            try:
+                rows = compute_indicators(table, options['year'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write(self.style.SUCCESS("Computed %d rows of indicators for %s" % (rows, table.name)))
+
+        if options['clear_cache']:
+            cache.clear()
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.geokeys import convert_to_geo_ids
+from wazimap.data.utils import get_datatable
+from wazimap.models import DBTable, SimpleTableRelease, FieldTableRelease
+
+
+class Command(BaseCommand):
+    help = "Converts the database tables of data tables from geo_level, geo_code and geo_version columns to " + \
+           "an integer geo_id column that references the geography, which makes them smaller. " + \
+           "Restart Wazimap afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*', help="Names of the data tables to convert. Default: all tables.")
+
+    def handle(self, *args, **options):
+        releases = [
+            release_class.objects.select_related('data_table', 'db_table', 'release').order_by('id')
+            for release_class in [SimpleTableRelease, FieldTableRelease]]
+
+        if options['table']:
+            tables = []
+            for name in options['table']:
+                table = get_datatable(name)
+                if not table:
+                    raise CommandError("No data table named '%s'" % name)
+                tables.append(table)
+
+            releases = [
+                r.filter(data_table__in=[t for t in tables if t.release_class == r.model])
+                for r in releases]
+
+        converted = set()
+        for release_class in releases:
+            for table_release in release_class:
+                if table_release.db_table.name in converted or table_release.db_table.geo_key == DBTable.GEO_ID:
+                    continue
+
+                db_table = table_release.data_table.get_db_table(release=table_release.release)
+                try:
+                    rows = convert_to_geo_ids(db_table)
+                except ValueError as e:
+                    raise CommandError(str(e))
+
+                converted.add(db_table.name)
+                self.stdout.write("Converted %d rows of %s" % (rows, db_table.name))
+
+        self.stdout.write(self.style.SUCCESS("Converted %d tables" % len(converted)))
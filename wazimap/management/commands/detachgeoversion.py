@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.partitions import detach_version, partitioned_tables
+from wazimap.data.utils import _engine
+from wazimap.models import DBTable
+
+
+class Command(BaseCommand):
+    help = "Retires a geo version by detaching its partitions from every partitioned data table. " + \
+           "The detached tables keep their rows, unless --drop is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', help="The geo version to retire.")
+        parser.add_argument('--drop', action='store_true', help="Drop the detached partitions.")
+
+    def handle(self, *args, **options):
+        version = options['version']
+        names = list(DBTable.objects.values_list('name', flat=True))
+
+        with _engine.connect() as conn:
+            tables = partitioned_tables(conn, names)
+        if not tables:
+            raise CommandError("There are no partitioned data tables")
+
+        detached = []
+        for name in tables:
+            with _engine.begin() as conn:
+                partitions = detach_version(conn, name, version, drop=options['drop'])
+
+            for partition in partitions:
+                self.stdout.write("%s %s" % ("Dropped" if options['drop'] else "Detached", partition))
+            detached.extend(partitions)
+
+        self.stdout.write(self.style.SUCCESS("Detached %d partitions for version '%s'" % (len(detached), version)))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from wazimap.data.snapshot import export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Writes Wazimap's metadata, the geographies and the data for every data table release into a " + \
+           "read-only SQLite snapshot, which can be served without Postgres by setting SNAPSHOT_DATABASE."
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="SQLite file to write the snapshot to. An existing file is replaced.")
+
+    def handle(self, *args, **options):
+        def progress(name, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write("Exported %d rows from %s" % (rows, name))
+
+        tables = export_snapshot(options['file'], progress=progress)
+
+        self.stdout.write(self.style.SUCCESS("Wrote %d tables to %s" % (tables, options['file'])))
@@ -0,0 +1,83 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.indicators import compute_indicators, indicator_tables
+from wazimap.data.loader import DataTableLoader, open_csv
+from wazimap.data.utils import get_datatable
+from wazimap.models import FieldTable
+
+
+class Command(BaseCommand):
+    help = "Loads a CSV file, which may be gzipped, into the database table for a release of a data table. " + \
+           "The file's header row must name the table's columns, such as geo_level,geo_code,gender,total."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', help="Name of the SimpleTable or FieldTable")
+        parser.add_argument('year', help="Year of the release to load data for, or 'latest'")
+        parser.add_argument('file', help="CSV file to load, ending in .gz if it is gzipped")
+        parser.add_argument('--chunk-size', type=int, default=DataTableLoader.CHUNK_SIZE,
+                            help="Number of rows to send to the database at a time. Default: %s" % DataTableLoader.CHUNK_SIZE)
+        parser.add_argument('--truncate', action='store_true', default=False,
+                            help="Remove the existing data for this release before loading")
+        parser.add_argument('--swap', action='store_true', default=False,
+                            help="Replace the existing data for this release without downtime, by loading into a "
+                                 "shadow table and swapping it for the live table")
+        parser.add_argument('--lock-timeout', type=int, default=5,
+                            help="With --swap, seconds to wait for queries on the live table before trying again. Default: 5")
+        parser.add_argument('--compute-indicators', action='store_true', default=False,
+                            help="Recompute the derived indicators that use this table, for the same release year")
+        parser.add_argument('--clear-cache', action='store_true', default=False,
+                            help="Clear the page cache after loading, so that pages show the new data")
+
+    def handle(self, *args, **options):
+        if options['truncate'] and options['swap']:
+            raise CommandError("Use either --truncate or --swap, not both")
+
+        table = get_datatable(options['table'])
+        if not table:
+            raise CommandError("No data table named '%s'" % options['table'])
+
+        release = table.get_release(options['year'])
+        if not release:
+            raise CommandError("%s doesn't have a release for %s" % (table.name, options['year']))
+
+        table.ensure_db_tables_exist()
+        db_table = table.get_db_table(release=release)
+        loader = DataTableLoader(table, db_table, chunk_size=options['chunk_size'])
+
+        start = time.time()
+
+        def progress(rows):
+            if options['verbosity'] > 1:
+                self.stdout.write("Loaded %d rows (%d rows/s)" % (rows, rows / max(time.time() - start, 0.001)))
+
+        try:
+            with open_csv(options['file']) as f:
+                if options['swap']:
+                    rows = loader.swap(f, progress=progress, lock_timeout=options['lock_timeout'])
+                else:
+                    rows = loader.load(f, truncate=options['truncate'], progress=progress)
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+        elapsed = max(time.time() - start, 0.001)
+
+        if isinstance(table, FieldTable):
+            table_release = table.release_class.objects.get(data_table=table, release=release)
+            table_release.rebuild_column_catalog(db_table)
+
+        if options['compute_indicators']:
+            for indicator_table in indicator_tables(table):
+                try:
+                    indicator_rows = compute_indicators(indicator_table, release.year)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write("Computed %d rows of indicators for %s" % (indicator_rows, indicator_table.name))
+
+        if options['clear_cache']:
+            cache.clear()
+
+        self.stdout.write(self.style.SUCCESS("Loaded %d rows into %s in %.1fs (%d rows/s)" % (
+            rows, db_table.name, elapsed, rows / elapsed)))
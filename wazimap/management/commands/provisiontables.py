@@ -0,0 +1,52 @@
+from itertools import chain
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.models import SimpleTableRelease, FieldTableRelease
+from wazimap.models.data import provision_db_tables
+from wazimap.data.partitions import create_partitions, partitioned_tables
+from wazimap.data.utils import _engine, get_datatable
+
+
+class Command(BaseCommand):
+    help = "Creates the database tables for data table releases that don't exist yet, and the partitions " + \
+           "of partitioned tables for new geo levels and versions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*', help="Names of the data tables to provision. Default: all tables.")
+
+    def handle(self, *args, **options):
+        releases = [
+            release_class.objects.select_related('data_table', 'db_table', 'release')
+            for release_class in [SimpleTableRelease, FieldTableRelease]]
+
+        if options['table']:
+            tables = []
+            for name in options['table']:
+                table = get_datatable(name)
+                if not table:
+                    raise CommandError("No data table named '%s'" % name)
+                tables.append(table)
+
+            releases = [
+                r.filter(data_table__in=[t for t in tables if t.release_class == r.model])
+                for r in releases]
+
+        releases = list(chain(*releases))
+        created = provision_db_tables(releases)
+
+        for name in created:
+            self.stdout.write("Created %s" % name)
+        self.stdout.write(self.style.SUCCESS("Created %d tables" % len(created)))
+
+        if settings.WAZIMAP.get('partition_data_tables'):
+            names = set(r.db_table.name for r in releases if r.db_table)
+            partitions = []
+            with _engine.begin() as conn:
+                for name in partitioned_tables(conn, names):
+                    partitions.extend(create_partitions(conn, name))
+
+            for name in partitions:
+                self.stdout.write("Created partition %s" % name)
+            self.stdout.write(self.style.SUCCESS("Created %d partitions" % len(partitions)))
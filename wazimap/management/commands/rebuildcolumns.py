@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.models import FieldTable, FieldTableRelease
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the column catalog for FieldTables. Run this after changing a table's data directly in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='*', help="Names of the FieldTables to rebuild. Default: all tables.")
+        parser.add_argument('--year', help="Only rebuild the catalog for this release year.")
+
+    def handle(self, *args, **options):
+        releases = FieldTableRelease.objects.select_related('data_table', 'release', 'db_table')
+
+        if options['table']:
+            tables = []
+            for name in options['table']:
+                table = FieldTable.find(name)
+                if not table:
+                    raise CommandError("No FieldTable named '%s'" % name)
+                tables.append(table)
+            releases = releases.filter(data_table__in=tables)
+
+        if options['year']:
+            releases = releases.filter(release__year=options['year'])
+
+        for table_release in releases.order_by('data_table__name', 'release__year'):
+            columns = table_release.rebuild_column_catalog()
+            self.stdout.write(self.style.SUCCESS("Rebuilt %d columns for %s" % (len(columns), table_release)))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.rollup import rollup
+from wazimap.models import FieldTable
+
+
+class Command(BaseCommand):
+    help = "Sums the data for geographies at one level into rows for each of their ancestors, for FieldTables " + \
+           "that are only published at a low level. Existing data for the ancestors is replaced."
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', nargs='+', help="Names of the FieldTables to roll up")
+        parser.add_argument('--from', dest='level', required=True, help="Geo level that has the data, such as 'ward'")
+        parser.add_argument('--to', dest='levels', action='append',
+                            help="Ancestor level to roll up to. Can be used multiple times. Default: all ancestors.")
+        parser.add_argument('--year', default='latest', help="Release year to roll up. Default: latest")
+        parser.add_argument('--geo', dest='geo_codes', action='append',
+                            help="Code of a geography at the --from level whose data has changed. Only its "
+                                 "ancestors are recalculated. Can be used multiple times.")
+
+    def handle(self, *args, **options):
+        tables = []
+        for name in options['table']:
+            table = FieldTable.find(name)
+            if not table:
+                raise CommandError("No FieldTable named '%s'" % name)
+            tables.append(table)
+
+        for table in tables:
+            release = table.get_release(options['year'])
+            if not release:
+                raise CommandError("%s doesn't have a release for %s" % (table.name, options['year']))
+
+            db_table = table.get_db_table(release=release)
+            try:
+                rows = rollup(table, db_table, options['level'], levels=options['levels'], geo_codes=options['geo_codes'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write(self.style.SUCCESS("Rolled up %s into %d rows for %s" % (
+                options['level'], rows, table.name)))
@@ -0,0 +1,29 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wazimap.data.schema import dump_schema
+from wazimap.data.utils import _engine
+from wazimap.models import DBTable
+
+
+class Command(BaseCommand):
+    help = "Stores the columns of all data tables in a schema snapshot, so that they don't have to be read from the database " + \
+           "when Wazimap starts. Run this after adding or changing data tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write the snapshot to. Default: WAZIMAP['schema_snapshot']")
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.WAZIMAP.get('schema_snapshot')
+        if not path:
+            raise CommandError("Specify an output file with --output, or set WAZIMAP['schema_snapshot']")
+
+        names = DBTable.objects.values_list('name', flat=True)
+        schema = dump_schema(_engine, names)
+
+        with open(path, 'w') as f:
+            json.dump(schema, f, indent=2, sort_keys=True)
+
+        self.stdout.write(self.style.SUCCESS("Wrote schema for %d tables to %s" % (len(schema['tables']), path)))
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.6 on 2026-10-17 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wazimap', '0014_auto_20191021_1216'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldTableColumn',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('column_id', models.CharField(max_length=1024)),
+                ('name', models.CharField(max_length=1024)),
+                ('indent', models.PositiveSmallIntegerField(default=0)),
+                ('position', models.PositiveIntegerField()),
+                ('table_release', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='wazimap.FieldTableRelease')),
+            ],
+            options={
+                'ordering': ['table_release', 'position'],
+            },
+        ),
+    ]
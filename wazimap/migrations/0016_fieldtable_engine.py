@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-17 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wazimap', '0015_fieldtablecolumn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldtable',
+            name='engine',
+            field=models.CharField(choices=[('sql', 'Database'), ('columnar', 'Columnar, in memory')], default='sql', help_text="How stats are calculated. The columnar engine loads each release into memory the first time it's used, which makes stats faster for heavily used tables. It requires NumPy.", max_length=20),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-17 12:40
+
+from django.db import migrations, models
+import wazimap.models.data
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wazimap', '0016_fieldtable_engine'),
+    ]
+
+    operations = [
+        # existing tables are keyed by geo codes
+        migrations.AddField(
+            model_name='dbtable',
+            name='geo_key',
+            field=models.CharField(choices=[('geo_codes', 'Geo level, code and version'), ('geo_id', 'Geography id')], default='geo_codes', max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='dbtable',
+            name='geo_key',
+            field=models.CharField(choices=[('geo_codes', 'Geo level, code and version'), ('geo_id', 'Geography id')], default=wazimap.models.data.default_geo_key, help_text="How rows are linked to their geography. Tables keyed by geography id are smaller and faster. Use 'python manage.py convertgeokeys' to convert an existing table.", max_length=20),
+        ),
+    ]
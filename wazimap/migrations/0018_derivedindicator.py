@@ -0,0 +1,28 @@
+# Generated by Django 2.2.6 on 2026-10-17 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wazimap', '0017_dbtable_geo_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DerivedIndicator',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text="Name of the table column to store the indicator in, such as 'persons_per_household'.", max_length=50)),
+                ('expression', models.TextField(help_text="How to calculate the indicator, such as '{POPULATION.total} / {HOUSEHOLDS.total}'. Refer to a SimpleTable column as {TABLE.column}, to the total of a FieldTable as {TABLE} and to the total of some of its rows as {TABLE:field=value,field=value}.")),
+                ('description', models.CharField(blank=True, max_length=200, null=True)),
+                ('table', models.ForeignKey(help_text="SimpleTable to store the indicator in. It's computed for each of the table's releases.", on_delete=django.db.models.deletion.CASCADE, related_name='indicators', to='wazimap.SimpleTable')),
+            ],
+            options={
+                'ordering': ['table', 'name'],
+                'unique_together': {('table', 'name')},
+            },
+        ),
+    ]
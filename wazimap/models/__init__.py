@@ -1,2 +1,2 @@
 from .geo import GeographyBase, GeoMixin, Geography  # noqa
-from .data import FieldTable, SimpleTable, DBTable, Dataset, Release, FieldTableRelease, SimpleTableRelease  # noqa
+from .data import FieldTable, SimpleTable, DBTable, Dataset, Release, FieldTableRelease, SimpleTableRelease, FieldTableColumn, DerivedIndicator  # noqa
@@ -24,28 +24,69 @@ for a set of fields, the one with the fewest extraneous fields is chosen.
 """
 
 from collections import OrderedDict
+import json
+import logging
 import re
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.utils.text import slugify
 from django.contrib.postgres.fields import ArrayField
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 
 from itertools import groupby
-from wazimap.data.base import Base
+from wazimap.data.base import Base, ModelRegistry
+from wazimap.data.columnar import (
+    get_columnar_table,
+    rows_for_geos as columnar_rows_for_geos,
+)
+from wazimap.data.geokeys import (
+    GEO_COLUMNS,
+    geo_code_columns,
+    geo_id_column,
+    geo_id_model,
+)
+from wazimap.data.partitions import (
+    is_partitioned,
+    partition_on_create,
+    table_kwargs,
+)
+from wazimap.data.registry import get_registry, invalidate_registry, metadata_changed
+from wazimap.data.schema import get_schema_snapshot
 from wazimap.data.utils import (
     get_session,
     capitalize,
     percent as p,
     add_metadata,
+    byte_order,
     current_context,
+    geo_keys,
+    geo_chunks,
+    geo_sort_key,
+    get_datatable,
+    merge_dicts,
+    STREAM_BATCH_SIZE,
+)
+from sqlalchemy import (
+    Column,
+    String,
+    Table,
+    and_,
+    case,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    null,
+    union_all,
 )
-from sqlalchemy import Column, String, Table, or_, and_, func, text
 from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy.orm import class_mapper
 import sqlalchemy.types
 
+log = logging.getLogger(__name__)
+
 
 class DataNotFound(Exception):
     pass
@@ -106,10 +147,23 @@ class Release(models.Model):
         return {"name": self.name, "year": self.year, "citation": self.citation}
 
 
+def default_geo_key():
+    if settings.WAZIMAP.get("geo_id_keys"):
+        return DBTable.GEO_ID
+    return DBTable.GEO_CODES
+
+
 class DBTable(models.Model):
     """ Pointer to a table in the database that contains actual data.
     """
 
+    GEO_CODES = "geo_codes"
+    GEO_ID = "geo_id"
+    GEO_KEY_CHOICES = (
+        (GEO_CODES, "Geo level, code and version"),
+        (GEO_ID, "Geography id"),
+    )
+
     # TODO: validator on name
     name = models.CharField(
         max_length=100,
@@ -118,8 +172,16 @@ class DBTable(models.Model):
         blank=False,
         help_text="Name of the physical database table containing data for this DB table.",
     )
+    geo_key = models.CharField(
+        max_length=20,
+        null=False,
+        default=default_geo_key,
+        choices=GEO_KEY_CHOICES,
+        help_text="How rows are linked to their geography. Tables keyed by geography id are smaller and faster. "
+        + "Use 'python manage.py convertgeokeys' to convert an existing table.",
+    )
     # Cache of SQLALchemy models for each db table
-    MODELS = {}
+    MODELS = ModelRegistry(Base.metadata, settings.WAZIMAP.get("model_cache_size"))
 
     class Meta:
         ordering = ["name"]
@@ -140,6 +202,14 @@ class DBTable(models.Model):
         DBTable.MODELS[self.name] = model
         self._model = model
 
+    @property
+    def table(self):
+        """ The SQLAlchemy table for the database table.
+        """
+        table = self.model.__table__
+        # models for tables keyed by geo_id are mapped to a join, see `wazimap.data.geokeys`
+        return getattr(table, "left", table)
+
     def __str__(self):
         return "DBTable<%s>" % self.name
 
@@ -188,16 +258,7 @@ class DataTable(models.Model):
     def get_release(self, year):
         """ Get the Release description for the specified year.
         """
-        query = self.release_class.objects.filter(data_table=self)
-
-        if year == "latest":
-            query = query.order_by("-release__year")
-        else:
-            query = query.filter(release__year=year)
-
-        result = query.first()
-        if result:
-            return result.release
+        return get_registry().get_release(self, year)
 
     def get_db_table(self, release=None, year=None):
         """ Get a DBTable instance for a particular year or release,
@@ -218,22 +279,27 @@ class DataTable(models.Model):
             )
 
         # get the db_table
-        fieldname = self.release_class.__name__.lower() + "__release"
-        query = self.db_table_releases.filter(**{fieldname: release})
-
-        db_table = query.first()
+        db_table = get_registry().get_db_table(self, release)
         db_table.active_release = release
         self.setup_model(db_table)
 
         return db_table
 
     def setup_model(self, db_table):
+        """ Ensure +db_table+ has the model that corresponds to the table underlying
+        this data table, building it if necessary.
+        """
+        db_table.model = DBTable.MODELS.get_or_create(
+            db_table.name, lambda: self.build_model(db_table)
+        )
+
+    def build_model(self, db_table):
         pass
 
     def _build_description(self):
         pass
 
-    def _build_model_columns(self):
+    def _build_model_columns(self, db_table):
         # We build this array in a particular order, with the geo-related fields first,
         # to ensure that SQLAlchemy creates the underlying table with the compound primary
         # key columns in the correct order:
@@ -243,24 +309,25 @@ class DataTable(models.Model):
         # This means postgresql will use the first two elements of the compound primary
         # key -- geo_level and geo_code -- when looking up values for a particular
         # geograhy. This saves us from having to create a secondary index.
-        columns = []
+        #
+        # Tables keyed by geo_id have just the geo_id column instead.
 
         # will form a compound primary key on the fields, and the geo id
-        columns.append(
-            Column("geo_level", String(15), nullable=False, primary_key=True)
-        )
-        columns.append(Column("geo_code", String(10), nullable=False, primary_key=True))
-        columns.append(
-            Column(
-                "geo_version",
-                String(100),
-                nullable=False,
-                primary_key=True,
-                server_default="",
-            )
-        )
+        if db_table.geo_key == DBTable.GEO_ID:
+            return [geo_id_column()]
+        return geo_code_columns(primary_key=True)
 
-        return columns
+    def _build_model_class(self, db_table, table):
+        if db_table.geo_key == DBTable.GEO_ID:
+            return geo_id_model(table)
+
+        if is_partitioned(db_table):
+            partition_on_create(table)
+
+        class Model(Base):
+            __table__ = table
+
+        return Model
 
     def as_dict(self):
         return {
@@ -274,27 +341,92 @@ class DataTable(models.Model):
         }
 
     def releases(self):
-        return list(
-            set(
-                r.release
-                for r in self.release_class.objects.filter(data_table=self)
-                .prefetch_related("release")
-                .all()
-            )
-        )
+        releases = []
+        for release, db_table in get_registry().releases_for(self):
+            if release not in releases:
+                releases.append(release)
+        return releases
+
+    def get_time_series(self, geos, fields=None, years=None):
+        """ Get the values of this table for one or more geographies in several releases.
+
+        The release tables are combined with UNION ALL, so the values for all
+        the releases are fetched in a single query.
+
+        :param geos: a geography, or a list of geographies
+        :param list fields: for SimpleTables, the columns to fetch, all columns by default.
+                            For FieldTables, the fields to group rows by, all fields by default.
+        :param list years: release years, all the table's releases by default
+
+        :return: a dict with ``years``, the release years in order, and ``geos``, a dict from
+                 geo id to the series for that geography. A series maps each key to a list
+                 of values aligned with ``years``, with None for releases without data.
+                 For FieldTables, the keys are nested by field, like `get_stat_data`.
+        """
+        if not isinstance(geos, (list, tuple)):
+            geos = [geos]
+
+        if years is None:
+            releases = self.releases()
+        else:
+            releases = []
+            for year in years:
+                release = self.get_release(year)
+                if not release:
+                    raise ValueError("%s doesn't have a release for %s" % (self.name, year))
+                releases.append(release)
+        releases = sorted(set(releases), key=lambda r: r.year)
+
+        db_tables = [self.get_db_table(release=r) for r in releases]
+        fields = self._time_series_fields(fields, db_tables)
+
+        series = OrderedDict((g.geoid, OrderedDict()) for g in geos)
+        geo_ids = dict(((g.geo_level, g.geo_code, g.version), g.geoid) for g in geos)
+        positions = dict((r.year, i) for i, r in enumerate(releases))
+
+        if releases:
+            session = get_session()
+            try:
+                for chunk in geo_chunks(geos):
+                    keys = geo_keys(chunk)
+                    query = union_all(
+                        *[
+                            self._time_series_query(session, db_table, fields, keys)
+                            .add_columns(literal(release.year).label("year"))
+                            .statement
+                            for release, db_table in zip(releases, db_tables)
+                        ]
+                    )
+
+                    for row in session.execute(query):
+                        geo_id = geo_ids[(row.geo_level, row.geo_code, row.geo_version)]
+                        self._add_time_series_row(
+                            series[geo_id], row, fields, positions[row.year], len(releases)
+                        )
+            finally:
+                session.close()
+
+        return {"years": [r.year for r in releases], "geos": series}
+
+    def _geo_columns(self, db_model):
+        return [
+            db_model.geo_level.label("geo_level"),
+            db_model.geo_code.label("geo_code"),
+            db_model.geo_version.label("geo_version"),
+        ]
 
     def ensure_db_tables_exist(self):
-        for release in self.release_class.objects.all():
-            release.ensure_db_table_exists()
+        """ Ensure that the database tables behind this table's releases exist.
+        """
+        provision_db_tables(
+            self.release_class.objects.filter(data_table=self).select_related(
+                "data_table", "db_table", "release"
+            )
+        )
 
     @classmethod
     def find(cls, name, universe=None, dataset=None):
-        candidates = cls.objects.filter(name__iexact=name)
-        if universe:
-            candidates = candidates.filter(universe__iexact=universe)
-        if dataset:
-            candidates = candidates.filter(dataset__name__iexact=dataset)
-        return candidates.first()
+        return get_registry().find(cls, name, universe=universe, dataset=dataset)
 
 
 class SimpleTable(DataTable):
@@ -367,6 +499,11 @@ class SimpleTable(DataTable):
             if fields is not None and not isinstance(fields, list):
                 fields = [fields]
             if fields:
+                if any(f not in columns for f in fields):
+                    self._reload_model(db_table)
+                    model = db_table.model
+                    columns = self.columns(db_table)
+
                 for f in fields:
                     if f not in columns:
                         raise ValueError(
@@ -392,7 +529,7 @@ class SimpleTable(DataTable):
                 )
 
             # table columns to fetch
-            cols = [model.__table__.columns[c] for c in fields]
+            cols = [db_table.table.columns[c] for c in fields]
 
             if total is not None and isinstance(total, str) and total not in cols:
                 cols.append(total)
@@ -400,6 +537,7 @@ class SimpleTable(DataTable):
             # do the query. If this returns no data, row is None
             row = (
                 session.query(*cols)
+                .select_from(model)
                 .filter(
                     model.geo_level == geo.geo_level,
                     model.geo_code == geo.geo_code,
@@ -455,44 +593,86 @@ class SimpleTable(DataTable):
             session.close()
 
     def raw_data_for_geos(self, geos, release=None, year=None):
+        """ Pull raw data for a list of geo models.
+
+        Returns a dict mapping the geo ids to table data.
+        """
         # initial values
         data = {
             ("%s-%s" % (geo.geo_level, geo.geo_code)): {"estimate": {}, "error": {}}
             for geo in geos
         }
 
+        data.update(self.iter_raw_data_for_geos(geos, release=release, year=year))
+        return data
+
+    def iter_raw_data_for_geos(self, geos, release=None, year=None):
+        """ Stream raw data for a list of geo models, using a server-side cursor.
+
+        Yields a (geo id, table data) tuple for each geo that has data,
+        ordered by `geo_sort_key`.
+        """
         db_table = self.get_db_table(release=release, year=year)
         columns = self.columns(db_table)
+        model = db_table.model
 
         session = get_session()
         try:
-            geo_values = None
-            rows = (
-                session.query(db_table.model)
-                .filter(
-                    or_(
-                        and_(
-                            db_table.model.geo_level == g.geo_level,
-                            db_table.model.geo_code == g.geo_code,
-                            db_table.model.geo_version == g.version,
-                        )
-                        for g in geos
-                    )
+            for chunk in geo_chunks(sorted(geos, key=geo_sort_key)):
+                keys = geo_keys(chunk)
+                rows = (
+                    session.query(model)
+                    .join(keys, join_geo_keys(model, keys))
+                    .order_by(byte_order(model.geo_level), byte_order(model.geo_code))
+                    .yield_per(STREAM_BATCH_SIZE)
                 )
-                .all()
-            )
 
-            for row in rows:
-                geo_values = data["%s-%s" % (row.geo_level, row.geo_code)]
+                for row in rows:
+                    geo_values = {"estimate": {}, "error": {}}
+                    for col in columns.keys():
+                        geo_values["estimate"][col] = getattr(row, col)
+                        geo_values["error"][col] = 0
 
-                for col in columns.keys():
-                    geo_values["estimate"][col] = getattr(row, col)
-                    geo_values["error"][col] = 0
+                    yield "%s-%s" % (row.geo_level, row.geo_code), geo_values
 
         finally:
             session.close()
 
-        return data
+    def _time_series_fields(self, fields, db_tables):
+        if fields is None:
+            # the columns of all the releases, in order
+            fields = []
+            for db_table in db_tables:
+                fields.extend(c for c in self.columns(db_table) if c not in fields)
+            return fields
+
+        if not isinstance(fields, list):
+            fields = [fields]
+        for f in fields:
+            if not any(f in db_table.table.columns for db_table in db_tables):
+                for db_table in db_tables:
+                    self._reload_model(db_table)
+            if not any(f in db_table.table.columns for db_table in db_tables):
+                raise ValueError("Invalid column '%s' for table '%s'" % (f, self.id))
+        return fields
+
+    def _time_series_query(self, session, db_table, fields, keys):
+        db_model = db_table.model
+        columns = db_table.table.columns
+        # releases without a column have nulls instead
+        values = [
+            (columns[f] if f in columns else null()).label(f) for f in fields
+        ]
+
+        return (
+            session.query(*(self._geo_columns(db_model) + values))
+            .select_from(db_model)
+            .join(keys, join_geo_keys(db_model, keys))
+        )
+
+    def _add_time_series_row(self, series, row, fields, position, size):
+        for f in fields:
+            series.setdefault(f, [None] * size)[position] = getattr(row, f)
 
     def columns(self, db_table=None, year=None, release=None):
         """ Work out our columns by finding those that aren't geo columns.
@@ -505,9 +685,7 @@ class SimpleTable(DataTable):
             indent = 1
 
         for col in (
-            c.name
-            for c in db_table.model.__table__.columns
-            if c.name not in ["geo_code", "geo_level", "geo_version"]
+            c.name for c in db_table.table.columns if c.name not in GEO_COLUMNS
         ):
             columns[col] = {
                 "name": capitalize(col.replace("_", " ")),
@@ -518,11 +696,40 @@ class SimpleTable(DataTable):
 
         return columns
 
-    def setup_model(self, db_table):
-        model = db_table.model
-        if not model:
-            columns = self._build_model_columns()
+    def _reload_model(self, db_table):
+        """ Reflect the model for +db_table+ from the database again, because a column was
+        asked for that it doesn't have. Columns may have been added since the model was
+        built, such as by another process computing indicators, or since the schema
+        snapshot was taken.
+        """
+        if db_table.table.info.get("schema_snapshot"):
+            log.warning(
+                "Schema snapshot for %s is out of date, reading its columns from the database. "
+                "Run `python manage.py snapshotschema` to update it." % db_table.name
+            )
+            get_schema_snapshot().discard(db_table.name)
+
+        DBTable.MODELS.evict(db_table.name)
+        self.setup_model(db_table)
 
+    def build_model(self, db_table):
+        columns = self._build_model_columns(db_table)
+        snapshot_columns = get_schema_snapshot().columns(db_table.name)
+
+        if snapshot_columns is not None:
+            # The other columns are described by the schema snapshot.
+            names = set(c.name for c in columns)
+            columns.extend(c for c in snapshot_columns if c.name not in names)
+            table = Table(
+                db_table.name,
+                Base.metadata,
+                *columns,
+                autoload=False,
+                extend_existing=True,
+                **table_kwargs(db_table)
+            )
+            table.info["schema_snapshot"] = True
+        else:
             try:
                 # We have to find out the other columns from the table itself.
                 # First, assume it exists. If not, we'll create it with our default columns.
@@ -531,7 +738,8 @@ class SimpleTable(DataTable):
                     Base.metadata,
                     *columns,
                     autoload=True,
-                    extend_existing=True
+                    extend_existing=True,
+                    **table_kwargs(db_table)
                 )
             except NoSuchTableError:
                 # Create it
@@ -540,14 +748,11 @@ class SimpleTable(DataTable):
                     Base.metadata,
                     *columns,
                     autoload=False,
-                    extend_existing=True
+                    extend_existing=True,
+                    **table_kwargs(db_table)
                 )
 
-            class Model(Base):
-                __table__ = table
-
-            model = Model
-            db_table.model = model
+        return self._build_model_class(db_table, table)
 
     def __str__(self):
         return self.name
@@ -586,6 +791,20 @@ class FieldTable(DataTable):
         max_length=20, null=False, blank=False, default=INTEGER, choices=CHOICES
     )
 
+    SQL = "sql"
+    COLUMNAR = "columnar"
+    ENGINE_CHOICES = ((SQL, "Database"), (COLUMNAR, "Columnar, in memory"))
+
+    engine = models.CharField(
+        max_length=20,
+        null=False,
+        blank=False,
+        default=SQL,
+        choices=ENGINE_CHOICES,
+        help_text="How stats are calculated. The columnar engine loads each release into memory "
+        + "the first time it's used, which makes stats faster for heavily used tables. It requires NumPy.",
+    )
+
     def __init__(self, *args, **kwargs):
         super(FieldTable, self).__init__(*args, **kwargs)
         self.release_class = FieldTableRelease
@@ -595,6 +814,14 @@ class FieldTable(DataTable):
         else:
             self.total_column = None
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(FieldTable, cls).from_db(db, field_names, values)
+        if isinstance(instance.__dict__.get("fields"), str):
+            # SQLite snapshots store arrays as JSON, see `wazimap.data.snapshot`
+            instance.fields = json.loads(instance.fields)
+        return instance
+
     def clean(self):
         if not self.name:
             self.name = slugify("".join(self.fields))
@@ -608,23 +835,23 @@ class FieldTable(DataTable):
             self._field_set = set(self.fields)
         return self._field_set
 
-    def setup_model(self, db_table):
+    def build_model(self, db_table):
         """ Build the model that corresponds to the table underlying this data table.
         """
-        model = db_table.model
-        if not model:
-            columns = self._build_model_columns()
-
-            # create the table model
-            class Model(Base):
-                __table__ = Table(
-                    db_table.name, Base.metadata, *columns, extend_existing=True
-                )
+        columns = self._build_model_columns(db_table)
+        table = Table(
+            db_table.name,
+            Base.metadata,
+            *columns,
+            extend_existing=True,
+            **table_kwargs(db_table)
+        )
 
-            db_table.model = Model
+        # create the table model
+        return self._build_model_class(db_table, table)
 
-    def _build_model_columns(self):
-        columns = super(FieldTable, self)._build_model_columns()
+    def _build_model_columns(self, db_table):
+        columns = super(FieldTable, self)._build_model_columns(db_table)
         value_type = getattr(sqlalchemy.types, self.value_type)
 
         # field columns
@@ -636,10 +863,73 @@ class FieldTable(DataTable):
 
         return columns
 
+    def _time_series_fields(self, fields, db_tables):
+        if fields is None:
+            return list(self.fields)
+
+        if not isinstance(fields, list):
+            fields = [fields]
+        if not fields:
+            raise ValueError("Specify at least one field of table '%s'" % self.id)
+        for f in fields:
+            if f not in self.field_set:
+                raise ValueError("Invalid field '%s' for table '%s'" % (f, self.id))
+        return fields
+
+    def _time_series_query(self, session, db_table, fields, keys):
+        db_model = db_table.model
+        geo_columns = self._geo_columns(db_model)
+
+        return (
+            self._rows_query(session, db_model, fields, None, None, None)
+            .add_columns(*geo_columns)
+            .group_by(db_model.geo_level, db_model.geo_code, db_model.geo_version)
+            .join(keys, join_geo_keys(db_model, keys))
+        )
+
+    def _add_time_series_row(self, series, row, fields, position, size):
+        for f in fields[:-1]:
+            series = series.setdefault(getattr(row, f), OrderedDict())
+        series.setdefault(getattr(row, fields[-1]), [None] * size)[position] = row.total
+
     def columns(self, db_table=None, year=None, release=None):
         """ Prepare a description of our columns for use by the data API.
 
         Each 'column' is actually a unique value for each of this table's +fields+.
+
+        Columns are read from the column catalog for the release, which is built
+        when data is loaded or by `python manage.py rebuildcolumns`. If there's
+        no catalog, they're worked out from the underlying table, without storing
+        them. Either way, they're kept with the metadata registry.
+        """
+        db_table = db_table or self.get_db_table(year=year, release=release)
+
+        cache = get_registry().field_table_columns
+        key = (self.pk, db_table.active_release.pk)
+        columns = cache.get(key)
+
+        if columns is None:
+            entries = FieldTableColumn.objects.filter(
+                table_release__data_table=self,
+                table_release__release=db_table.active_release,
+            )
+            columns = OrderedDict(
+                (c.column_id, {"name": c.name, "indent": c.indent}) for c in entries
+            )
+            if not columns:
+                log.warning(
+                    "There's no column catalog for %s in %s, so its columns are read from the table. "
+                    "Build it with 'python manage.py rebuildcolumns %s'"
+                    % (self.name, db_table.active_release, self.name)
+                )
+                columns = self.build_columns(db_table)
+            cache[key] = columns
+
+        return OrderedDict(columns)
+
+    def build_columns(self, db_table):
+        """ Build a description of our columns from the distinct field values in the
+        table underlying +db_table+. This scans the entire table, use `columns` instead.
         """
         # Each "column" is a unique permutation of the values
         # of this table's fields, including rollups. The ordering of the
@@ -666,9 +956,6 @@ class FieldTable(DataTable):
 
         # map from column id to column info.
         columns = OrderedDict()
-        db_table = db_table or self.get_db_table(year=year, release=release)
-
-        # TODO: cache this
 
         if self.has_total:
             columns[self.total_column] = {"name": "Total", "indent": 0}
@@ -777,7 +1064,179 @@ class FieldTable(DataTable):
         :param str db_table: database table and release to use. None will try
                              to use `year` if given, and the current dataset context.
 
-        :return: (data-dictionary, total)
+        :return: (data-dictionary, total), or a `DeferredStatData` in a deferred dataset context
+        """
+        (
+            fields,
+            order_by,
+            only,
+            exclude,
+            recode,
+            key_order,
+            percent_grouping,
+        ) = self._stat_data_args(
+            fields, order_by, percent, total, only, exclude, recode, key_order, percent_grouping
+        )
+
+        # get the release and underlying database table
+        db_table = db_table or self.get_db_table(year=year)
+
+        planner = current_context().planner
+        if planner:
+            return planner.defer(
+                self,
+                db_table,
+                geo,
+                session,
+                fields,
+                order_by=order_by,
+                percent=percent,
+                total=total,
+                only=only,
+                exclude=exclude,
+                exclude_zero=exclude_zero,
+                recode=recode,
+                key_order=key_order,
+                percent_grouping=percent_grouping,
+                slices=slices,
+            )
+
+        sql_recode, sql_grouping = self._sql_aggregation(fields, recode, percent_grouping)
+        objects = self.get_rows_for_geo(
+            geo,
+            session,
+            fields=fields,
+            order_by=order_by,
+            only=only,
+            exclude=exclude,
+            db_table=db_table,
+            recode=sql_recode,
+            percent_grouping=sql_grouping,
+        )
+
+        root_data, grand_total = self._build_stat_data(
+            objects,
+            fields,
+            percent=percent,
+            total=total,
+            exclude_zero=exclude_zero,
+            recode=recode,
+            key_order=key_order,
+            percent_grouping=percent_grouping,
+            sql_recoded=sql_recode,
+            sql_grouped=bool(sql_grouping),
+        )
+
+        if slices:
+            for v in slices:
+                root_data = root_data[v]
+
+        add_metadata(root_data, self, db_table.active_release)
+
+        return root_data, grand_total
+
+    def get_stat_data_for_geos(
+        self,
+        fields,
+        geos,
+        session,
+        order_by=None,
+        percent=True,
+        total=None,
+        only=None,
+        exclude=None,
+        exclude_zero=False,
+        recode=None,
+        key_order=None,
+        percent_grouping=None,
+        slices=None,
+        year=None,
+        db_table=None,
+    ):
+        """
+        Like `get_stat_data`, but for a geography and its comparative geographies
+        in a single query.
+
+        The first geography in ``geos`` is the primary geography. The values and
+        numerators for each of the remaining geographies are merged into the result
+        under the key of their geo level, just as ``merge_dicts`` does. Comparative
+        geographies without any data are ignored.
+
+        See `get_stat_data` for a description of the other parameters.
+
+        :param list geos: the primary geography, followed by its comparative geographies
+                          (such as those from `GeoData.get_comparative_geos`)
+
+        :return: (data-dictionary, total) for the primary geography
+        """
+        (
+            fields,
+            order_by,
+            only,
+            exclude,
+            recode,
+            key_order,
+            percent_grouping,
+        ) = self._stat_data_args(
+            fields, order_by, percent, total, only, exclude, recode, key_order, percent_grouping
+        )
+
+        geos = list(geos)
+        db_table = db_table or self.get_db_table(year=year)
+        sql_recode, sql_grouping = self._sql_aggregation(fields, recode, percent_grouping)
+        objects = self.get_rows_for_geos(
+            geos,
+            session,
+            fields=fields,
+            order_by=order_by,
+            only=only,
+            exclude=exclude,
+            db_table=db_table,
+            recode=sql_recode,
+            percent_grouping=sql_grouping,
+        )
+
+        results = []
+        for geo in geos:
+            geo_objects = objects.get((geo.geo_level, geo.geo_code, geo.version))
+            if not geo_objects:
+                if not results:
+                    raise DataNotFound(
+                        "Entry in %s for geography %s version '%s' not found"
+                        % (db_table.name, geo.geoid, geo.version)
+                    )
+                continue
+
+            data, grand_total = self._build_stat_data(
+                geo_objects,
+                fields,
+                percent=percent,
+                total=total,
+                exclude_zero=exclude_zero,
+                recode=recode,
+                key_order=key_order,
+                percent_grouping=percent_grouping,
+                sql_recoded=sql_recode,
+                sql_grouped=bool(sql_grouping),
+            )
+
+            if slices:
+                for v in slices:
+                    data = data[v]
+
+            add_metadata(data, self, db_table.active_release)
+            results.append((geo, data, grand_total))
+
+        _, root_data, grand_total = results[0]
+        for geo, data, _ in results[1:]:
+            merge_dicts(root_data, data, geo.geo_level)
+
+        return root_data, grand_total
+
+    def _stat_data_args(
+        self, fields, order_by, percent, total, only, exclude, recode, key_order, percent_grouping
+    ):
+        """ Check and normalise the arguments to `get_stat_data`.
         """
         if not isinstance(fields, list):
             fields = [fields]
@@ -824,18 +1283,6 @@ class FieldTable(DataTable):
             if not isinstance(recode, dict) or not many_fields:
                 recode = dict((f, recode) for f in fields)
 
-        # get the release and underlying database table
-        db_table = db_table or self.get_db_table(year=year)
-        objects = self.get_rows_for_geo(
-            geo,
-            session,
-            fields=fields,
-            order_by=order_by,
-            only=only,
-            exclude=exclude,
-            db_table=db_table,
-        )
-
         if total is not None and many_fields:
             raise ValueError("Cannot specify a total if many fields are given")
 
@@ -865,12 +1312,76 @@ class FieldTable(DataTable):
         else:
             percent_grouping = None
 
+        return fields, order_by, only, exclude, recode, key_order, percent_grouping
+
+    def _sql_aggregation(self, fields, recode, percent_grouping):
+        """ Work out which recodes and percent groupings for `get_stat_data` can be done
+        by the database, so that only the final groups are returned.
+
+        Recodes that are dicts of strings are done with a CASE expression. Lambda recodes,
+        and recodes of the field with the denominator key, are done in Python. Group totals
+        for percentages are done with a window function, unless a grouped field is
+        recoded in Python.
+
+        :return: (dict of recodes for the database, list of percent grouping fields or None)
+        """
+        if self.engine == self.COLUMNAR:
+            # the columnar engine only sums rows, everything else is done in Python
+            return {}, None
+
+        recode = recode or {}
+        sql_recode = {}
+
+        for field, recoder in recode.items():
+            if (
+                field in fields
+                and isinstance(recoder, dict)
+                and recoder
+                and not (self.denominator_key and field == self.fields[-1])
+                and all(
+                    isinstance(k, str) and isinstance(v, str)
+                    for k, v in recoder.items()
+                )
+            ):
+                sql_recode[field] = recoder
+
+        sql_grouping = None
+        if percent_grouping and all(
+            f in sql_recode or f not in recode for f in percent_grouping
+        ):
+            sql_grouping = percent_grouping
+
+        return sql_recode, sql_grouping
+
+    def _build_stat_data(
+        self,
+        objects,
+        fields,
+        percent,
+        total,
+        exclude_zero,
+        recode,
+        key_order,
+        percent_grouping,
+        sql_recoded=(),
+        sql_grouped=False,
+    ):
+        """ Build the data dictionary for `get_stat_data` from rows
+        returned by `get_rows_for_geo`.
+
+        Fields in +sql_recoded+ have already been recoded by the database, and if
+        +sql_grouped+ is True, each row has a ``group_total`` for its percent grouping.
+        """
+        n_fields = len(fields)
         root_data = OrderedDict()
         running_total = 0
         group_totals = {}
         grand_total = -1
 
         def get_recoded_key(recode, field, key):
+            if field in sql_recoded:
+                return key
+
             recoder = recode[field]
             if isinstance(recoder, dict):
                 return recoder.get(key, key)
@@ -950,7 +1461,12 @@ class FieldTable(DataTable):
                         group_key = group_key + (key,)
 
                     data["_group_key"] = group_key
-                    group_totals[group_key] = group_totals.get(group_key, 0) + obj.total
+                    if sql_grouped:
+                        group_totals[group_key] = obj.group_total
+                    else:
+                        group_totals[group_key] = (
+                            group_totals.get(group_key, 0) + obj.total
+                        )
 
         if grand_total == -1:
             grand_total = running_total if total is None else total
@@ -986,12 +1502,6 @@ class FieldTable(DataTable):
 
         calc_percent(root_data)
 
-        if slices:
-            for v in slices:
-                root_data = root_data[v]
-
-        add_metadata(root_data, self, db_table.active_release)
-
         return root_data, grand_total
 
     def get_rows_for_geo(
@@ -1003,30 +1513,123 @@ class FieldTable(DataTable):
         only=None,
         exclude=None,
         db_table=None,
+        recode=None,
+        percent_grouping=None,
     ):
         """ Get rows of statistics from the stats model +db_model+ for a particular
         geography, summing over the 'total' field and grouping by +fields+. Filters
         to include +only+ and ignore +exclude+, if given.
+
+        If +recode+ (a dict from field names to dicts of values) is given, the
+        values are recoded and summed by the database. If +percent_grouping+
+        is given, each row has a ``group_total`` with the total for its group.
         """
         db_table = db_table or self.get_db_table()
         db_model = db_table.model
+        aggregate = bool(recode or percent_grouping)
 
-        if fields is None:
-            fields = [
-                c.key
-                for c in class_mapper(db_model).attrs
-                if c.key not in ["geo_code", "geo_level", "geo_version", "total"]
-            ]
-
-        fields = [getattr(db_model, f) for f in fields]
+        if self.engine == self.COLUMNAR and not aggregate:
+            objects = get_columnar_table(self, db_table).rows_for_geo(
+                geo, fields=fields, order_by=order_by, only=only, exclude=exclude
+            )
+            if not objects:
+                raise DataNotFound(
+                    "Entry in %s for geography %s version '%s' not found"
+                    % (db_table.name, geo.geoid, geo.version)
+                )
+            return objects
 
         objects = (
-            session.query(func.sum(db_model.total).label("total"), *fields)
-            .group_by(*fields)
+            self._rows_query(
+                session, db_model, fields, None if aggregate else order_by, only, exclude
+            )
             .filter(db_model.geo_code == geo.geo_code)
             .filter(db_model.geo_level == geo.geo_level)
             .filter(db_model.geo_version == geo.version)
         )
+        if aggregate:
+            objects = self._aggregate_rows_query(
+                session, objects, fields, order_by, recode, percent_grouping
+            )
+        objects = objects.all()
+
+        if len(objects) == 0:
+            raise DataNotFound(
+                "Entry in %s for geography %s version '%s' not found"
+                % (db_table.name, geo.geoid, geo.version)
+            )
+        return objects
+
+    def get_rows_for_geos(
+        self,
+        geos,
+        session,
+        fields=None,
+        order_by=None,
+        only=None,
+        exclude=None,
+        db_table=None,
+        recode=None,
+        percent_grouping=None,
+    ):
+        """ Get rows of statistics for many geographies at once. This works like
+        `get_rows_for_geo`, but returns a dict from (geo_level, geo_code, geo_version)
+        tuples to the rows for that geography. Geographies without data are not included.
+        """
+        db_table = db_table or self.get_db_table()
+        db_model = db_table.model
+        geo_columns = [db_model.geo_level, db_model.geo_code, db_model.geo_version]
+        aggregate = bool(recode or percent_grouping)
+
+        if self.engine == self.COLUMNAR and not aggregate:
+            return columnar_rows_for_geos(
+                get_columnar_table(self, db_table),
+                geos,
+                fields=fields,
+                order_by=order_by,
+                only=only,
+                exclude=exclude,
+            )
+
+        objects = OrderedDict()
+        for chunk in geo_chunks(geos):
+            keys = geo_keys(chunk)
+            query = (
+                self._rows_query(
+                    session, db_model, fields, None if aggregate else order_by, only, exclude
+                )
+                .add_columns(*geo_columns)
+                .group_by(*geo_columns)
+                .join(keys, join_geo_keys(db_model, keys))
+            )
+            if aggregate:
+                query = self._aggregate_rows_query(
+                    session,
+                    query,
+                    fields,
+                    order_by,
+                    recode,
+                    percent_grouping,
+                    group_by=[c.key for c in geo_columns],
+                )
+
+            for row in query:
+                key = (row.geo_level, row.geo_code, row.geo_version)
+                objects.setdefault(key, []).append(row)
+
+        return objects
+
+    def _rows_query(self, session, db_model, fields, order_by, only, exclude):
+        """ Build a query that sums over the 'total' field grouped by +fields+,
+        for use by `get_rows_for_geo` and `get_rows_for_geos`.
+        """
+        fields = [getattr(db_model, f) for f in self._row_fields(db_model, fields)]
+
+        objects = (
+            session.query(func.sum(db_model.total).label("total"), *fields)
+            .select_from(db_model)
+            .group_by(*fields)
+        )
 
         if only:
             for k, v in only.items():
@@ -1044,8 +1647,9 @@ class FieldTable(DataTable):
                 attr = attr[1:]
 
             if attr == "total":
-                if is_desc:
-                    attr = text(attr + " DESC")
+                # nulls are ordered explicitly, so that SQLite snapshots order them like Postgres
+                attr = literal_column(attr)
+                attr = attr.desc().nullsfirst() if is_desc else attr.asc().nullslast()
             else:
                 attr = getattr(db_model, attr)
                 if is_desc:
@@ -1053,14 +1657,73 @@ class FieldTable(DataTable):
 
             objects = objects.order_by(attr)
 
-        objects = objects.all()
-        if len(objects) == 0:
-            raise DataNotFound(
-                "Entry in %s for geography %s version '%s' not found"
-                % (db_table.name, geo.geoid, geo.version)
+        return objects
+
+    def _aggregate_rows_query(
+        self, session, query, fields, order_by, recode, percent_grouping, group_by=()
+    ):
+        """ Wrap a query from `_rows_query` so that the database recodes the
+        field values and sums the rows into their final groups.
+        """
+        inner = query.subquery()
+        fields = self._row_fields(inner, fields)
+        recode = recode or {}
+
+        columns = []
+        for field in fields:
+            col = inner.c[field]
+            if field in recode:
+                col = case(recode[field], value=col, else_=col)
+            columns.append(col.label(field))
+        extra = [inner.c[c] for c in group_by]
+
+        objects = session.query(
+            func.sum(inner.c.total).label("total"), *(columns + extra)
+        ).group_by(*(columns + extra))
+
+        if percent_grouping:
+            # the total for each group of rows, ignoring the denominator row
+            group_total = func.sum(inner.c.total)
+            if self.denominator_key and self.fields[-1] in fields:
+                group_total = case(
+                    [(inner.c[self.fields[-1]] == self.denominator_key, None)],
+                    else_=group_total,
+                )
+            partition = [c for c in columns if c.key in percent_grouping] + extra
+            objects = objects.add_columns(
+                func.sum(group_total).over(partition_by=partition).label("group_total")
+            )
+
+        if order_by is not None:
+            # order the groups by where they would first appear if they
+            # hadn't been grouped
+            is_desc = order_by[0] == "-"
+            attr = inner.c[order_by.lstrip("-")]
+            objects = objects.order_by(
+                func.max(attr).desc().nullsfirst()
+                if is_desc
+                else func.min(attr).asc().nullslast()
             )
+
         return objects
 
+    def _row_fields(self, db_model, fields):
+        """ The names of the fields to group rows by, all the non-geo fields by default.
+        """
+        if fields is None:
+            if hasattr(db_model, "c"):
+                keys = db_model.c.keys()
+            else:
+                keys = [c.key for c in class_mapper(db_model).attrs]
+
+            fields = [
+                k
+                for k in keys
+                if k not in GEO_COLUMNS + ["total"]
+            ]
+
+        return fields
+
     def raw_data_for_geos(self, geos, db_table=None):
         """ Pull raw data for a list of geo models.
 
@@ -1072,35 +1735,24 @@ class FieldTable(DataTable):
             for geo in geos
         }
 
+        data.update(self.iter_raw_data_for_geos(geos, db_table=db_table))
+        return data
+
+    def iter_raw_data_for_geos(self, geos, db_table=None):
+        """ Stream raw data for a list of geo models, using a server-side cursor.
+
+        Yields a (geo id, table data) tuple for each geo that has data,
+        ordered by `geo_sort_key`. Rows are processed as they arrive from the
+        database, so only one geo's data is held in memory at a time.
+        """
         db_table = db_table or self.get_db_table()
+        model = db_table.model
 
         session = get_session()
         try:
-            geo_values = None
-            fields = [getattr(db_table.model, f) for f in self.fields]
-            rows = (
-                session.query(
-                    db_table.model.geo_level,
-                    db_table.model.geo_code,
-                    func.sum(db_table.model.total).label("total"),
-                    *fields
-                )
-                .group_by(db_table.model.geo_level, db_table.model.geo_code, *fields)
-                .order_by(db_table.model.geo_level, db_table.model.geo_code, *fields)
-                .filter(
-                    or_(
-                        and_(
-                            db_table.model.geo_level == geo.geo_level,
-                            db_table.model.geo_code == geo.geo_code,
-                            db_table.model.geo_version == geo.version,
-                        )
-                        for geo in geos
-                    )
-                )
-                .all()
-            )
+            fields = [getattr(model, f) for f in self.fields]
 
-            def permute(level, field_keys, rows):
+            def permute(geo_values, level, field_keys, rows):
                 field = self.fields[level]
                 total = None
                 denominator = 0
@@ -1110,7 +1762,7 @@ class FieldTable(DataTable):
                     col_id = self.column_id(new_keys)
 
                     if level + 1 < len(self.fields):
-                        value = permute(level + 1, new_keys, rows)
+                        value = permute(geo_values, level + 1, new_keys, rows)
                     else:
                         # we've bottomed out
 
@@ -1136,21 +1788,63 @@ class FieldTable(DataTable):
 
                 return total
 
-            # rows for each geo
-            for geo_id, geo_rows in groupby(rows, lambda r: (r.geo_level, r.geo_code)):
-                geo_values = data["%s-%s" % geo_id]
-                total = permute(0, [], geo_rows)
+            if self.engine == self.COLUMNAR:
+                columnar = get_columnar_table(self, db_table)
 
-                # total
-                if self.total_column:
-                    geo_values["estimate"][self.total_column] = total
-                    geo_values["error"][self.total_column] = 0
+                for chunk in geo_chunks(sorted(geos, key=geo_sort_key)):
+                    for geo in chunk:
+                        # rows are ordered by field values
+                        rows = columnar.rows_for_geo(geo, fields=self.fields)
+                        if not rows:
+                            continue
+
+                        geo_values = {"estimate": {}, "error": {}}
+                        total = permute(geo_values, 0, [], rows)
+                        if self.total_column:
+                            geo_values["estimate"][self.total_column] = total
+                            geo_values["error"][self.total_column] = 0
+
+                        yield geo.geoid, geo_values
+
+                return
+
+            # chunks of sorted geos, so that the streamed rows are in order
+            # across chunks, too
+            for chunk in geo_chunks(sorted(geos, key=geo_sort_key)):
+                keys = geo_keys(chunk)
+                rows = (
+                    session.query(
+                        model.geo_level,
+                        model.geo_code,
+                        func.sum(model.total).label("total"),
+                        *fields
+                    )
+                    .select_from(model)
+                    .join(keys, join_geo_keys(model, keys))
+                    .group_by(model.geo_level, model.geo_code, *fields)
+                    .order_by(
+                        byte_order(model.geo_level), byte_order(model.geo_code), *fields
+                    )
+                    .yield_per(STREAM_BATCH_SIZE)
+                )
+
+                # rows for each geo
+                for geo_id, geo_rows in groupby(
+                    rows, lambda r: (r.geo_level, r.geo_code)
+                ):
+                    geo_values = {"estimate": {}, "error": {}}
+                    total = permute(geo_values, 0, [], geo_rows)
+
+                    # total
+                    if self.total_column:
+                        geo_values["estimate"][self.total_column] = total
+                        geo_values["error"][self.total_column] = 0
+
+                    yield "%s-%s" % geo_id, geo_values
 
         finally:
             session.close()
 
-        return data
-
     def _build_description(self):
         return self.universe + " by " + ", ".join(self.fields)
 
@@ -1167,13 +1861,9 @@ class FieldTable(DataTable):
         # try find it based on fields
         field_set = set(fields)
 
-        candidates = cls.objects.filter(fields__contains=list(field_set))
-        if name:
-            candidates = candidates.filter(name__iexact=name)
-        if universe:
-            candidates = candidates.filter(universe=universe)
-        if dataset:
-            candidates = candidates.filter(dataset__name=dataset)
+        candidates = get_registry().for_fields(
+            field_set, universe=universe, dataset=dataset, name=name
+        )
 
         possibilities = [
             (t, len(t.field_set - field_set))
@@ -1198,11 +1888,48 @@ class BaseRelease(object):
         # ensure it exists in the DB
         session = get_session()
         try:
-            db_table.model.__table__.create(session.get_bind(), checkfirst=True)
+            db_table.table.create(session.get_bind(), checkfirst=True)
         finally:
             session.close()
 
 
+def provision_db_tables(table_releases):
+    """ Create the database tables behind +table_releases+ that don't exist yet,
+    using a single lookup of the tables in the database.
+
+    Returns the names of the tables that were created.
+    """
+    created = []
+
+    session = get_session()
+    try:
+        bind = session.get_bind()
+        existing = set(inspect(bind).get_table_names())
+
+        for table_release in table_releases:
+            if not (
+                table_release.db_table
+                and table_release.data_table
+                and table_release.release
+            ):
+                continue
+
+            name = table_release.db_table.name
+            if name in existing:
+                continue
+
+            db_table = table_release.data_table.get_db_table(
+                release=table_release.release
+            )
+            db_table.table.create(bind, checkfirst=True)
+            existing.add(name)
+            created.append(name)
+    finally:
+        session.close()
+
+    return created
+
+
 class SimpleTableRelease(models.Model, BaseRelease):
     data_table = models.ForeignKey(SimpleTable, on_delete=models.CASCADE)
     db_table = models.ForeignKey(DBTable, on_delete=models.CASCADE)
@@ -1220,6 +1947,136 @@ class FieldTableRelease(models.Model, BaseRelease):
     def __str__(self):
         return "%s for %s in %s" % (self.db_table, self.data_table, self.release)
 
+    def rebuild_column_catalog(self, db_table=None):
+        """ Rebuild the column catalog for this release from the underlying
+        database table, and return the columns.
+
+        The catalog is only stored if the table has data, so that it isn't built
+        prematurely for a table that is still empty.
+        """
+        db_table = db_table or self.data_table.get_db_table(release=self.release)
+        columns = self.data_table.build_columns(db_table)
+
+        with transaction.atomic():
+            self.catalog_entries.all().delete()
+
+            if any(col_id != self.data_table.total_column for col_id in columns):
+                FieldTableColumn.objects.bulk_create(
+                    FieldTableColumn(
+                        table_release=self,
+                        column_id=col_id,
+                        name=info["name"],
+                        indent=info["indent"],
+                        position=i,
+                    )
+                    for i, (col_id, info) in enumerate(columns.items())
+                )
+
+            # discard columns kept with the registry
+            transaction.on_commit(invalidate_registry)
+
+        return columns
+
+
+class FieldTableColumn(models.Model):
+    """ Catalog entry for a column of a FieldTable in a particular release.
+
+    Working out a FieldTable's columns requires a scan of the entire underlying table,
+    so the result is stored here when data is loaded or when a release is attached.
+    Use `python manage.py rebuildcolumns` to rebuild it after changing the data directly.
+    """
+
+    table_release = models.ForeignKey(
+        FieldTableRelease, related_name="catalog_entries", on_delete=models.CASCADE
+    )
+    column_id = models.CharField(max_length=1024, null=False, blank=False)
+    name = models.CharField(max_length=1024, null=False, blank=False)
+    indent = models.PositiveSmallIntegerField(null=False, default=0)
+    position = models.PositiveIntegerField(null=False)
+
+    class Meta:
+        ordering = ["table_release", "position"]
+
+    def __str__(self):
+        return "%s in %s" % (self.column_id, self.table_release)
+
+
+class DerivedIndicator(models.Model):
+    """ An indicator, such as persons per household, derived from the data of other tables
+    and stored as a column of a SimpleTable.
+
+    Its values are computed for every geography with `python manage.py computeindicators`.
+    See `wazimap.data.indicators` for the syntax of expressions.
+    """
+
+    table = models.ForeignKey(
+        SimpleTable,
+        related_name="indicators",
+        on_delete=models.CASCADE,
+        help_text="SimpleTable to store the indicator in. It's computed for each of the table's releases.",
+    )
+    name = models.CharField(
+        max_length=50,
+        null=False,
+        blank=False,
+        help_text="Name of the table column to store the indicator in, such as 'persons_per_household'.",
+    )
+    expression = models.TextField(
+        null=False,
+        blank=False,
+        help_text="How to calculate the indicator, such as '{POPULATION.total} / {HOUSEHOLDS.total}'. "
+        + "Refer to a SimpleTable column as {TABLE.column}, to the total of a FieldTable as {TABLE} "
+        + "and to the total of some of its rows as {TABLE:field=value,field=value}.",
+    )
+    description = models.CharField(max_length=200, null=True, blank=True)
+
+    class Meta:
+        ordering = ["table", "name"]
+        unique_together = ("table", "name")
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        from wazimap.data.indicators import NAME_RE, parse_expression
+
+        if not NAME_RE.match(self.name or "") or self.name in GEO_COLUMNS:
+            raise ValidationError(
+                {
+                    "name": "Use lowercase letters, numbers and underscores, starting with a letter."
+                }
+            )
+
+        try:
+            _, refs = parse_expression(self.expression or "")
+        except ValueError as e:
+            raise ValidationError({"expression": str(e)})
+
+        for ref in refs.values():
+            if not get_datatable(ref.table):
+                raise ValidationError(
+                    {"expression": "No data table named '%s'" % ref.table}
+                )
+
+    def __str__(self):
+        return "%s.%s" % (self.table, self.name)
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+@receiver(post_save, sender=Release)
+@receiver(post_delete, sender=Release)
+@receiver(post_save, sender=DBTable)
+@receiver(post_delete, sender=DBTable)
+@receiver(post_save, sender=SimpleTable)
+@receiver(post_delete, sender=SimpleTable)
+@receiver(post_save, sender=FieldTable)
+@receiver(post_delete, sender=FieldTable)
+@receiver(post_save, sender=SimpleTableRelease)
+@receiver(post_delete, sender=SimpleTableRelease)
+@receiver(post_save, sender=FieldTableRelease)
+@receiver(post_delete, sender=FieldTableRelease)
+def invalidate_metadata_registry(sender, **kwargs):
+    metadata_changed()
+
 
 @receiver(post_save, sender=SimpleTable)
 def ensure_simple_table_db_tables_exist(sender, **kwargs):
@@ -1231,6 +2088,51 @@ def ensure_field_table_db_tables_exist(sender, **kwargs):
     kwargs["instance"].ensure_db_tables_exist()
 
 
+# the FieldTable attributes that the column catalog depends on
+CATALOG_ATTRIBUTES = ["fields", "denominator_key", "has_total"]
+
+
+@receiver(pre_save, sender=FieldTable)
+def check_field_table_column_catalog(sender, **kwargs):
+    table = kwargs["instance"]
+    old = (
+        FieldTable.objects.filter(pk=table.pk).values(*CATALOG_ATTRIBUTES).first()
+        if table.pk
+        else None
+    )
+    table._catalog_changed = old is not None and any(
+        old[attr] != getattr(table, attr) for attr in CATALOG_ATTRIBUTES
+    )
+
+
+@receiver(post_save, sender=FieldTable)
+def clear_field_table_column_catalog(sender, **kwargs):
+    # the columns have changed, rebuild the catalog with loaddatatable or rebuildcolumns
+    table = kwargs["instance"]
+    if getattr(table, "_catalog_changed", False):
+        FieldTableColumn.objects.filter(table_release__data_table=table).delete()
+        transaction.on_commit(invalidate_registry)
+
+
+@receiver(post_save, sender=FieldTableRelease)
+def build_field_table_release_column_catalog(sender, **kwargs):
+    release = kwargs["instance"]
+    if release.db_table and release.data_table and release.release:
+        release.ensure_db_table_exists()
+        # the table may already have data, build the catalog once the release is committed
+        transaction.on_commit(release.rebuild_column_catalog)
+
+
+def join_geo_keys(db_model, keys):
+    """ Join condition between a data table model and a relation built by `geo_keys`.
+    """
+    return and_(
+        db_model.geo_level == keys.c.geo_level,
+        db_model.geo_code == keys.c.geo_code,
+        db_model.geo_version == keys.c.geo_version,
+    )
+
+
 class ZeroRow(object):
     # object that acts as a SQLAlchemy row of zeros
     def __getattribute__(self, attr):
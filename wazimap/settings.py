@@ -23,6 +23,17 @@ DATABASES = {
 }
 DATABASES['default']['ATOMIC_REQUESTS'] = True
 
+# Path to a read-only SQLite snapshot written by `python manage.py exportsnapshot`.
+# If set, the site is served from the snapshot rather than from DATABASE_URL.
+# The admin and anything else that writes to the database won't work.
+SNAPSHOT_DATABASE = os.environ.get('SNAPSHOT_DATABASE')
+if SNAPSHOT_DATABASE:
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:%s?mode=ro&immutable=1' % os.path.abspath(SNAPSHOT_DATABASE),
+        'OPTIONS': {'uri': True},
+    }
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -270,4 +281,48 @@ WAZIMAP = {
     # levels, such as a 2010 national census down to the city level, and a 2015
     # partial census to the provincial level.
     'primary_release_year': {},
+
+    # How many seconds the in-memory registry of data tables and releases is kept
+    # for before it is reloaded from the database. Changes are picked up immediately
+    # by the process that makes them. If None, other processes only see changes when
+    # they are restarted.
+    'metadata_registry_ttl': 5 * 60,
+
+    # How many seconds FieldTables using the columnar engine are kept in memory
+    # before they're reloaded from the database. Data loaded with loaddatatable,
+    # rollupdata or computeindicators is picked up immediately by the process that
+    # loads it. If None, other processes only see it when they are restarted.
+    'columnar_table_ttl': 15 * 60,
+
+    # Path to a schema snapshot of the data tables, written by
+    # `python manage.py snapshotschema`. Wazimap reads the columns of SimpleTables
+    # from the snapshot, rather than from the database. If None, or for tables
+    # that aren't in the snapshot, the columns are read from the database.
+    'schema_snapshot': None,
+
+    # Maximum number of SQLAlchemy models for data tables to keep in memory.
+    # The least recently used models are discarded when there are more. If None,
+    # all models are kept.
+    'model_cache_size': 1000,
+
+    # Should new database tables for data tables be keyed by the integer id of each
+    # row's geography, rather than by its geo_level, geo_code and geo_version?
+    # This makes tables and their indexes smaller.
+    'geo_id_keys': False,
+
+    # Should new database tables for data tables be partitioned by geo_level and
+    # geo_version? Requires PostgreSQL 11 or later.
+    'partition_data_tables': False,
+
+    # Path to a binary geometry cache built by 'python manage.py buildgeometrycache',
+    # which is read instead of parsing the GeoJSON files of geometry_data.
+    'geometry_cache': None,
+
+    # Should wazimap.wsgi load geometry before the server forks its worker
+    # processes, so that they share it? Use gunicorn's --preload option.
+    'preload_geometry': False,
+
+    # Path to a read-only SQLite snapshot to serve data from, rather than from
+    # Postgres. This is set by the SNAPSHOT_DATABASE environment variable.
+    'snapshot_database': SNAPSHOT_DATABASE,
 }
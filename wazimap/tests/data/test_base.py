@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from sqlalchemy import MetaData, Table, Column, String
+
+from wazimap.data.base import ModelRegistry
+
+
+class ModelRegistryTestCase(TestCase):
+    def setUp(self):
+        self.metadata = MetaData()
+        self.registry = ModelRegistry(self.metadata, max_size=2)
+
+    def model(self, name):
+        class Model(object):
+            __table__ = Table(name, self.metadata, Column('geo_code', String(10), primary_key=True))
+        return Model
+
+    def test_get_or_create(self):
+        one = self.registry.get_or_create('one', lambda: self.model('one'))
+        self.assertIs(self.registry.get_or_create('one', lambda: self.model('one')), one)
+        self.assertEqual(self.registry.stats()['hits'], 1)
+        self.assertEqual(self.registry.stats()['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        self.registry.get_or_create('one', lambda: self.model('one'))
+        self.registry.get_or_create('two', lambda: self.model('two'))
+        self.registry.get('one')
+        self.registry.get_or_create('three', lambda: self.model('three'))
+
+        self.assertEqual(sorted(self.registry.models.keys()), ['one', 'three'])
+        self.assertNotIn('two', self.metadata.tables)
+        self.assertEqual(self.registry.stats()['evictions'], 1)
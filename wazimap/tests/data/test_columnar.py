@@ -0,0 +1,94 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.columnar import HAS_NUMPY, columnar_tables
+from wazimap.geo import geo_data
+from wazimap.models import FieldTable
+
+
+@skipUnless(HAS_NUMPY, "NumPy is not installed")
+class ColumnarTestCase(WazimapTestCase):
+    def test_matches_sql(self):
+        table = self.field_table(['age group', 'gender'], """
+lev,code,0-9,Male,10
+lev,code,0-9,Female,20
+lev,code,10-19,Male,
+lev,code,10-19,Female,5
+lev,code,20+,Male,7
+lev,code,20+,Female,8
+lev,other,0-9,Male,1
+""")
+        # the columnar engine loads data with its own session
+        self.s.commit()
+        geo = geo_data.geo_model(geo_level='lev', geo_code='code', version='')
+
+        options = [
+            {'order_by': 'age group'},
+            {'order_by': '-age group'},
+            {'only': {'gender': ['Male']}},
+            {'exclude': {'age group': ['20+']}},
+            {'recode': {'age group': {'0-9': 'Young', '10-19': 'Young'}}},
+            {'percent_grouping': ['age group']},
+        ]
+
+        table.engine = FieldTable.SQL
+        unchanged = table.get_stat_data(['age group', 'gender'], geo, self.s)
+        table.engine = FieldTable.COLUMNAR
+        self.assertEqual(table.get_stat_data(['age group', 'gender'], geo, self.s), unchanged)
+
+        for kwargs in options:
+            table.engine = FieldTable.SQL
+            expected = table.get_stat_data(['age group', 'gender'], geo, self.s, **kwargs)
+            if 'order_by' not in kwargs:
+                self.assertNotEqual(expected, unchanged, kwargs)
+
+            table.engine = FieldTable.COLUMNAR
+            self.assertEqual(table.get_stat_data(['age group', 'gender'], geo, self.s, **kwargs), expected, kwargs)
+
+        table.engine = FieldTable.SQL
+        expected = table.raw_data_for_geos([geo])
+        table.engine = FieldTable.COLUMNAR
+        self.assertEqual(table.raw_data_for_geos([geo]), expected)
+
+        columnar_tables.evict(table.get_db_table().name)
+
+    def test_reloaded_when_expired(self):
+        table = self.field_table(['main transport'], None)
+        table.engine = FieldTable.COLUMNAR
+        db_table = table.get_db_table()
+        self.addCleanup(columnar_tables.evict, db_table.name)
+
+        columnar = columnar_tables.get(table, db_table)
+        self.assertIs(columnar_tables.get(table, db_table), columnar)
+
+        with patch.dict(settings.WAZIMAP, {'columnar_table_ttl': 0}):
+            self.assertIsNot(columnar_tables.get(table, db_table), columnar)
+
+    def test_expired_served_while_reloading(self):
+        table = self.field_table(['distance to school'], None)
+        table.engine = FieldTable.COLUMNAR
+        db_table = table.get_db_table()
+        self.addCleanup(columnar_tables.evict, db_table.name)
+
+        columnar = columnar_tables.get(table, db_table)
+
+        with patch.dict(settings.WAZIMAP, {'columnar_table_ttl': 0}):
+            # another thread is reloading the table
+            lock = columnar_tables._loading[db_table.name]
+            with lock:
+                self.assertIs(columnar_tables.get(table, db_table), columnar)
+
+            self.assertIsNot(columnar_tables.get(table, db_table), columnar)
+
+        # a load that started before the table was evicted isn't kept
+        def load(*args):
+            columnar_tables.evict(db_table.name)
+            return columnar
+
+        columnar_tables.evict(db_table.name)
+        with patch('wazimap.data.columnar.ColumnarTable', side_effect=load):
+            self.assertIs(columnar_tables.get(table, db_table), columnar)
+            self.assertNotIn(db_table.name, columnar_tables.tables)
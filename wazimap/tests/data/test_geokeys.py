@@ -0,0 +1,42 @@
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.geokeys import convert_to_geo_ids
+from wazimap.geo import geo_data
+from wazimap.models import DBTable
+
+
+class GeoKeysTestCase(WazimapTestCase):
+    def setUp(self):
+        super(GeoKeysTestCase, self).setUp()
+        self.geo = geo_data.geo_model.objects.create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+
+    def test_convert(self):
+        # data tables outlive each test, so this table is only used here
+        table = self.field_table(['citizenship'], """
+country,ZA,South African,10
+country,ZA,Other,
+""")
+        self.s.commit()
+        data = table.get_stat_data(['citizenship'], self.geo, self.s)
+        raw = table.raw_data_for_geos([self.geo])
+        # release the session's locks on the table
+        self.s.commit()
+
+        self.assertEqual(convert_to_geo_ids(table.get_db_table(year='latest')), 2)
+
+        db_table = table.get_db_table(year='latest')
+        self.assertEqual(db_table.geo_key, DBTable.GEO_ID)
+        self.assertEqual([c.name for c in db_table.table.columns], ['geo_id', 'citizenship', 'total'])
+
+        self.assertEqual(table.get_stat_data(['citizenship'], self.geo, self.s), data)
+        self.assertEqual(table.raw_data_for_geos([self.geo]), raw)
+
+    def test_convert_missing_geography(self):
+        table = self.field_table(['country of birth'], """
+country,ZA,South Africa,10
+country,XX,South Africa,10
+""")
+        self.s.commit()
+
+        with self.assertRaises(ValueError):
+            convert_to_geo_ids(table.get_db_table(year='latest'))
+        self.assertEqual(table.get_db_table(year='latest').geo_key, DBTable.GEO_CODES)
@@ -0,0 +1,75 @@
+from django.db import transaction
+from sqlalchemy import text
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.indexes import Index, advise, candidate_index, create_indexes, index_sql
+from wazimap.data.utils import _engine
+from wazimap.models import Dataset, DBTable, Release, SimpleTable, SimpleTableRelease
+
+
+class IndexesTestCase(WazimapTestCase):
+    def test_advise(self):
+        # data tables outlive each test, so this table is only used here
+        table = self.field_table(['marital status', 'employment'], """
+country,ZA,Married,Employed,10
+country,ZA,Single,Unemployed,5
+""")
+        self.s.commit()
+        db_table = table.get_db_table(year='latest')
+
+        advice = advise(table, db_table)
+        self.assertEqual(advice.skipped, "fewer than 10000 rows")
+
+        advice = advise(table, db_table, min_rows=0)
+        self.assertIsNone(advice.skipped)
+        self.assertEqual([(q.level, q.kind) for q, before, after in advice.costs], [
+            ('country', 'geography'), ('country', 'map')])
+
+        index = candidate_index(table, db_table)
+        self.assertEqual(index.columns, ['geo_level', 'geo_version', 'marital status', 'employment'])
+        self.assertEqual(index.include, ['geo_code', 'total'])
+        # the trial index was rolled back
+        self.assertNotIn(index.name, self.index_names(db_table.name))
+
+        advice.indexes = [index]
+        self.assertEqual(create_indexes(advice), [index.name])
+        self.assertIn(index.name, self.index_names(db_table.name))
+
+    def test_simple_table_index(self):
+        with transaction.atomic():
+            dataset, _ = Dataset.objects.get_or_create(name="Test Dataset")
+            release, _ = Release.objects.get_or_create(name="Test release", year="2000", dataset=dataset)
+            table = SimpleTable.objects.create(name='INDEXEDSIMPLE', dataset=dataset)
+            db_table, _ = DBTable.objects.get_or_create(name='indexedsimple')
+            SimpleTableRelease.objects.create(data_table=table, db_table=db_table, release=release)
+        with _engine.begin() as conn:
+            conn.execute(text('CREATE TABLE indexedsimple (geo_level VARCHAR(15), geo_code VARCHAR(10), '
+                              'geo_version VARCHAR(100), total INTEGER, households INTEGER, '
+                              'PRIMARY KEY (geo_level, geo_code, geo_version))'))
+            conn.execute(text("INSERT INTO indexedsimple VALUES ('country', 'ZA', '', 10, 4)"))
+        db_table = table.get_db_table(year='latest')
+
+        # a total column doesn't make it a FieldTable, and the index covers the columns that are read
+        index = candidate_index(table, db_table)
+        self.assertEqual(index.columns, ['geo_level', 'geo_version'])
+        self.assertEqual(index.include, ['geo_code', 'total', 'households'])
+        self.assertEqual(candidate_index(table, db_table, 'country', ['households']).include,
+                         ['geo_code', 'households'])
+        with self.assertRaises(ValueError):
+            candidate_index(table, db_table, columns=['missing'])
+
+        advice = advise(table, db_table, columns=['households'], min_rows=0)
+        self.assertEqual([q.sql for q, before, after in advice.costs if q.kind == 'map'], [
+            "SELECT geo_code, households FROM indexedsimple WHERE geo_level = 'country' AND geo_version = ''"])
+
+    def index_names(self, table_name):
+        with _engine.connect() as conn:
+            rows = conn.execute(text('SELECT indexname FROM pg_indexes WHERE tablename = :name'), {'name': table_name})
+            return [r[0] for r in rows]
+
+    def test_index_sql(self):
+        index = Index('ix_t_ward_level', ['geo_version', 'gender'], ['geo_code', 'total'], 'ward')
+        self.assertEqual(
+            index_sql('t', index, concurrently=True),
+            'CREATE INDEX CONCURRENTLY ix_t_ward_level ON t (geo_version, gender) INCLUDE (geo_code, total) '
+            "WHERE geo_level = 'ward'")
@@ -0,0 +1,128 @@
+from django.db import transaction
+from sqlalchemy import select, text
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.utils import _engine
+from wazimap.data.indicators import Reference, compute_indicators, indicator_tables, parse_expression, reference_query
+from wazimap.geo import geo_data
+from wazimap.models import Dataset, DBTable, DerivedIndicator, Release, SimpleTable, SimpleTableRelease
+
+
+class IndicatorsTestCase(WazimapTestCase):
+    def test_parse_expression(self):
+        tree, refs = parse_expression('100 * {WATER:water source=Piped, toilet=Flush} / {WATER} + {HOUSEHOLDS.total}')
+        self.assertEqual(sorted(refs.values()), sorted([
+            Reference('WATER', None, (('water source', 'Piped'), ('toilet', 'Flush'))),
+            Reference('WATER', None, ()),
+            Reference('HOUSEHOLDS', 'total', ()),
+        ]))
+
+        for expression in ['{A.total} ** 2', '__import__("os")', '{A.total} / x', '{A.total} +', '1 + 2', '"a"']:
+            with self.assertRaises(ValueError):
+                parse_expression(expression)
+
+    def test_compute_indicators(self):
+        geo_data.geo_model.objects.create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+        # data tables outlive each test, so these tables are only used here
+        table = self.field_table(['water source'], """
+country,ZA,Piped,30
+country,ZA,Borehole,10
+""")
+        self.s.commit()
+
+        with transaction.atomic():
+            dataset = Dataset.objects.get(name="Test Dataset")
+            simple = SimpleTable.objects.create(name='WATERINDICATORS', dataset=dataset)
+            db_table, _ = DBTable.objects.get_or_create(name='waterindicators')
+            SimpleTableRelease.objects.create(
+                data_table=simple, db_table=db_table, release=Release.objects.get(dataset=dataset))
+            DerivedIndicator.objects.create(
+                table=simple, name='piped_water', expression='100 * {%s:water source=Piped} / {%s}' % (
+                    table.name, table.name))
+            DerivedIndicator.objects.create(
+                table=simple, name='piped_ratio', expression='{%s:water source=Piped} / {%s:water source=None}' % (
+                    table.name, table.name))
+        simple.ensure_db_tables_exist()
+
+        self.assertEqual(indicator_tables(table), [simple])
+        self.assertEqual(compute_indicators(simple, 'latest'), 1)
+
+        db_table = simple.get_db_table(year='latest')
+        columns = db_table.table.columns
+        row = self.s.execute(select([columns.geo_code, columns.piped_water, columns.piped_ratio])).fetchone()
+        # there are no rows for the denominator
+        self.assertEqual(tuple(row), ('ZA', 75.0, None))
+
+    def test_compute_indicators_keeps_other_columns(self):
+        geo_data.geo_model.objects.create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+        table = self.field_table(['energy for lighting'], """
+country,ZA,Electricity,30
+country,ZA,Candles,10
+""")
+        self.s.commit()
+
+        with transaction.atomic():
+            dataset = Dataset.objects.get(name="Test Dataset")
+            simple = SimpleTable.objects.create(name='LIGHTINGINDICATORS', dataset=dataset)
+            db_table, _ = DBTable.objects.get_or_create(name='lightingindicators')
+            SimpleTableRelease.objects.create(
+                data_table=simple, db_table=db_table, release=Release.objects.get(dataset=dataset))
+            DerivedIndicator.objects.create(
+                table=simple, name='electricity', expression='100 * {%s:energy for lighting=Electricity} / {%s}' % (
+                    table.name, table.name))
+        simple.ensure_db_tables_exist()
+
+        # loaded data, for a geography with and without indicators
+        with _engine.begin() as conn:
+            conn.execute(text('ALTER TABLE lightingindicators ADD COLUMN households INTEGER'))
+            conn.execute(text("INSERT INTO lightingindicators (geo_level, geo_code, geo_version, households) "
+                              "VALUES ('country', 'ZA', '', 12), ('country', 'XX', '', 3)"))
+        DBTable.MODELS.evict('lightingindicators')
+
+        self.assertEqual(compute_indicators(simple, 'latest'), 1)
+        self.assertEqual(compute_indicators(simple, 'latest'), 1)
+
+        columns = simple.get_db_table(year='latest').table.columns
+        rows = self.s.execute(select([columns.geo_code, columns.households, columns.electricity])
+                              .order_by(columns.geo_code)).fetchall()
+        self.assertEqual([tuple(r) for r in rows], [('XX', 3, None), ('ZA', 12, 75.0)])
+
+    def test_denominator_key_total(self):
+        table = self.field_table(['internet access'], """
+country,ZA,Home,15
+country,ZA,Work,12
+country,ZA,Total households,30
+""", universe='Households', denominator_key='Total households')
+        self.s.commit()
+
+        def value(*filters):
+            query = reference_query(Reference(table.name, None, filters), 'latest')
+            return self.s.execute(query).fetchone().value
+
+        # the denominator row is the total, it isn't added to the other rows
+        self.assertEqual(value(), 30)
+        self.assertEqual(value(('internet access', 'Home')), 15)
+        self.assertEqual(value(('internet access', 'Total households')), 30)
+
+    def test_new_columns_found(self):
+        with transaction.atomic():
+            dataset, _ = Dataset.objects.get_or_create(name="Test Dataset")
+            release, _ = Release.objects.get_or_create(name="Test release", year="2000", dataset=dataset)
+            simple = SimpleTable.objects.create(name='ROOFINDICATORS', dataset=dataset)
+            db_table, _ = DBTable.objects.get_or_create(name='roofindicators')
+            SimpleTableRelease.objects.create(data_table=simple, db_table=db_table, release=release)
+        simple.ensure_db_tables_exist()
+        self.assertNotIn('tiled', simple.get_db_table(year='latest').table.columns)
+
+        # another process, such as computeindicators, adds a column after the model is built
+        with _engine.begin() as conn:
+            conn.execute(text('ALTER TABLE roofindicators ADD COLUMN tiled FLOAT'))
+            conn.execute(text("INSERT INTO roofindicators (geo_level, geo_code, geo_version, tiled) "
+                              "VALUES ('country', 'ZA', '', 40.0)"))
+
+        geo = geo_data.geo_model(geo_level='country', geo_code='ZA', version='')
+        data, _ = simple.get_stat_data(geo, fields=['tiled'], percent=False)
+        self.assertEqual(data['tiled']['values'], {'this': 40.0})
+
+        series = simple.get_time_series(geo, fields=['tiled'])
+        self.assertEqual(series['geos']['country-ZA']['tiled'], [40.0])
@@ -0,0 +1,84 @@
+import io
+from unittest.mock import patch
+
+from django.conf import settings
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.loader import DataTableLoader
+from wazimap.geo import geo_data
+
+
+class DataTableLoaderTestCase(WazimapTestCase):
+    def loader(self, table):
+        return DataTableLoader(table, table.get_db_table(year='latest'), chunk_size=2)
+
+    def test_load(self):
+        table = self.field_table(['gender'], None)
+        self.s.commit()
+
+        rows = self.loader(table).load(io.StringIO("""geo_level,geo_code,gender,total
+lev,one,Male,10
+lev,one,Female,20
+lev,two,Male,
+"""))
+        self.assertEqual(rows, 3)
+
+        geos = [geo_data.geo_model(geo_level='lev', geo_code=code, version='') for code in ['one', 'two']]
+        data = table.raw_data_for_geos(geos)
+        self.assertEqual(data['lev-one']['estimate'], {'Male': 10, 'Female': 20, 'total': 30})
+        self.assertEqual(data['lev-two']['estimate'], {'Male': None, 'total': None})
+
+    def test_check_headers(self):
+        table = self.field_table(['gender'], None)
+        loader = self.loader(table)
+
+        loader.check_headers(['geo_level', 'geo_code', 'gender', 'total'])
+        with self.assertRaises(ValueError):
+            loader.check_headers(['geo_level', 'geo_code', 'sex', 'total'])
+        with self.assertRaises(ValueError):
+            loader.check_headers(['geo_level', 'gender', 'total'])
+
+    def test_swap(self):
+        table = self.field_table(['gender'], """
+lev,one,Male,1
+lev,old,Male,1
+""")
+        self.s.commit()
+
+        rows = self.loader(table).swap(io.StringIO("""geo_level,geo_code,gender,total
+lev,one,Male,10
+lev,one,Female,20
+"""))
+        self.assertEqual(rows, 2)
+
+        geos = [geo_data.geo_model(geo_level='lev', geo_code=code, version='') for code in ['one', 'old']]
+        data = table.raw_data_for_geos(geos)
+        self.assertEqual(data['lev-one']['estimate'], {'Male': 10, 'Female': 20, 'total': 30})
+        self.assertEqual(data['lev-old']['estimate'], {})
+
+    def test_load_geo_ids(self):
+        for code in ['one', 'two']:
+            geo_data.geo_model.objects.create(geo_level='lev', geo_code=code, name=code, version='')
+
+        # data tables outlive each test, so this table is only used here
+        with patch.dict(settings.WAZIMAP, {'geo_id_keys': True}):
+            table = self.field_table(['home language'], None)
+        loader = self.loader(table)
+        self.assertTrue(loader.geo_id)
+
+        rows = loader.load(io.StringIO("""geo_level,geo_code,home language,total
+lev,one,English,10
+lev,one,isiZulu,20
+lev,two,English,
+"""))
+        self.assertEqual(rows, 3)
+
+        geos = [geo_data.geo_model(geo_level='lev', geo_code=code, version='') for code in ['one', 'two']]
+        data = table.raw_data_for_geos(geos)
+        self.assertEqual(data['lev-one']['estimate'], {'English': 10, 'isiZulu': 20, 'total': 30})
+        self.assertEqual(data['lev-two']['estimate'], {'English': None, 'total': None})
+
+        with self.assertRaises(ValueError):
+            loader.load(io.StringIO("""geo_level,geo_code,home language,total
+lev,missing,English,10
+"""))
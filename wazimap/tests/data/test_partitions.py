@@ -0,0 +1,53 @@
+from django.conf import settings
+from unittest.mock import patch
+from sqlalchemy import text
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.partitions import detach_version, get_partitions, partition_name
+from wazimap.data.utils import _engine
+from wazimap.geo import geo_data
+
+
+class PartitionsTestCase(WazimapTestCase):
+    def setUp(self):
+        super(PartitionsTestCase, self).setUp()
+        self.geo = geo_data.geo_model.objects.create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+
+    def test_partitions(self):
+        # data tables outlive each test, so this table is only used here
+        with patch.dict(settings.WAZIMAP, {'partition_data_tables': True}):
+            table = self.field_table(['religion'], """
+country,ZA,Christian,10
+country,ZA,Other,5
+province,WC,Other,1
+""")
+        self.s.commit()
+        name = table.get_db_table(year='latest').name
+
+        with _engine.connect() as conn:
+            partitions = get_partitions(conn, name)
+        self.assertEqual(sorted(partitions.keys()), sorted([
+            partition_name(name, 'country'),
+            partition_name(name, 'country', 'v'),
+            partition_name(name, 'country', 'default'),
+            partition_name(name, 'default'),
+        ]))
+
+        data, total = table.get_stat_data(['religion'], self.geo, self.s)
+        self.assertEqual(total, 15)
+        # release the session's locks on the table
+        self.s.commit()
+
+        with _engine.begin() as conn:
+            self.assertEqual(detach_version(conn, name, ''), [partition_name(name, 'country', 'v')])
+            rows = conn.execute(text('SELECT geo_level, geo_code FROM %s' % name)).fetchall()
+            conn.execute(text('DROP TABLE %s' % partition_name(name, 'country', 'v')))
+
+        # rows for other levels are still there
+        self.assertEqual([tuple(r) for r in rows], [('province', 'WC')])
+
+    def test_partition_name(self):
+        self.assertEqual(partition_name('religion', 'Local Municipality'), 'religion_local_municipality')
+        name = partition_name('x' * 60, 'country')
+        self.assertEqual(len(name), 63)
+        self.assertNotEqual(name, partition_name('x' * 60, 'province'))
@@ -0,0 +1,60 @@
+from django.db import transaction
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data import registry
+from wazimap.data.registry import get_registry
+from wazimap.models import FieldTable, Release
+
+
+class MetadataRegistryTestCase(WazimapTestCase):
+    def test_lookups_without_queries(self):
+        table = self.field_table(['gender'], None)
+        self.field_table(['gender', 'age group'], None)
+        get_registry()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(FieldTable.for_fields(['gender']), table)
+            self.assertEqual(FieldTable.find(table.name.lower()), table)
+            self.assertEqual(table.get_release('latest').year, '2000')
+            self.assertEqual(table.get_db_table(year='2000').name, table.name.lower())
+
+    def test_invalidated_on_save(self):
+        table = self.field_table(['gender'], None)
+        self.assertEqual(table.get_release('2001'), None)
+
+        Release.objects.create(name="Other release", year="2001", dataset=table.dataset)
+        self.assertEqual([r.year for r in get_registry().get_dataset_releases("Test Dataset")], ['2001', '2000'])
+
+    def test_kept_in_atomic_block(self):
+        # requests run in atomic blocks
+        table = self.field_table(['gender'], None)
+
+        with transaction.atomic():
+            self.assertEqual(table.get_release('latest').year, '2000')
+
+            with self.assertNumQueries(0):
+                self.assertEqual(FieldTable.find(table.name.lower()), table)
+                self.assertEqual(FieldTable.for_fields(['gender']), table)
+                self.assertEqual(table.get_release('latest').year, '2000')
+                self.assertEqual(table.get_db_table(year='2000').name, table.name.lower())
+
+    def test_not_kept_with_uncommitted_changes(self):
+        table = self.field_table(['gender'], None)
+
+        with transaction.atomic():
+            Release.objects.create(name="Other release", year="2001", dataset=table.dataset)
+            self.assertEqual(table.get_release('2001'), None)
+            self.assertIsNone(registry._registry)
+
+    def test_kept_after_rollback(self):
+        table = self.field_table(['gender'], None)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Release.objects.create(name="Other release", year="2001", dataset=table.dataset)
+                raise ValueError()
+
+        with transaction.atomic():
+            self.assertEqual(table.get_release('2001'), None)
+        self.assertEqual(table.get_release('2001'), None)
+        self.assertIsNotNone(registry._registry)
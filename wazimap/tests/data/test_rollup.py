@@ -0,0 +1,103 @@
+from django.core.management import call_command
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data.geokeys import convert_to_geo_ids
+from wazimap.data.rollup import rollup
+from wazimap.geo import geo_data
+
+
+LEVELS = {
+    'country': {'children': ['province']},
+    'province': {'children': ['ward'], 'ancestors': ['country']},
+    'ward': {'children': [], 'ancestors': ['province', 'country']},
+}
+
+WARD_DATA = """
+ward,1,Flush,10
+ward,1,Pit,5
+ward,2,Flush,20
+ward,3,Pit,7
+"""
+
+
+class RollupTestCase(WazimapTestCase):
+    def setUp(self):
+        super(RollupTestCase, self).setUp()
+        levels = geo_data.geo_levels
+        geo_data.geo_levels = LEVELS
+        self.addCleanup(setattr, geo_data, 'geo_levels', levels)
+
+        create = geo_data.geo_model.objects.create
+        create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+        create(geo_level='province', geo_code='WC', name='Western Cape', version='', parent_level='country', parent_code='ZA')
+        create(geo_level='province', geo_code='GT', name='Gauteng', version='', parent_level='country', parent_code='ZA')
+        create(geo_level='ward', geo_code='1', name='Ward 1', version='', parent_level='province', parent_code='WC')
+        create(geo_level='ward', geo_code='2', name='Ward 2', version='', parent_level='province', parent_code='WC')
+        create(geo_level='ward', geo_code='3', name='Ward 3', version='', parent_level='province', parent_code='GT')
+
+    def geo(self, level, code):
+        return geo_data.geo_model(geo_level=level, geo_code=code, version='')
+
+    def estimates(self, table):
+        geos = [self.geo('country', 'ZA'), self.geo('province', 'WC'), self.geo('province', 'GT')]
+        data = table.raw_data_for_geos(geos)
+        return dict((geoid, d['estimate']) for geoid, d in data.items())
+
+    def test_rollup(self):
+        # data tables outlive each test, so each table is only used in one test
+        table = self.field_table(['toilet type'], WARD_DATA)
+        self.s.commit()
+
+        call_command('rollupdata', table.name, '--from', 'ward')
+
+        self.assertEqual(self.estimates(table), {
+            'country-ZA': {'Flush': 30, 'Pit': 12, 'total': 42},
+            'province-WC': {'Flush': 30, 'Pit': 5, 'total': 35},
+            'province-GT': {'Pit': 7, 'total': 7},
+        })
+
+        # rolling up again replaces the rows, rather than adding to them
+        call_command('rollupdata', table.name, '--from', 'ward')
+        self.assertEqual(self.estimates(table)['country-ZA'], {'Flush': 30, 'Pit': 12, 'total': 42})
+
+    def test_rollup_changed_geos(self):
+        table = self.field_table(['fuel for cooking'], WARD_DATA + """
+province,WC,Flush,1
+province,GT,Pit,1
+""")
+        self.s.commit()
+
+        call_command('rollupdata', table.name, '--from', 'ward', '--geo', '3')
+
+        estimates = self.estimates(table)
+        # only the ancestors of ward 3 are recalculated
+        self.assertEqual(estimates['province-GT'], {'Pit': 7, 'total': 7})
+        self.assertEqual(estimates['province-WC'], {'Flush': 1, 'total': 1})
+        self.assertEqual(estimates['country-ZA'], {'Flush': 30, 'Pit': 12, 'total': 42})
+
+    def test_rollup_to_levels(self):
+        table = self.field_table(['refuse disposal'], WARD_DATA)
+        self.s.commit()
+
+        call_command('rollupdata', table.name, '--from', 'ward', '--to', 'province')
+
+        estimates = self.estimates(table)
+        self.assertEqual(estimates['province-WC'], {'Flush': 30, 'Pit': 5, 'total': 35})
+        self.assertEqual(estimates['country-ZA'], {})
+
+        with self.assertRaises(ValueError):
+            rollup(table, table.get_db_table(year='latest'), 'province', levels=['ward'])
+
+    def test_rollup_geo_id_keys(self):
+        table = self.field_table(['tenure status'], WARD_DATA)
+        self.s.commit()
+        convert_to_geo_ids(table.get_db_table(year='latest'))
+
+        db_table = table.get_db_table(year='latest')
+        self.assertEqual(rollup(table, db_table, 'ward'), 5)
+
+        self.assertEqual(self.estimates(table), {
+            'country-ZA': {'Flush': 30, 'Pit': 12, 'total': 42},
+            'province-WC': {'Flush': 30, 'Pit': 5, 'total': 35},
+            'province-GT': {'Pit': 7, 'total': 7},
+        })
@@ -0,0 +1,119 @@
+import json
+
+from django.db import transaction
+from sqlalchemy import event, text
+from sqlalchemy.types import NullType
+from sqlalchemy.dialects import postgresql
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.data import schema
+from wazimap.data.schema import SchemaSnapshot, dump_schema, load_type
+from wazimap.data.utils import _engine
+from wazimap.geo import geo_data
+from wazimap.models import Dataset, DBTable, Release, SimpleTable, SimpleTableRelease
+
+
+class SchemaSnapshotTestCase(WazimapTestCase):
+    def setUp(self):
+        super(SchemaSnapshotTestCase, self).setUp()
+        snapshot = schema._snapshot
+        self.addCleanup(setattr, schema, '_snapshot', snapshot)
+
+    def create_table(self, name, sql):
+        with _engine.begin() as conn:
+            conn.execute(text(sql))
+        self.addCleanup(self.drop_table, name)
+
+    def drop_table(self, name):
+        DBTable.MODELS.evict(name)
+        with _engine.begin() as conn:
+            conn.execute(text('DROP TABLE IF EXISTS %s' % name))
+
+    def simple_table(self, name):
+        with transaction.atomic():
+            dataset, _ = Dataset.objects.get_or_create(name="Test Dataset")
+            release, _ = Release.objects.get_or_create(name="Test release", year="2000", dataset=dataset)
+            table = SimpleTable.objects.create(name=name.upper(), dataset=dataset)
+            db_table, _ = DBTable.objects.get_or_create(name=name)
+            SimpleTableRelease.objects.create(data_table=table, db_table=db_table, release=release)
+        return table
+
+    def snapshot(self, tables):
+        # written and read back, as snapshotschema and get_schema_snapshot do
+        schema._snapshot = SchemaSnapshot(json.loads(json.dumps(tables)))
+        return schema._snapshot
+
+    def test_dump_schema(self):
+        self.create_table('schematypes', """
+CREATE TABLE schematypes (
+    geo_level VARCHAR(15) NOT NULL, geo_code VARCHAR(10) NOT NULL, geo_version VARCHAR(100) NOT NULL,
+    name VARCHAR(20), rate NUMERIC(5, 2), households INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (geo_level, geo_code, geo_version))
+""")
+
+        tables = dump_schema(_engine, ['schematypes', 'missingtable'])['tables']
+        self.assertEqual(list(tables.keys()), ['schematypes'])
+
+        columns = dict((c.name, c) for c in self.snapshot(tables).columns('schematypes'))
+        self.assertEqual(list(columns.keys()), ['geo_level', 'geo_code', 'geo_version', 'name', 'rate', 'households'])
+        self.assertTrue(columns['geo_level'].primary_key)
+        self.assertFalse(columns['name'].primary_key)
+        self.assertFalse(columns['households'].nullable)
+        self.assertEqual(columns['households'].server_default.arg.text, '0')
+
+        self.assertIsInstance(columns['name'].type, postgresql.VARCHAR)
+        self.assertEqual(columns['name'].type.length, 20)
+        self.assertIsInstance(columns['rate'].type, postgresql.NUMERIC)
+        self.assertEqual((columns['rate'].type.precision, columns['rate'].type.scale), (5, 2))
+        self.assertIsInstance(columns['households'].type, postgresql.INTEGER)
+
+        self.assertIsInstance(load_type({'type': 'NoSuchType'}), NullType)
+
+    def test_build_model_from_snapshot(self):
+        # the table doesn't exist, so its columns can only come from the snapshot
+        table = self.simple_table('snapshotonly')
+        self.snapshot({'snapshotonly': {'columns': [
+            {'name': 'households', 'type': {'type': 'INTEGER'}, 'nullable': True, 'primary_key': False},
+        ]}})
+
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(_engine, 'before_cursor_execute', before_execute)
+        try:
+            db_table = table.get_db_table(year='latest')
+        finally:
+            event.remove(_engine, 'before_cursor_execute', before_execute)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(list(table.columns(db_table).keys()), ['households'])
+        self.assertTrue(db_table.table.info['schema_snapshot'])
+
+    def test_stale_snapshot(self):
+        self.create_table('stalesnapshot', """
+CREATE TABLE stalesnapshot (
+    geo_level VARCHAR(15) NOT NULL, geo_code VARCHAR(10) NOT NULL, geo_version VARCHAR(100) NOT NULL,
+    households INTEGER, persons INTEGER,
+    PRIMARY KEY (geo_level, geo_code, geo_version));
+INSERT INTO stalesnapshot VALUES ('country', 'ZA', '', 10, 35);
+""")
+        table = self.simple_table('stalesnapshot')
+        # persons was added after the snapshot was taken
+        snapshot = self.snapshot(dump_schema(_engine, ['stalesnapshot'])['tables'])
+        snapshot.tables['stalesnapshot']['columns'].pop()
+
+        geo = geo_data.geo_model(geo_level='country', geo_code='ZA', version='')
+        with self.assertLogs('wazimap.models.data', 'WARNING'):
+            data, _ = table.get_stat_data(geo, fields=['persons'], percent=False)
+        self.assertEqual(data['persons']['values'], {'this': 35})
+
+        # the table is read from the database from now on
+        self.assertNotIn('stalesnapshot', snapshot)
+        db_table = table.get_db_table(year='latest')
+        self.assertNotIn('schema_snapshot', db_table.table.info)
+        self.assertEqual(list(table.columns(db_table).keys()), ['households', 'persons'])
+
+        with self.assertRaises(ValueError):
+            table.get_stat_data(geo, fields=['missing'], percent=False)
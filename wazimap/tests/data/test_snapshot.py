@@ -0,0 +1,62 @@
+import json
+import os.path
+import shutil
+import tempfile
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from wazimap.tests.data import test_utils
+from wazimap.data.snapshot import export_snapshot
+from wazimap.data.utils import snapshot_engine
+from wazimap.models import Dataset, DerivedIndicator, FieldTable, SimpleTable
+
+
+class SnapshotTestCase(test_utils.UtilsTestCase):
+    """ Runs the get_stat_data tests against a SQLite snapshot of the test data.
+    """
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        self.db_session = self.s
+        self.engine = None
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'snapshot.db')
+
+    def tearDown(self):
+        self.db_session.close()
+        super(SnapshotTestCase, self).tearDown()
+        if self.engine:
+            self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def load_data(self, table, data_str):
+        # load the data into the database, and then query a fresh snapshot of it
+        if self.s is not self.db_session:
+            self.s.close()
+            self.engine.dispose()
+        self.s = self.db_session
+
+        super(SnapshotTestCase, self).load_data(table, data_str)
+        self.s.commit()
+
+        export_snapshot(self.path)
+        self.engine = snapshot_engine(self.path)
+        self.s = sessionmaker(bind=self.engine)()
+
+    def test_metadata(self):
+        table = self.field_table(['gender'], """
+lev,code,Male,10
+""")
+        sql = text("SELECT fields FROM %s WHERE name = :name" % FieldTable._meta.db_table)
+        fields = self.s.execute(sql, {'name': table.name}).scalar()
+        self.assertEqual(json.loads(fields), ['gender'])
+
+    def test_derived_indicators(self):
+        dataset, _ = Dataset.objects.get_or_create(name="Test Dataset")
+        simple = SimpleTable.objects.create(name='SNAPSHOTINDICATORS', dataset=dataset)
+        DerivedIndicator.objects.create(table=simple, name='speed', expression='{SNAPSHOTINDICATORS.total}')
+        self.field_table(['internet speed'], """
+lev,code,Fast,10
+""")
+        sql = text("SELECT name, expression FROM %s" % DerivedIndicator._meta.db_table)
+        self.assertEqual([tuple(r) for r in self.s.execute(sql)], [('speed', '{SNAPSHOTINDICATORS.total}')])
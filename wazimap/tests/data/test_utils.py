@@ -1,5 +1,5 @@
 from wazimap.tests.support import WazimapTestCase
-from wazimap.data.utils import get_stat_data
+from wazimap.data.utils import get_stat_data, get_stat_data_for_geos, dataset_context
 from wazimap.data.tables import FieldTable
 from wazimap.geo import geo_data
 
@@ -60,3 +60,79 @@ lev,code,total households,
         self.assertIsNone(data['Fridge']['values']['this'])
         self.assertEqual(data['Computer']['numerators']['this'], 5)
         self.assertIsNone(data['Computer']['values']['this'])
+
+    def test_get_stat_data_for_geos(self):
+        self.field_table(['gender'], """
+lev,code,Male,10
+lev,code,Female,20
+parent,pcode,Male,50
+parent,pcode,Female,50
+""")
+        parent = geo_data.geo_model(geo_level='parent', geo_code='pcode', version='')
+        missing = geo_data.geo_model(geo_level='root', geo_code='missing', version='')
+
+        data, total = get_stat_data_for_geos(['gender'], [self.geo, parent, missing], self.s)
+        self.assertEqual(total, 30)
+        self.assertEqual(data['Male']['numerators'], {'this': 10, 'parent': 50})
+        self.assertEqual(data['Male']['values'], {'this': 33.33, 'parent': 50})
+        self.assertEqual(data['Female']['numerators'], {'this': 20, 'parent': 50})
+        self.assertEqual(data['Female']['values'], {'this': 66.67, 'parent': 50})
+
+    def test_get_stat_data_deferred(self):
+        self.field_table(['gender', 'age group'], """
+lev,code,Male,child,4
+lev,code,Male,adult,6
+lev,code,Female,child,5
+lev,code,Female,adult,15
+""")
+        with dataset_context(year='latest', deferred=True):
+            gender = get_stat_data(['gender'], self.geo, self.s, order_by='-total')
+            adults = get_stat_data(['gender'], self.geo, self.s, only={'age group': ['adult']}, table_fields=['gender', 'age group'])
+            nested = get_stat_data(['gender', 'age group'], self.geo, self.s)
+
+            # nothing is done until the results are used
+            self.assertFalse(gender.resolved)
+
+        data, total = gender
+        self.assertEqual(total, 30)
+        self.assertEqual(list(data.keys())[:2], ['Female', 'Male'])
+        self.assertEqual(data['Male']['numerators']['this'], 10)
+        self.assertEqual(data['Female']['values']['this'], 66.67)
+
+        data, total = adults
+        self.assertEqual(total, 21)
+        self.assertEqual(data['Male']['numerators']['this'], 6)
+
+        data, total = nested
+        self.assertEqual(total, 30)
+        self.assertEqual(data['Female']['Adult']['numerators']['this'], 15)
+
+    def test_get_stat_data_recode(self):
+        self.field_table(['gender', 'age'], """
+lev,code,Male,1,2
+lev,code,Male,3,4
+lev,code,Male,12,1
+lev,code,Female,2,3
+lev,code,Female,11,10
+""")
+        recode = {'1': '0-9', '2': '0-9', '3': '0-9', '11': '10-19', '12': '10-19'}
+
+        data, total = get_stat_data(['age'], self.geo, self.s, recode=recode)
+        self.assertEqual(total, 20)
+        self.assertEqual(list(data.keys()), ['0-9', '10-19', 'metadata'])
+        self.assertEqual(data['0-9']['numerators']['this'], 9)
+        self.assertEqual(data['0-9']['values']['this'], 45)
+        self.assertEqual(data['10-19']['numerators']['this'], 11)
+
+        data, total = get_stat_data(['gender', 'age'], self.geo, self.s,
+                                    recode={'age': recode}, percent_grouping=['gender'])
+        self.assertEqual(total, 20)
+        self.assertEqual(data['Male']['0-9']['numerators']['this'], 6)
+        self.assertEqual(data['Male']['0-9']['values']['this'], 85.71)
+        self.assertEqual(data['Female']['10-19']['numerators']['this'], 10)
+        self.assertEqual(data['Female']['10-19']['values']['this'], 76.92)
+
+        # lambdas are recoded in python
+        data, total = get_stat_data(['age'], self.geo, self.s, recode=lambda f, v: recode[v])
+        self.assertEqual(data['0-9']['numerators']['this'], 9)
+        self.assertEqual(data['10-19']['numerators']['this'], 11)
@@ -3,11 +3,14 @@ from wazimap.data.utils import dataset_context
 from django.db import transaction
 
 from wazimap.data.utils import get_session, _engine
+from wazimap.data.registry import invalidate_registry
 from wazimap.models import FieldTable, Dataset, Release, DBTable
 
 
 class WazimapTestCase(TransactionTestCase):
     def setUp(self):
+        # the database is flushed between tests without sending signals
+        invalidate_registry()
         self.s = get_session()
         self.ctxt = dataset_context(year='latest')
         self.ctxt.__enter__()
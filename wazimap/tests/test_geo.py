@@ -1,7 +1,16 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.conf import settings
 
-from wazimap.geo import geo_data, GeoData
+from wazimap.geo import geo_data, GeoData, ShapeIndex, HAS_GDAL
+
+try:
+    import shapely  # noqa
+    HAS_SHAPELY = True
+except ImportError:
+    HAS_SHAPELY = False
 
 
 class GeoTestCase(TestCase):
@@ -27,3 +36,131 @@ class GeoTestCase(TestCase):
 
         with self.assertRaises(AttributeError):
             GeoData()
+
+    def test_geometry_loaded_on_first_use(self):
+        geometry_data = {'': {'': 'geo/all.geojson'}}
+        with patch.dict(settings.WAZIMAP, {'geometry_data': geometry_data, 'geometry_cache': None}), \
+                patch.object(GeoData, 'load_geojson_for_level', return_value=(None, None)) as load:
+            data = GeoData()
+            self.assertFalse(load.called)
+
+            self.assertEqual(data.geometry_for_level('', 'country'), {})
+            self.assertEqual(data.geometry_for_level('', 'country'), {})
+            load.assert_called_once_with('country', '')
+
+            # versions without geometry aren't loaded
+            self.assertEqual(data.geometry_for_level('2011', 'country'), {})
+            self.assertEqual(load.call_count, 1)
+
+
+@skipUnless(HAS_SHAPELY, "Shapely isn't installed")
+class ShapeIndexTestCase(TestCase):
+    def test_codes_containing(self):
+        from shapely.geometry import box, Point, Polygon
+
+        shapes = [
+            ('left', box(0, 0, 1, 1)),
+            ('right', box(1, 0, 2, 1)),
+            ('triangle', Polygon([(0, 0), (1, 0), (1, 1)])),
+        ]
+        index = ShapeIndex([(code, {'shape': shape}, shape.bounds) for code, shape in shapes])
+
+        # inside the triangle's bounding box, but not the triangle
+        self.assertEqual(index.codes_containing(Point(0.25, 0.75)), ['left'])
+        self.assertEqual(sorted(index.codes_containing(Point(0.75, 0.25))), ['left', 'triangle'])
+        self.assertEqual(index.codes_containing(Point(1.5, 0.5)), ['right'])
+        self.assertEqual(index.codes_containing(Point(5, 5)), [])
+
+        # only the most recently used shapes are kept prepared
+        index = ShapeIndex([(code, {'shape': shape}, shape.bounds) for code, shape in shapes], max_prepared=1)
+        self.assertEqual(sorted(index.codes_containing(Point(0.75, 0.25))), ['left', 'triangle'])
+        self.assertEqual(len(index.prepared), 1)
+        self.assertEqual(index.codes_containing(Point(1.5, 0.5)), ['right'])
+        self.assertEqual(list(index.prepared), [index.codes.index('right')])
+
+
+@skipUnless(HAS_SHAPELY and HAS_GDAL, "Shapely or GDAL isn't installed")
+class CoordsTestCase(TestCase):
+    def setUp(self):
+        from shapely.geometry import box, mapping
+
+        shapes = {
+            'country': [('ZA', box(0, 0, 2, 1))],
+            'province': [('WC', box(0, 0, 1, 1)), ('GT', box(1, 0, 2, 1))],
+        }
+
+        def load_geojson_for_level(level, version):
+            return 'test.geojson', {'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'properties': {'code': code}, 'geometry': mapping(shape)}
+                for code, shape in shapes[level]]}
+
+        geometry_data = {'': {'': 'geo/all.geojson'}}
+        with patch.dict(settings.WAZIMAP, {'geometry_data': geometry_data, 'geometry_cache': None}):
+            self.geo_data = GeoData()
+        self.geo_data.geo_levels = {
+            'country': {'children': ['province']},
+            'province': {'children': [], 'ancestors': ['country']},
+        }
+        self.geo_data.load_geojson_for_level = load_geojson_for_level
+
+        geo_data.geo_model.objects.create(geo_level='country', geo_code='ZA', name='South Africa', version='')
+        geo_data.geo_model.objects.create(geo_level='province', geo_code='WC', name='Western Cape', version='')
+
+    def test_get_geoids_from_coords(self):
+        coords = [(0.5, 0.5), (1.5, 0.5), (5, 5), (0.25, 0.75)]
+        # GT has a shape but no geography, so it isn't found
+        self.assertEqual(self.geo_data.get_geoids_from_coords(coords, version=''), [
+            ['country-ZA', 'province-WC'],
+            ['country-ZA'],
+            [],
+            ['country-ZA', 'province-WC'],
+        ])
+        self.assertEqual(self.geo_data.get_geoids_from_coords(coords[:2], levels=['province'], version=''), [
+            ['province-WC'], []])
+        self.assertEqual(self.geo_data.get_geoids_from_coords([], version=''), [])
+
+        # the same as looking up each point
+        geos = self.geo_data.get_locations_from_coords(0.5, 0.5, version='')
+        self.assertEqual([g.geoid for g in geos], ['country-ZA', 'province-WC'])
+
+
+@skipUnless(HAS_SHAPELY, "Shapely isn't installed")
+class GeometryCacheTestCase(TestCase):
+    def test_round_trip(self):
+        import os
+        import tempfile
+        from wazimap.data.geometry import read_geometry_cache, write_geometry_cache
+
+        tmpdir = tempfile.mkdtemp()
+        source = os.path.join(tmpdir, 'province.geojson')
+        path = os.path.join(tmpdir, 'geometry.cache')
+        with open(source, 'w') as f:
+            f.write('{}')
+
+        features = [
+            ('2011', 'province', source, {'properties': {'code': 'WC', 'name': 'Western Cape'},
+                                          'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [2, 0], [2, 1], [0, 0]]]}}),
+            ('2011', 'province', source, {'properties': {'code': 'XX'}, 'geometry': None}),
+        ]
+        geometry_data = {'2011': {'province': source}}
+        self.assertEqual(write_geometry_cache(path, geometry_data, iter(features)), 2)
+
+        geometry = read_geometry_cache(path, geometry_data)
+        wc = geometry['2011']['province']['WC']
+        self.assertEqual(wc['properties']['name'], 'Western Cape')
+        self.assertEqual(wc['bbox'], [0, 0, 2, 1])
+        self.assertEqual(wc['shape'].bounds, (0, 0, 2, 1))
+        self.assertIsNone(geometry['2011']['province']['XX']['shape'])
+
+        # shapes that aren't kept are loaded each time they're used
+        geometry = read_geometry_cache(path, geometry_data, keep_shapes=False)
+        wc = geometry['2011']['province']['WC']
+        self.assertEqual(wc['shape'].bounds, (0, 0, 2, 1))
+        self.assertNotIn('shape', wc)
+        self.assertIsNot(wc['shape'], wc['shape'])
+
+        # a different setting, or a changed source file, makes the cache stale
+        self.assertIsNone(read_geometry_cache(path, {'2016': {'province': source}}))
+        with open(source, 'w') as f:
+            f.write('{"type": "FeatureCollection"}')
+        self.assertIsNone(read_geometry_cache(path, geometry_data))
@@ -0,0 +1,124 @@
+from django.db import transaction
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.geo import geo_data
+from wazimap.data.utils import _engine
+from wazimap.models import DBTable, FieldTableRelease, Release
+from wazimap.models.data import provision_db_tables
+
+
+class FieldTableTestCase(WazimapTestCase):
+    def geo(self, code):
+        return geo_data.geo_model(geo_level='lev', geo_code=code, version='')
+
+    def test_columns_without_catalog(self):
+        table = self.field_table(['dwelling type'], """
+            ward,1,House,10
+            ward,1,Flat,5
+            """)
+        db_table = table.get_db_table(year='latest')
+        table_release = FieldTableRelease.objects.get(data_table=table)
+        self.assertFalse(table_release.catalog_entries.exists())
+
+        self.assertEqual(list(table.columns(db_table)), ['total', 'Flat', 'House'])
+        # worked out from the table, but not stored
+        self.assertFalse(table_release.catalog_entries.exists())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(list(table.columns(db_table)), ['total', 'Flat', 'House'])
+
+        table_release.rebuild_column_catalog(db_table)
+        self.assertEqual(table_release.catalog_entries.count(), 3)
+        self.assertEqual(list(table.columns(db_table)), ['total', 'Flat', 'House'])
+
+    def test_catalog_kept_on_unrelated_save(self):
+        table = self.field_table(['fuel for heating'], """
+            ward,1,Gas,10
+            ward,1,Wood,5
+            """)
+        self.s.commit()
+        table_release = FieldTableRelease.objects.get(data_table=table)
+
+        # attaching a release to a table with data builds the catalog
+        table_release.save()
+        self.assertEqual(table_release.catalog_entries.count(), 3)
+
+        table.description = "Fuel used for heating"
+        table.save()
+        self.assertEqual(table_release.catalog_entries.count(), 3)
+
+        table.denominator_key = 'Gas'
+        table.save()
+        self.assertFalse(table_release.catalog_entries.exists())
+
+    def test_raw_data_for_geos(self):
+        table = self.field_table(['gender'], """
+lev,one,Male,10
+lev,one,Female,20
+lev,two,Male,5
+lev,three,Female,7
+""")
+        # raw_data_for_geos uses its own session
+        self.s.commit()
+
+        data = table.raw_data_for_geos([self.geo('one'), self.geo('two'), self.geo('missing')])
+
+        self.assertEqual(sorted(data.keys()), ['lev-missing', 'lev-one', 'lev-two'])
+        self.assertEqual(data['lev-one']['estimate'], {'Male': 10, 'Female': 20, 'total': 30})
+        self.assertEqual(data['lev-two']['estimate'], {'Male': 5, 'total': 5})
+        self.assertEqual(data['lev-missing']['estimate'], {})
+
+    def test_iter_raw_data_for_geos(self):
+        table = self.field_table(['gender'], """
+lev,b,Male,10
+lev,b,Female,20
+lev,a,Male,5
+lev,C,Female,7
+""")
+        # iter_raw_data_for_geos uses its own session
+        self.s.commit()
+
+        data = list(table.iter_raw_data_for_geos([self.geo('b'), self.geo('a'), self.geo('C'), self.geo('missing')]))
+
+        self.assertEqual([geo_id for geo_id, values in data], ['lev-C', 'lev-a', 'lev-b'])
+        self.assertEqual(data[2][1]['estimate'], {'Male': 10, 'Female': 20, 'total': 30})
+
+    def test_get_time_series(self):
+        # data tables outlive each test, so these tables are only used here
+        table = self.field_table(['disability'], """
+lev,one,Yes,3
+lev,one,No,10
+lev,two,No,5
+""")
+        with transaction.atomic():
+            release = Release.objects.create(name="Test release", year="2010", dataset=table.dataset)
+            db_table = DBTable.objects.create(name='disability_2010')
+            FieldTableRelease.objects.create(data_table=table, db_table=db_table, release=release)
+        table.ensure_db_tables_exist()
+
+        model = table.get_db_table(year='2010').model
+        self.s.add(model(geo_level='lev', geo_code='one', geo_version='', disability='Yes', total=4))
+        # get_time_series uses its own session
+        self.s.commit()
+
+        series = table.get_time_series([self.geo('one'), self.geo('two'), self.geo('missing')])
+        self.assertEqual(series['years'], ['2000', '2010'])
+        self.assertEqual(series['geos'], {
+            'lev-one': {'Yes': [3, 4], 'No': [10, None]},
+            'lev-two': {'No': [5, None]},
+            'lev-missing': {},
+        })
+
+        series = table.get_time_series(self.geo('one'), years=['2010'])
+        self.assertEqual(series, {'years': ['2010'], 'geos': {'lev-one': {'Yes': [4]}}})
+
+
+class ProvisionDBTablesTestCase(WazimapTestCase):
+    def test_provision_db_tables(self):
+        table = self.field_table(['gender'], None)
+        self.field_table(['age'], None)
+        table.get_db_table(year='latest').model.__table__.drop(_engine)
+
+        releases = FieldTableRelease.objects.select_related('data_table', 'db_table', 'release')
+        self.assertEqual(provision_db_tables(releases), [table.name.lower()])
+        self.assertEqual(provision_db_tables(releases), [])
@@ -0,0 +1,86 @@
+import json
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from wazimap.tests.support import WazimapTestCase
+from wazimap.views import BatchPlaceSearchView
+
+
+class DataTimeSeriesViewTestCase(WazimapTestCase):
+    def test_unknown_geo(self):
+        table = self.field_table(['school attendance'], None)
+
+        resp = self.client.get('/api/1.0/data/timeseries', {'table_id': table.name, 'geo_ids': 'country-XX'})
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('country-XX', json.loads(resp.content.decode('utf-8'))['error'])
+
+        resp = self.client.get('/api/1.0/data/timeseries', {'table_id': table.name, 'geo_ids': 'nonsense'})
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(json.loads(resp.content.decode('utf-8')), {'error': 'Invalid geo id: nonsense'})
+
+
+def fake_geoids(coords, levels=None, version=None):
+    return [['point-%s-%s' % (lon, lat)] for lon, lat in coords]
+
+
+@patch.object(BatchPlaceSearchView, 'BATCH_SIZE', 2)
+@patch.object(BatchPlaceSearchView, 'MAX_POINTS', 3)
+class BatchPlaceSearchViewTestCase(TestCase):
+    def setUp(self):
+        patcher = patch('wazimap.views.geo_data')
+        self.geo_data = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.geo_data.get_geoids_from_coords.side_effect = fake_geoids
+
+    def post(self, body, content_type='application/json', **params):
+        url = '/place-search/batch/'
+        if params:
+            url += '?' + '&'.join('%s=%s' % p for p in params.items())
+        return self.client.post(url, body, content_type=content_type)
+
+    def content(self, resp):
+        return b''.join(resp.streaming_content).decode('utf-8')
+
+    def test_json(self):
+        points = [[1, 2], {'id': 'b', 'lat': 3, 'lon': 4}, [5, 6]]
+        resp = self.post(json.dumps(points), geolevels='country,ward', geo_version='2011')
+        self.assertEqual(resp.status_code, 200)
+
+        # the third point is in the second batch
+        self.assertEqual(json.loads(self.content(resp)), {'results': [
+            {'lat': 1.0, 'lon': 2.0, 'geo_ids': ['point-2.0-1.0']},
+            {'id': 'b', 'lat': 3.0, 'lon': 4.0, 'geo_ids': ['point-4.0-3.0']},
+            {'lat': 5.0, 'lon': 6.0, 'geo_ids': ['point-6.0-5.0']},
+        ]})
+        self.assertEqual([c[0][0] for c in self.geo_data.get_geoids_from_coords.call_args_list], [
+            [(2.0, 1.0), (4.0, 3.0)], [(6.0, 5.0)]])
+        self.assertEqual(self.geo_data.get_geoids_from_coords.call_args[1], {
+            'levels': ['country', 'ward'], 'version': '2011'})
+
+    def test_csv(self):
+        resp = self.post('id,lat,lon\r\na,1,2\r\n,3,4\r\nc,5,6\r\n', content_type='text/csv')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.content(resp).splitlines(), [
+            'id,lat,lon,geo_ids',
+            'a,1.0,2.0,point-2.0-1.0',
+            ',3.0,4.0,point-4.0-3.0',
+            'c,5.0,6.0,point-6.0-5.0',
+        ])
+
+    def test_malformed(self):
+        for body in ['not json', '{"lat": 1, "lon": 2}', '[[1]]', '[{"lat": 1}]', '[["a", 2]]', '[5]']:
+            self.assertEqual(self.post(body).status_code, 400, body)
+
+        for body in ['id,lat\r\na,1\r\n', 'lat,lon\r\n1,x\r\n']:
+            self.assertEqual(self.post(body, content_type='text/csv').status_code, 400, body)
+
+        self.assertFalse(self.geo_data.get_geoids_from_coords.called)
+
+    def test_max_points(self):
+        self.assertEqual(self.post(json.dumps([[1, 2]] * 4)).status_code, 400)
+        self.assertFalse(self.geo_data.get_geoids_from_coords.called)
+
+        resp = self.post(json.dumps([[1, 2]] * 3))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(json.loads(self.content(resp))['results']), 3)
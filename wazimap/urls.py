@@ -4,13 +4,14 @@ from django.contrib import admin
 from django.urls import reverse_lazy
 from django.http import HttpResponse
 from django.views.decorators.cache import cache_page
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import RedirectView, TemplateView
 
 from census.views import HealthcheckView, DataView, ExampleView
 
-from wazimap.views import (HomepageView, GeographyDetailView, GeographyJsonView, PlaceSearchJson,
-                           LocateView, DataAPIView, TableAPIView, AboutView, HelpView, GeographyCompareView,
-                           GeoAPIView, TableDetailView)
+from wazimap.views import (HomepageView, GeographyDetailView, GeographyJsonView, PlaceSearchJson, BatchPlaceSearchView,
+                           LocateView, DataAPIView, DataTimeSeriesView, TableAPIView, AboutView, HelpView,
+                           GeographyCompareView, GeoAPIView, TableDetailView)
 
 
 #admin.autodiscover()
@@ -93,6 +94,14 @@ urlpatterns = [
         name    = 'api_download_data',
     ),
 
+    # time series API
+    url(
+        regex   = '^api/1.0/data/timeseries$',
+        view    = cache_page(STANDARD_CACHE_TIME)(DataTimeSeriesView.as_view()),
+        kwargs  = {},
+        name    = 'api_data_timeseries',
+    ),
+
     # table search API
     url(
         regex   = '^api/1.0/table$',
@@ -231,6 +240,13 @@ urlpatterns = [
         name    = 'place_search_json',
     ),
 
+    url(
+        regex   = '^place-search/batch/$',
+        view    = csrf_exempt(BatchPlaceSearchView.as_view()),
+        kwargs  = {},
+        name    = 'place_search_batch',
+    ),
+
     # LOCAL DEV VERSION OF API ##
     # url(
     #     regex   = '^geo-search/$',
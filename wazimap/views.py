@@ -1,4 +1,6 @@
 from itertools import chain
+import csv
+import io
 import json
 import urllib
 
@@ -6,7 +8,7 @@ from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.safestring import SafeString
 from django.utils.module_loading import import_string
-from django.http import HttpResponse, Http404, HttpResponseBadRequest
+from django.http import HttpResponse, Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.generic import View, TemplateView
 from django.shortcuts import redirect
 
@@ -15,9 +17,9 @@ from census.views import GeographyDetailView as BaseGeographyDetailView, LocateV
 from wazimap.geo import geo_data, LocationNotFound
 from wazimap.profiles import enhance_api_data
 from wazimap.data.tables import get_datatable
-from wazimap.data.utils import dataset_context, get_page_releases
+from wazimap.data.utils import dataset_context, get_page_releases, geo_sort_key
 from wazimap.data.download import DownloadManager
-from wazimap.models import FieldTable, SimpleTable
+from wazimap.data.registry import get_registry
 
 
 def render_json_error(message, status_code=400):
@@ -150,6 +152,98 @@ class PlaceSearchJson(View):
             return HttpResponseBadRequest('"q" or "coords" parameter is required')
 
 
+class BatchPlaceSearchView(View):
+    """
+    Finds the geographies containing each of many points, which are POSTed as JSON or CSV.
+
+    JSON is a list of points, each either a [lat, lon] list or an object with
+    "lat" and "lon" keys and an optional "id". CSV must have a header row with lat
+    and lon columns, and an optional id column.
+
+    Results are streamed back in the same format, in the same order: each point
+    with the geo ids of the geographies containing it, from the root level down.
+    The ``geolevels`` and ``geo_version`` parameters work like those of `PlaceSearchJson`.
+    """
+    # points are looked up in batches of this size
+    BATCH_SIZE = 1000
+    MAX_POINTS = 100000
+
+    def post(self, request, *args, **kwargs):
+        geo_levels = request.GET.get('geolevels', None)
+        self.geo_version = request.GET.get('geo_version', None)
+        if geo_levels:
+            geo_levels = [lev.strip() for lev in geo_levels.split(',')]
+            geo_levels = [lev for lev in geo_levels if lev] or None
+        self.geo_levels = geo_levels
+
+        is_csv = request.content_type in ('text/csv', 'application/csv')
+        try:
+            points = self.read_csv(request) if is_csv else self.read_json(request)
+        except (ValueError, KeyError, TypeError) as e:
+            return HttpResponseBadRequest('bad points: %s' % e)
+
+        if len(points) > self.MAX_POINTS:
+            return HttpResponseBadRequest('too many points, the maximum is %d' % self.MAX_POINTS)
+
+        if is_csv:
+            response = StreamingHttpResponse(self.stream_csv(points), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(self.stream_json(points), content_type='application/json')
+        return response
+
+    def read_json(self, request):
+        data = json.loads(request.body.decode('utf-8'))
+        if not isinstance(data, list):
+            raise ValueError('expected a list of points')
+
+        points = []
+        for point in data:
+            if isinstance(point, dict):
+                points.append((point.get('id'), float(point['lat']), float(point['lon'])))
+            else:
+                lat, lon = point
+                points.append((None, float(lat), float(lon)))
+        return points
+
+    def read_csv(self, request):
+        reader = csv.DictReader(io.StringIO(request.body.decode('utf-8-sig')))
+        return [(row.get('id'), float(row['lat']), float(row['lon'])) for row in reader]
+
+    def results(self, points):
+        """ Yields a (point, geo ids) tuple for each point, in order.
+        """
+        for i in range(0, len(points), self.BATCH_SIZE):
+            batch = points[i:i + self.BATCH_SIZE]
+            geo_ids = geo_data.get_geoids_from_coords(
+                [(lon, lat) for id, lat, lon in batch], levels=self.geo_levels, version=self.geo_version)
+            for point, ids in zip(batch, geo_ids):
+                yield point, ids
+
+    def stream_json(self, points):
+        yield '{"results": ['
+        for i, ((id, lat, lon), geo_ids) in enumerate(self.results(points)):
+            result = {'lat': lat, 'lon': lon, 'geo_ids': geo_ids}
+            if id is not None:
+                result['id'] = id
+            yield (',' if i else '') + json.dumps(result)
+        yield ']}'
+
+    def stream_csv(self, points):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        def flush():
+            data = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return data
+
+        writer.writerow(['id', 'lat', 'lon', 'geo_ids'])
+        for (id, lat, lon), geo_ids in self.results(points):
+            writer.writerow([id or '', lat, lon, ' '.join(geo_ids)])
+            yield flush()
+
+
 class LocateView(BaseLocateView):
     def get_context_data(self, *args, **kwargs):
         page_context = {}
@@ -251,7 +345,7 @@ class DataAPIView(View):
             response.status_code = 400
             return response
 
-        data = self.get_data(self.data_geos, self.tables)
+        data = self.stream_data(self.data_geos, self.tables)
         columns = {table.name: table.columns(release=self.release) for table in self.tables}
 
         content, fname, mime_type = mgr.generate_download_bundle(self.tables, self.data_geos, self.geo_ids, self.release, columns, data, fmt)
@@ -303,15 +397,77 @@ class DataAPIView(View):
 
         return data
 
+    def stream_data(self, geos, tables):
+        """ Stream data for +geos+ from each of +tables+.
+
+        Yields a (geo, data) tuple for each geo, ordered by `geo_sort_key`,
+        where data is like the values of the dict returned by `get_data`.
+        """
+        geos = sorted(geos, key=geo_sort_key)
+        streams = [(table.name.upper(), table.iter_raw_data_for_geos(geos)) for table in tables]
+        heads = [next(stream, None) for name, stream in streams]
+
+        for geo in geos:
+            data = {}
+            for i, (name, stream) in enumerate(streams):
+                # skip past geos we've already handled
+                while heads[i] and geo_sort_key(geo) > tuple(heads[i][0].split('-', 1)):
+                    heads[i] = next(stream, None)
+
+                if heads[i] and heads[i][0] == geo.geoid:
+                    data[name] = heads[i][1]
+                else:
+                    data[name] = {'estimate': {}, 'error': {}}
+            yield geo, data
+
+
+class DataTimeSeriesView(DataAPIView):
+    """
+    View that provides the values of a table for several releases, for one or more geographies.
+
+    An example call:
+
+    /api/1.0/data/timeseries?table_id=POPULATIONGROUP&geo_ids=country-ZA,province-WC&years=2011,2016
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.geo_ids = request.GET.get('geo_ids', '').split(',')
+            geo_version = request.GET.get('geo_version', None)
+            self.data_geos, self.info_geos = self.get_geos(self.geo_ids, geo_version)
+        except LocationNotFound as e:
+            return render_json_error(str(e), 404)
+
+        table_id = request.GET.get('table_id', '')
+        table = get_datatable(table_id)
+        if not table:
+            return render_json_error('Unknown table: %s' % table_id, 404)
+
+        fields = request.GET.get('fields')
+        years = request.GET.get('years')
+
+        try:
+            series = table.get_time_series(
+                self.data_geos,
+                fields=fields.split(',') if fields else None,
+                years=years.split(',') if years else None)
+        except ValueError as e:
+            return render_json_error(str(e), 400)
+
+        return render_json_to_response({
+            'table': table.as_dict(),
+            'years': series['years'],
+            'data': series['geos'],
+            'geography': dict((g.geoid, g.as_dict()) for g in chain(self.data_geos, self.info_geos)),
+        })
+
 
 class TableAPIView(View):
     """
     View that lists data tables.
     """
     def get(self, request, *args, **kwargs):
-        return render_json_to_response([
-            t.as_dict() for t in chain(SimpleTable.objects.all(), FieldTable.objects.all())
-        ])
+        return render_json_to_response([t.as_dict() for t in get_registry().tables])
 
 
 class AboutView(TemplateView):
@@ -13,3 +13,7 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wazimap.settings")
 application = get_wsgi_application()
+
+# load geometry before a server such as gunicorn --preload forks its workers
+from wazimap.geo import preload_geometry  # noqa
+preload_geometry()